@@ -3,12 +3,8 @@
 from fastapi import FastAPI, Response
 from fastapi import Request as fast_request, HTTPException
 from fastapi.responses import JSONResponse, RedirectResponse
-from firebase_admin import initialize_app
-from firebase_admin import credentials
-from firebase_admin import firestore
-import json
 
-from utils.firebase_handlers import dashboard_data, user_handler
+from utils.firebase_handlers import dashboard_data, user_handler, seed_counters
 from utils.telegram_handlers import (
     send_msg,
     edit_msg,
@@ -29,7 +25,27 @@ from utils.chat_handlers import (
     chat_handler,
 )
 from utils.gcal_events import link_handler, unlink_handler, first_signin
-from config import return_flow, FIREBASE_TOKEN
+from utils.image_processing import shutdown_image_pool
+from utils.gemini_models import model_usage_snapshot
+from utils.metrics import snapshot, loop_lag_monitor
+from utils.usage_counter import usage_flusher, flush_uses, user_uses
+from utils.retention import retention_job
+from utils.token_manager import token_refresh_job, expiry_timestamp
+from utils.user_context import user_context, user_context_data, user_context_flush
+from utils.model_scheduler import scheduler_state
+from utils.session_cache import (
+    session_get,
+    session_put,
+    session_flusher,
+    session_flush_all,
+)
+from utils.storage import storage_client
+from utils.storage_metrics import (
+    storage_update_begin,
+    storage_update_tag,
+    storage_update_end,
+)
+from config import return_flow, STORAGE_BACKEND, ADMIN_TOKEN
 
 import httpx
 import asyncio
@@ -38,12 +54,9 @@ app = FastAPI()
 
 db = None
 try:
-    fire_creds = json.loads(FIREBASE_TOKEN)
-    cred = credentials.Certificate(fire_creds)
-    fapp = initialize_app(cred)
-    db = firestore.client()
+    db = storage_client()
 except Exception as e:
-    print(f"Error while connecting to firestore \n{e}")
+    print(f"Error while connecting to {STORAGE_BACKEND} \n{e}")
 
 session = httpx.AsyncClient()
 queue = asyncio.Queue()
@@ -65,15 +78,36 @@ async def process_queue():
             queue.task_done()
 
 
+@app.on_event("startup")
+async def startup():
+    """Seeds the counters, then starts the flushers, the retention and token refresh jobs and the loop lag monitor."""
+    # the counters are seeded before any update can add to their shards
+    await seed_counters(db)
+    asyncio.create_task(session_flusher(db))
+    asyncio.create_task(usage_flusher(db))
+    asyncio.create_task(retention_job(db))
+    asyncio.create_task(token_refresh_job(db, session))
+    asyncio.create_task(loop_lag_monitor())
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Flushes cached chat sessions and usage counts and releases resources on shutdown."""
+    await session_flush_all(db)
+    await flush_uses(db)
+    shutdown_image_pool()
+    await session.aclose()
+
+
 @app.get("/api/get_counts")
-def get_counts():
+async def get_counts():
     """Endpoint to retrieve dashboard data (user, message, and event counts).
 
     Returns:
         fastapi.responses.JSONResponse: A JSON response containing event, message,
                                           and user counts.
     """
-    result = dashboard_data(db)
+    result = await dashboard_data(db)
     output = {
         "event_count": result[2],
         "message_count": result[1],
@@ -82,6 +116,36 @@ def get_counts():
     return JSONResponse(content=output)
 
 
+@app.get("/api/admin/stats")
+async def admin_stats(request: fast_request, chat_id: int = None):
+    """Admin endpoint exposing model token usage and the in-memory metrics.
+
+    Requires the X-Admin-Token header to match the ADMIN_TOKEN environment variable.
+
+    Args:
+        request (fastapi.Request): The incoming FastAPI request object.
+        chat_id (int, optional): If given, only the model usage of that chat is
+                                 returned (needs MODEL_USAGE_PER_CHAT), along
+                                 with the number of uses of that chat.
+
+    Returns:
+        fastapi.responses.JSONResponse: Model usage per model and call site, the
+                                          counters and observations, and the
+                                          model scheduler state.
+    """
+    if not ADMIN_TOKEN or request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    output = {
+        "model_usage": model_usage_snapshot(chat_id),
+        "metrics": snapshot(),
+        "model_scheduler": scheduler_state(),
+    }
+    if chat_id is not None:
+        output["no_of_uses"] = await user_uses(db, chat_id)
+    return JSONResponse(content=output)
+
+
 @app.get("/")
 def website_return():
     """Serves the TimeSked website HTML content."""
@@ -123,8 +187,13 @@ async def oauth_callback(request: fast_request):
 
         access_token = flow.credentials.token
         refresh_token = flow.credentials.refresh_token
+        token_expiry = expiry_timestamp(flow.credentials.expiry)
 
-        asyncio.create_task(first_signin(db, chat_id, access_token, refresh_token))
+        asyncio.create_task(
+            first_signin(
+                db, session, chat_id, access_token, refresh_token, token_expiry
+            )
+        )
 
         success_msg = "Your account has been successfully linked, and a dedicated calendar has been set up. All your events will land right there. 🎯🗓️"
         await send_msg(session, chat_id, None, success_msg, None, None)
@@ -166,27 +235,47 @@ async def index(request: fast_request):
             chat_id = msg["message"]["chat"]["id"]
             received_message_id = msg["message"]["message_id"]
             sent_message_id = None
+            storage_token = storage_update_begin(
+                "photo" if "photo" in msg["message"] else "text"
+            )
+            # the user's document is read at most once for the whole update
+            context = user_context(db, chat_id)
             try:
                 if "photo" in msg["message"]:
                     asyncio.create_task(send_typing_action(session, chat_id))
                     await photo_logic(
-                        db, session, msg, chat_id, received_message_id, queue
+                        db, session, msg, chat_id, received_message_id, queue, context
                     )
 
                 elif "text" in msg["message"]:
                     asyncio.create_task(send_typing_action(session, chat_id))
                     user_message = msg["message"]["text"]
 
-                    col_ref = db.collection("user_records")
-                    doc_ref = col_ref.document(str(chat_id))
-                    doc = doc_ref.get()
+                    # users in chat mode are served from the session cache
+                    cached = session_get(chat_id)
                     position = None
                     calendar_id = None
+                    # whether the chat session was read from storage
+                    resumed = False
+
+                    if cached:
+                        position = cached["position"]
+                    else:
+                        doc = await user_context_data(context)
+
+                        if context["exists"]:
+                            position = doc["position"]
+                            calendar_id = doc["calendar_id"]
 
-                    if doc.exists:
-                        doc = doc.to_dict()
-                        position = doc["position"]
-                        calendar_id = doc["calendar_id"]
+                            if position == "CHATTING":
+                                chat_session = await chat_history_retriever(
+                                    db, chat_id, doc
+                                )
+                                if chat_session is not None:
+                                    cached = session_put(
+                                        chat_id, position, chat_session
+                                    )
+                                resumed = True
 
                     if not position:
                         match user_message:
@@ -201,13 +290,13 @@ async def index(request: fast_request):
                                 )
 
                             case "/chat":
-                                await search_handler(db, session, chat_id)
+                                await search_handler(db, session, chat_id, context)
 
                             case "/linkcalendar":
                                 await link_handler(session, chat_id, calendar_id)
 
                             case "/unlinkcalendar":
-                                await unlink_handler(db, session, chat_id)
+                                await unlink_handler(db, session, chat_id, context)
 
                             case "/cancel":
                                 await send_msg(
@@ -225,6 +314,7 @@ async def index(request: fast_request):
                                     chat_id,
                                     received_message_id,
                                     queue,
+                                    context,
                                 )
 
                     else:
@@ -234,20 +324,26 @@ async def index(request: fast_request):
                                     db,
                                     session,
                                     chat_id,
+                                    context,
                                     msg["message"]["text"],
                                     "DELETING",
                                 )
 
                             case "CHATTING":
+                                storage_update_tag("chat_resume" if resumed else "chat")
                                 if user_message == "/cancel":
                                     await cancel_handler(db, session, chat_id)
                                 else:
-                                    prev_msgs = chat_history_retriever(db, chat_id)
+                                    chat_session = (
+                                        cached["chat_session"]
+                                        if cached
+                                        else await chat_history_retriever(db, chat_id)
+                                    )
                                     await chat_handler(
                                         db,
                                         session,
                                         chat_id,
-                                        prev_msgs,
+                                        chat_session,
                                         user_message,
                                         received_message_id,
                                     )
@@ -274,15 +370,28 @@ async def index(request: fast_request):
                 print(f"Error processing message: {e}")
 
             finally:
-                user_handler(db, msg)
+                await user_handler(db, msg, context)
+                await user_context_flush(context)
                 await queue.join()
+                storage_update_end(storage_token)
                 return {"ok": True}
 
         elif "callback_query" in msg:
+            storage_token = storage_update_begin("callback")
+            context = None
             try:
-                await handle_callback_query(db, session, msg["callback_query"], queue)
+                chat_id = msg["callback_query"]["message"]["chat"]["id"]
+                context = user_context(db, chat_id)
+                await handle_callback_query(
+                    db, session, msg["callback_query"], queue, context
+                )
             except Exception as e:
                 print(f"Error while handling callback query \n {e}")
+            finally:
+                # changes made before a failure are written too
+                if context is not None:
+                    await user_context_flush(context)
+                storage_update_end(storage_token)
 
         else:
             print("Message format not recognized, Neither message nor callback query")
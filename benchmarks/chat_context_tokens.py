@@ -0,0 +1,53 @@
+"""Compares the chat context token counts of the old repr dump and the compact table.
+
+For every user in user_records (or the first N users), the upcoming events are
+serialized both as the Python repr that chat mode used to send and as the
+compact table, and the tokens of each are counted with the chat model.
+
+Usage:
+    python benchmarks/chat_context_tokens.py [max_users]
+"""
+
+import sys
+import os
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import chat_model  # noqa: E402
+from utils.storage import storage_client  # noqa: E402
+from utils.firebase_handlers import retrieve_upcoming_events  # noqa: E402
+from utils.chat_handlers import compact_event_table  # noqa: E402
+
+
+async def run(max_users):
+    db = storage_client()
+
+    old_total = 0
+    new_total = 0
+    users = 0
+    for doc in await db.collection("user_records").limit(max_users).get():
+        result = await retrieve_upcoming_events(db, doc.to_dict()["chat_id"])
+        if not isinstance(result, list):
+            continue
+
+        old_context = f"{result} This list contains the details about the upcoming events of the user."
+        new_context, _ = compact_event_table(result)
+
+        old_tokens = chat_model.count_tokens(old_context).total_tokens
+        new_tokens = chat_model.count_tokens(new_context).total_tokens
+        old_total += old_tokens
+        new_total += new_tokens
+        users += 1
+        print(f"{len(result):>3} events : {old_tokens:>6} -> {new_tokens:>6} tokens")
+
+    if users:
+        print(
+            f"\n{users} users, average {old_total / users:.0f} -> "
+            f"{new_total / users:.0f} tokens per chat turn "
+            f"({1 - new_total / old_total:.1%} saved)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
@@ -0,0 +1,80 @@
+"""Compares event loop lag under the synchronous and the async Firestore client.
+
+Simulates concurrent users by reading the user_records documents of the first
+N users (each read followed by a message_log style query) from many tasks at
+once. It does this once with the synchronous client, called from coroutines as
+the handlers used to, and once with the async client. For both runs it reports
+the wall time and the event loop lag seen by utils.metrics.loop_lag_monitor.
+
+Usage:
+    python benchmarks/firestore_loop_lag.py [users]
+"""
+
+import sys
+import os
+import json
+import time
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from firebase_admin import (  # noqa: E402
+    initialize_app,
+    credentials,
+    firestore,
+    firestore_async,
+)
+from google.cloud.firestore_v1.base_query import FieldFilter  # noqa: E402
+
+from config import FIREBASE_TOKEN  # noqa: E402
+from utils.metrics import loop_lag_monitor, observations  # noqa: E402
+
+
+async def sync_turn(db, chat_id):
+    db.collection("user_records").document(str(chat_id)).get()
+    db.collection("message_log").where(
+        filter=FieldFilter("chat_id", "==", chat_id)
+    ).limit(5).get()
+
+
+async def async_turn(db, chat_id):
+    await db.collection("user_records").document(str(chat_id)).get()
+    await db.collection("message_log").where(
+        filter=FieldFilter("chat_id", "==", chat_id)
+    ).limit(5).get()
+
+
+async def measure(label, turn, db, chat_ids):
+    observations.pop("event_loop_lag", None)
+    monitor = asyncio.create_task(loop_lag_monitor(0.05))
+    await asyncio.sleep(0.1)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(turn(db, chat_id) for chat_id in chat_ids))
+    duration = time.perf_counter() - start
+
+    await asyncio.sleep(0.1)
+    monitor.cancel()
+
+    lag = observations.get("event_loop_lag", {"count": 1, "total": 0, "max": 0})
+    print(
+        f"{label:>6} : {duration:6.2f}s for {len(chat_ids)} users, loop lag "
+        f"average {lag['total'] / lag['count'] * 1000:7.1f}ms, "
+        f"max {lag['max'] * 1000:7.1f}ms"
+    )
+
+
+async def run(users):
+    initialize_app(credentials.Certificate(json.loads(FIREBASE_TOKEN)))
+    sync_db = firestore.client()
+    async_db = firestore_async.client()
+
+    docs = sync_db.collection("user_records").select(["chat_id"]).limit(users).get()
+    chat_ids = [doc.get("chat_id") for doc in docs]
+
+    await measure("sync", sync_turn, sync_db, chat_ids)
+    await measure("async", async_turn, async_db, chat_ids)
+
+
+if __name__ == "__main__":
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 50))
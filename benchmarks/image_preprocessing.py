@@ -0,0 +1,113 @@
+"""Benchmarks the image preprocessing settings over a corpus of event posters.
+
+The corpus directory must contain the poster images along with an
+``expected.json`` file that maps every image file name to the events it
+contains, as a list of ``[event name, start date (YYYY-MM-DD)]`` pairs.
+
+For every combination of long edge, JPEG quality and border trimming, the
+script reports the average bytes sent to Gemini, the average preprocessing and
+extraction latency, and the fraction of expected events that were extracted.
+
+Usage:
+    python benchmarks/image_preprocessing.py path/to/corpus
+"""
+
+import sys
+import os
+import json
+import time
+import itertools
+import asyncio
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils.image_processing import preprocess_image  # noqa: E402
+from utils.gemini_models import prompter  # noqa: E402
+from utils.data_validation import process_events  # noqa: E402
+
+MAX_EDGES = [512, 768, 1024, 1280, 1600]
+QUALITIES = [60, 75, 85]
+TRIM_BORDERS = [False, True]
+
+
+def matched_events(expected, extracted):
+    """Counts how many of the expected events are present in the extracted events.
+
+    An expected event is matched when an extracted event has the same start date
+    and either name contains the other (case insensitive).
+
+    Args:
+        expected (list): List of [name, start_date] pairs.
+        extracted (list): Output of process_events.
+
+    Returns:
+        int: Number of expected events that were matched.
+    """
+    matches = 0
+    for name, start_date in expected:
+        for event in extracted:
+            if not isinstance(event, list):
+                continue
+            extracted_name = event[0].lower()
+            if event[1] == start_date and (
+                name.lower() in extracted_name or extracted_name in name.lower()
+            ):
+                matches += 1
+                break
+    return matches
+
+
+def run(corpus_dir):
+    with open(os.path.join(corpus_dir, "expected.json"), "r") as f:
+        expected = json.load(f)
+
+    posters = {}
+    for file_name in expected:
+        with open(os.path.join(corpus_dir, file_name), "rb") as f:
+            posters[file_name] = f.read()
+
+    total_expected = sum(len(events) for events in expected.values())
+    original_bytes = sum(len(data) for data in posters.values()) / len(posters)
+    print(f"{len(posters)} posters, {total_expected} expected events")
+    print(f"Average original size : {original_bytes / 1024:.1f} KiB\n")
+    print(
+        f"{'edge':>5} {'quality':>7} {'trim':>5} {'KiB sent':>9} "
+        f"{'prep ms':>8} {'extract s':>9} {'accuracy':>8}"
+    )
+
+    for max_edge, quality, trim in itertools.product(
+        MAX_EDGES, QUALITIES, TRIM_BORDERS
+    ):
+        bytes_sent = 0
+        prep_time = 0.0
+        extract_time = 0.0
+        matches = 0
+
+        for file_name, image_bytes in posters.items():
+            start = time.perf_counter()
+            processed = preprocess_image(image_bytes, max_edge, quality, trim)
+            prep_time += time.perf_counter() - start
+            bytes_sent += len(processed)
+
+            blob = {"mime_type": "image/jpeg", "data": processed}
+            start = time.perf_counter()
+            unprocessed_events = asyncio.run(prompter("image", blob))
+            extract_time += time.perf_counter() - start
+
+            if isinstance(unprocessed_events, list):
+                events = process_events(unprocessed_events)
+                matches += matched_events(expected[file_name], events)
+
+        count = len(posters)
+        print(
+            f"{max_edge:>5} {quality:>7} {str(trim):>5} "
+            f"{bytes_sent / count / 1024:>9.1f} {prep_time / count * 1000:>8.1f} "
+            f"{extract_time / count:>9.2f} {matches / total_expected:>8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print(__doc__)
+        sys.exit(1)
+    run(sys.argv[1])
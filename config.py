@@ -27,11 +27,103 @@ def return_flow():
 
 TOKEN = os.environ.get("TIMESKED_TOKEN")
 FIREBASE_TOKEN = os.environ.get("FIREBASE")
+
+# "firestore", or "sqlite" for a local database at SQLITE_PATH
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "firestore")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "timesked.db")
+# Counts the storage operations of every update, see utils/storage_metrics.py
+STORAGE_INSTRUMENTATION = (
+    os.environ.get("STORAGE_INSTRUMENTATION", "true").lower() == "true"
+)
+
 weather_api_key = os.environ.get("WEATHER_API_KEY")
 
 CAL_CLIENT_ID = os.environ.get("CAL_CLIENT_ID")
 CAL_CLIENT_SECRET = os.environ.get("CAL_CLIENT_SECRET")
 
+# Google Calendar API requests, retried on 429 and 5xx up to CALENDAR_MAX_ATTEMPTS
+# times, batch requests hold up to CALENDAR_BATCH_SIZE calls (at most 50)
+CALENDAR_MAX_ATTEMPTS = int(os.environ.get("CALENDAR_MAX_ATTEMPTS", 4))
+CALENDAR_BATCH_SIZE = int(os.environ.get("CALENDAR_BATCH_SIZE", 50))
+
+# Google access tokens are cached in memory and refreshed in the background
+# TOKEN_REFRESH_AHEAD seconds before they expire. A request only waits for a
+# refresh once less than TOKEN_EXPIRY_MARGIN seconds are left. Every
+# TOKEN_REFRESH_INTERVAL seconds, the tokens of the users active in the last
+# TOKEN_ACTIVE_WINDOW seconds are refreshed ahead of time as well.
+TOKEN_CACHE_MAX_USERS = int(os.environ.get("TOKEN_CACHE_MAX_USERS", 2000))
+TOKEN_REFRESH_AHEAD = float(os.environ.get("TOKEN_REFRESH_AHEAD", 300))
+TOKEN_EXPIRY_MARGIN = float(os.environ.get("TOKEN_EXPIRY_MARGIN", 30))
+TOKEN_REFRESH_INTERVAL = float(os.environ.get("TOKEN_REFRESH_INTERVAL", 60))
+TOKEN_ACTIVE_WINDOW = float(os.environ.get("TOKEN_ACTIVE_WINDOW", 900))
+
+# Image preprocessing before the photo is sent to Gemini
+IMAGE_MAX_EDGE = int(os.environ.get("IMAGE_MAX_EDGE", 1280))
+IMAGE_JPEG_QUALITY = int(os.environ.get("IMAGE_JPEG_QUALITY", 80))
+IMAGE_TRIM_BORDERS = os.environ.get("IMAGE_TRIM_BORDERS", "true").lower() == "true"
+IMAGE_POOL_WORKERS = int(os.environ.get("IMAGE_POOL_WORKERS", 2))
+
+# Smallest Telegram photo size (in pixels) that is tried first for extraction
+PHOTO_PIXEL_BUDGET = int(os.environ.get("PHOTO_PIXEL_BUDGET", 600_000))
+PHOTO_MAX_ESCALATIONS = int(os.environ.get("PHOTO_MAX_ESCALATIONS", 2))
+
+# Minimum number of seconds between two edits of a streamed chat reply
+CHAT_STREAM_EDIT_INTERVAL = float(os.environ.get("CHAT_STREAM_EDIT_INTERVAL", 1.0))
+
+# Token accounting, exposed on the admin endpoints guarded by ADMIN_TOKEN
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+MODEL_USAGE_PER_CHAT = os.environ.get("MODEL_USAGE_PER_CHAT", "false").lower() == "true"
+
+# Shared Gemini call scheduler, MODEL_RPM = 0 disables the per-minute budget
+MODEL_MAX_CONCURRENCY = int(os.environ.get("MODEL_MAX_CONCURRENCY", 4))
+MODEL_RPM = int(os.environ.get("MODEL_RPM", 0))
+
+# Chat mode sends the latest CHAT_WINDOW_MESSAGES messages, older ones are folded
+# into a rolling summary once CHAT_SUMMARY_BATCH of them have piled up
+CHAT_WINDOW_MESSAGES = int(os.environ.get("CHAT_WINDOW_MESSAGES", 8))
+CHAT_SUMMARY_BATCH = int(os.environ.get("CHAT_SUMMARY_BATCH", 6))
+
+# Per-user event search index used to pick relevant events for chat questions
+EVENT_INDEX_TOP_K = int(os.environ.get("EVENT_INDEX_TOP_K", 5))
+EVENT_INDEX_MAX_USERS = int(os.environ.get("EVENT_INDEX_MAX_USERS", 500))
+
+# Function calling chat mode, the model queries the events it needs through tools
+CHAT_TOOLS_ENABLED = os.environ.get("CHAT_TOOLS_ENABLED", "true").lower() == "true"
+CHAT_MAX_TOOL_ROUNDS = int(os.environ.get("CHAT_MAX_TOOL_ROUNDS", 3))
+
+# Chat sessions are kept in memory while the user is chatting, pending turns are
+# written every SESSION_FLUSH_INTERVAL seconds and idle sessions dropped after SESSION_TTL
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", 10))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 900))
+
+# no_of_uses increments are buffered and written every USAGE_FLUSH_INTERVAL
+# seconds, or as soon as USAGE_MAX_PENDING users have pending increments
+USAGE_FLUSH_INTERVAL = float(os.environ.get("USAGE_FLUSH_INTERVAL", 30))
+USAGE_MAX_PENDING = int(os.environ.get("USAGE_MAX_PENDING", 400))
+
+# Attempts for every batch of Firestore writes before giving up
+FIRESTORE_WRITE_ATTEMPTS = int(os.environ.get("FIRESTORE_WRITE_ATTEMPTS", 3))
+
+# Events per page of /viewevents
+EVENTS_PAGE_SIZE = int(os.environ.get("EVENTS_PAGE_SIZE", 10))
+
+# In-memory view of each user's upcoming events, serving /viewevents and chat setup
+UPCOMING_VIEW_MAX_USERS = int(os.environ.get("UPCOMING_VIEW_MAX_USERS", 2000))
+UPCOMING_VIEW_MAX_EVENTS = int(os.environ.get("UPCOMING_VIEW_MAX_EVENTS", 200))
+
+# Sharded counters for the global totals and per-user usage, read values are
+# cached for COUNTER_CACHE_TTL seconds
+COUNTER_SHARDS = int(os.environ.get("COUNTER_SHARDS", 10))
+COUNTER_CACHE_TTL = float(os.environ.get("COUNTER_CACHE_TTL", 60))
+
+# message_log entries and events older than their window are archived to
+# RETENTION_ARCHIVE_DIR (deleted without archive if empty) every RETENTION_INTERVAL seconds
+MESSAGE_LOG_RETENTION_DAYS = int(os.environ.get("MESSAGE_LOG_RETENTION_DAYS", 180))
+EVENT_RETENTION_DAYS = int(os.environ.get("EVENT_RETENTION_DAYS", 365))
+RETENTION_BATCH_SIZE = int(os.environ.get("RETENTION_BATCH_SIZE", 400))
+RETENTION_INTERVAL = float(os.environ.get("RETENTION_INTERVAL", 86400))
+RETENTION_ARCHIVE_DIR = os.environ.get("RETENTION_ARCHIVE_DIR", "archives")
+
 genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
 
 generation_config = {
@@ -51,10 +143,18 @@ img_model = genai.GenerativeModel(
     system_instruction="All the details must strictly be from the context of the message. You can be creative within the details mentioned, but do not add information yourself. NEVER CREATE ANY EVENTS THAT ISNT PRESENT IN THE DATA GIVEN TO YOU. If the message does not contain details about any events and isnt related to events, then respond with an empty list [], else in all cases the output should be a nested list and each nested list must always contain 7 elements. An event can be considered valid only if it has both an event name and a starting date, if not then you should respond with an empty list.",
 )
 
+# how the chat model gets to the events, through the tools or as tables in the conversation
+if CHAT_TOOLS_ENABLED:
+    chat_events_instruction = "You do not see the user's events up front, look them up with the tools whenever a question needs them instead of guessing. list_events lists the events starting between two dates, search_events searches all of the user's events, past and upcoming, by keywords, and get_event_details returns every detail of an event by the ref (like E1) the other two tools gave it. Refs are only for the tools, never show them to the user. The link returned by get_event_details is a short alias (like T1) of the google calendar event link and the link that might be present in the description is the registration link. When sharing a google calendar event link, write the alias exactly as given, for example [Event Link](T1)."
+else:
+    chat_events_instruction = "You will be provided with event details as a table with one event per line, the link column holds a short alias (like L1 or R1) of the google calendar event link and the link that might be present in the description is the registration link. When sharing a google calendar event link, write the alias exactly as given, for example [Event Link](L1)."
+
 chat_model = genai.GenerativeModel(
     model_name="gemini-1.5-flash-latest",
     generation_config={"temperature": 0.5},
-    system_instruction="You are a Telegram chatbot. Your purpose is to assist users with their upcoming events. You will be provided with event details, the link provided in the link section is the google calendar event link and the link that might be present in the description is the registration link. Respond to user queries based strictly on the provided information. Avoid answering questions unrelated to these events or making assumptions not explicitly stated in the data. You are allowed to format your output such that it is more readable to the user such as converting dates to dd-month-year format and time to 12 hour format. Strictly follow MarkdownV2 Telegram API friendly formatting to make it more readable. All entities opened must be closed properly. If the user asks on how to exit chat mode, ask the user to send the /cancel command.",
+    system_instruction="You are a Telegram chatbot. Your purpose is to assist users with their upcoming events. "
+    + chat_events_instruction
+    + " Respond to user queries based strictly on the provided information. Avoid answering questions unrelated to these events or making assumptions not explicitly stated in the data. You are allowed to format your output such that it is more readable to the user such as converting dates to dd-month-year format and time to 12 hour format. Strictly follow MarkdownV2 Telegram API friendly formatting to make it more readable. All entities opened must be closed properly. If the user asks on how to exit chat mode, ask the user to send the /cancel command.",
 )
 
 
@@ -0,0 +1,369 @@
+"""Fixtures running the bot's real handlers against local stand-ins.
+
+Storage is a fresh SQLite database per test (STORAGE_BACKEND=sqlite), with
+the storage instrumentation on. Every call of the shared httpx client
+(Telegram, Google Calendar, OAuth, geocoding and weather) is answered by the
+in-memory fakes below through httpx.MockTransport, and the Gemini extraction
+is replaced by canned results. Nothing leaves the machine.
+"""
+
+import os
+import re
+import sys
+import json
+import random
+import asyncio
+import datetime
+import itertools
+import tempfile
+from urllib.parse import unquote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(tempfile.mkdtemp(), "tests.db")
+os.environ["STORAGE_INSTRUMENTATION"] = "true"
+os.environ.setdefault("TIMESKED_TOKEN", "test-token")
+
+import httpx  # noqa: E402
+import pytest  # noqa: E402
+
+EVENTS_PATH = re.compile(r"^/calendar/v3/calendars/([^/]+)/events(?:/([^/]+))?$")
+chat_ids = itertools.count(10_000)
+
+
+def new_chat_id():
+    """Returns a chat ID no other test used, the caches of the process are shared."""
+    return next(chat_ids)
+
+
+def day(offset):
+    """Returns the date offset days from today, as YYYY-MM-DD."""
+    return (datetime.date.today() + datetime.timedelta(days=offset)).strftime(
+        "%Y-%m-%d"
+    )
+
+
+class FakeTelegram:
+    """Answers the Bot API calls of the handlers and records them."""
+
+    def __init__(self):
+        self.calls = []
+        self.message_ids = itertools.count(1000)
+
+    def handle(self, request):
+        if request.url.path.startswith("/file/"):
+            return httpx.Response(200, content=b"image bytes")
+
+        method = request.url.path.rsplit("/", 1)[1]
+        payload = json.loads(request.content) if request.content else {}
+        self.calls.append((method, {**dict(request.url.params), **payload}))
+        if method == "getFile":
+            return httpx.Response(
+                200, json={"ok": True, "result": {"file_path": "photos/file.jpg"}}
+            )
+        return httpx.Response(
+            200, json={"ok": True, "result": {"message_id": next(self.message_ids)}}
+        )
+
+    def texts(self, method):
+        """Returns the texts sent with a Bot API method, in order."""
+        return [payload.get("text") for name, payload in self.calls if name == method]
+
+
+class FakeCalendar:
+    """In-memory Google Calendar and OAuth token endpoint.
+
+    A failure_rate share of the calls is answered with 429 or 503, and only
+    the last access token handed out is accepted.
+    """
+
+    def __init__(self, failure_rate=0.0, latency=0.0):
+        self.failure_rate = failure_rate
+        self.latency = latency
+        self.token = "token-0"
+        self.refreshes = 0
+        self.calendars = {}
+        self.requests = []
+        self.ids = itertools.count(1)
+        self.random = random.Random(1)
+
+    def add_calendar(self):
+        calendar_id = f"cal{next(self.ids)}@group.calendar.google.com"
+        self.calendars[calendar_id] = {}
+        return calendar_id
+
+    def call(self, method, path, query, body):
+        """Answers a single API call, returns (status, JSON body or None)."""
+        if self.random.random() < self.failure_rate:
+            return self.random.choice((429, 503)), {"error": {"message": "again"}}
+
+        if method == "POST" and path == "/calendar/v3/calendars":
+            return 200, {"id": self.add_calendar(), **body}
+
+        match = EVENTS_PATH.match(path)
+        if match is None:
+            return 404, {"error": {"message": "not found"}}
+        calendar_id, event_id = unquote(match[1]), match[2] and unquote(match[2])
+        events = self.calendars.get(calendar_id)
+        if events is None:
+            return 404, {"error": {"message": "calendar not found"}}
+
+        if method == "POST" and event_id is None:
+            event_id = body.get("id") or f"ev{next(self.ids)}"
+            if event_id in events:
+                return 409, {"error": {"message": "duplicate"}}
+            events[event_id] = dict(body, id=event_id)
+            return 200, dict(
+                events[event_id], htmlLink=f"https://calendar/event?eid={event_id}"
+            )
+        if method == "GET" and event_id is not None:
+            if event_id not in events:
+                return 404, {"error": {"message": "not found"}}
+            return 200, dict(
+                events[event_id], htmlLink=f"https://calendar/event?eid={event_id}"
+            )
+        if method == "DELETE" and event_id is not None:
+            if events.pop(event_id, None) is None:
+                return 410, {"error": {"message": "deleted"}}
+            return 204, None
+        if method == "GET" and event_id is None:
+            ids = sorted(events)
+            start = int(query.get("pageToken", 0))
+            end = start + int(query.get("maxResults", 250))
+            page = {"items": [events[i] for i in ids[start:end]]}
+            if end < len(ids):
+                page["nextPageToken"] = str(end)
+            return 200, page
+        return 400, {"error": {"message": "unsupported"}}
+
+    def batch(self, request):
+        """Answers a multipart/mixed batch request, call by call."""
+        boundary = request.headers["content-type"].partition("boundary=")[2]
+        parts = []
+        for part in request.content.decode().split(f"--{boundary}")[1:]:
+            if part.startswith("--"):
+                break
+            part_headers, _, http = part.strip("\r\n").partition("\r\n\r\n")
+            content_id = re.search(r"Content-ID: <(.+)>", part_headers)[1]
+            request_line, _, rest = http.partition("\r\n")
+            method, path, _ = request_line.split(" ")
+            body = rest.partition("\r\n\r\n")[2].strip()
+            status, data = self.call(method, path, {}, json.loads(body or "null"))
+            payload = json.dumps(data) if data is not None else ""
+            parts.append(
+                f"--batch_response\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} Status\r\nContent-Type: application/json\r\n\r\n"
+                f"{payload}\r\n"
+            )
+        parts.append("--batch_response--")
+        return httpx.Response(
+            200,
+            content="".join(parts),
+            headers={"Content-Type": "multipart/mixed; boundary=batch_response"},
+        )
+
+    async def handle(self, request):
+        self.requests.append(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if request.url.host == "oauth2.googleapis.com":
+            self.refreshes += 1
+            self.token = f"token-{self.refreshes}"
+            return httpx.Response(
+                200, json={"access_token": self.token, "expires_in": 3599}
+            )
+
+        if request.headers.get("authorization") != f"Bearer {self.token}":
+            return httpx.Response(401, json={"error": {"message": "invalid token"}})
+
+        if request.url.path == "/batch/calendar/v3":
+            return self.batch(request)
+
+        body = json.loads(request.content) if request.content else None
+        status, data = self.call(
+            request.method, request.url.path, dict(request.url.params), body
+        )
+        return httpx.Response(status, json=data) if data else httpx.Response(status)
+
+
+def fake_session(telegram=None, calendar=None):
+    """Returns an httpx client whose requests are answered by the fakes."""
+
+    async def handle(request):
+        host = request.url.host
+        if host == "api.telegram.org" and telegram is not None:
+            return telegram.handle(request)
+        if host.endswith("googleapis.com") and calendar is not None:
+            return await calendar.handle(request)
+        # geocoding and weather find nothing
+        return httpx.Response(404, json={})
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handle))
+
+
+async def settle():
+    """Waits for the tasks started by an update, like its background commits."""
+    while True:
+        tasks = [
+            task
+            for task in asyncio.all_tasks()
+            if task is not asyncio.current_task()
+            and task.get_coro().__name__ != "process_queue"
+        ]
+        if not tasks:
+            return
+        await asyncio.wait(tasks)
+
+
+class FakeRequest:
+    """The part of fastapi.Request the webhook uses."""
+
+    def __init__(self, update):
+        self.update = update
+
+    async def json(self):
+        return self.update
+
+
+class Bot:
+    """Sends Telegram updates through the real webhook, TimeSked.index."""
+
+    def __init__(self, app, db, telegram, calendar, extractions, updates):
+        self.app = app
+        self.db = db
+        self.telegram = telegram
+        self.calendar = calendar
+        # results the fake Gemini extraction returns, in order
+        self.extractions = extractions
+        # storage usage of every update, see storage_update_end
+        self.updates = updates
+        self.message_ids = itertools.count(1)
+
+    def run(self, coroutine):
+        """Runs a test scenario on a new event loop."""
+
+        async def main():
+            self.app.queue = asyncio.Queue()
+            try:
+                return await coroutine
+            finally:
+                await settle()
+
+        return asyncio.run(main())
+
+    async def update(self, update):
+        """Handles one Telegram update and waits for everything it started."""
+        await self.app.index(FakeRequest(update))
+        await settle()
+        return self.updates[-1]
+
+    def message(self, chat_id, **content):
+        message_id = next(self.message_ids)
+        return {
+            "update_id": message_id,
+            "message": {
+                "message_id": message_id,
+                "chat": {"id": chat_id},
+                "from": {"id": chat_id, "first_name": "Test", "username": "test"},
+                **content,
+            },
+        }
+
+    async def text(self, chat_id, text):
+        return await self.update(self.message(chat_id, text=text))
+
+    async def photo(self, chat_id):
+        # extraction starts on 960x720, the smallest size within the pixel
+        # budget, and may escalate to 1280x960
+        photo = [
+            {"file_id": f"photo-{width}", "width": width, "height": height}
+            for width, height in ((320, 240), (960, 720), (1280, 960))
+        ]
+        return await self.update(self.message(chat_id, photo=photo))
+
+    async def callback(self, chat_id, data, text="TimeSked", reply_to=None):
+        message = {"message_id": next(self.message_ids), "chat": {"id": chat_id}}
+        message["text"] = text
+        if reply_to is not None:
+            message["reply_to_message"] = reply_to
+        return await self.update(
+            {"callback_query": {"id": "callback", "data": data, "message": message}}
+        )
+
+    async def add_user(self, chat_id, **fields):
+        """Stores the document of an existing user."""
+        await self.db.collection("user_records").document(str(chat_id)).set(
+            {
+                "chat_id": chat_id,
+                "name": "Test",
+                "username": "test",
+                "date": day(-30),
+                "no_of_uses": 1,
+                "access_token": None,
+                "refresh_token": None,
+                "token_expiry": None,
+                "calendar_id": None,
+                "chat_session": None,
+                "position": None,
+                **fields,
+            }
+        )
+
+    async def link_calendar(self, chat_id):
+        """Stores an existing user with a linked calendar and a valid token.
+
+        Returns the ID of the calendar.
+        """
+        calendar_id = self.calendar.add_calendar()
+        await self.add_user(
+            chat_id,
+            calendar_id=calendar_id,
+            access_token=self.calendar.token,
+            refresh_token="refresh",
+            token_expiry=datetime.datetime.now().timestamp() + 3000,
+        )
+        return calendar_id
+
+
+def extraction(offset=1, name="Team sync"):
+    """A model extraction of one event, offset days from today."""
+    return [[name, day(offset), "None", "10:00", "11:00", "Office", "None"]]
+
+
+@pytest.fixture
+def bot(monkeypatch, tmp_path):
+    import TimeSked
+    from utils import event_handlers, telegram_handlers
+    from utils.sqlite_store import SQLiteClient
+    from utils.storage_metrics import instrument_storage
+
+    db = instrument_storage(SQLiteClient(str(tmp_path / "bot.db")))
+    telegram = FakeTelegram()
+    calendar = FakeCalendar()
+    extractions = []
+    updates = []
+
+    async def prompter(type, message, attempt=1, chat_id=None, priority=None):
+        return extractions.pop(0) if extractions else extraction()
+
+    async def preprocess_in_pool(content, *args, **kwargs):
+        return {"mime_type": "image/jpeg", "data": content}
+
+    storage_update_end = TimeSked.storage_update_end
+
+    def recorded_update_end(token):
+        usage = storage_update_end(token)
+        updates.append(usage)
+        return usage
+
+    monkeypatch.setattr(TimeSked, "db", db)
+    monkeypatch.setattr(TimeSked, "session", fake_session(telegram, calendar))
+    monkeypatch.setattr(TimeSked, "queue", TimeSked.queue)
+    monkeypatch.setattr(TimeSked, "storage_update_end", recorded_update_end)
+    monkeypatch.setattr(event_handlers, "prompter", prompter)
+    monkeypatch.setattr(telegram_handlers, "preprocess_in_pool", preprocess_in_pool)
+
+    return Bot(TimeSked, db, telegram, calendar, extractions, updates)
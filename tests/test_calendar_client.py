@@ -0,0 +1,370 @@
+"""The async Calendar client against the fake Google Calendar of conftest.py."""
+
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from conftest import FakeCalendar, fake_session, new_chat_id
+from config import TOKEN_EXPIRY_MARGIN
+from utils import calendar_client
+from utils.calendar_client import (
+    parse_batch_response,
+    calendar_batch,
+    insert_event,
+    list_events,
+)
+from utils.gcal_events import (
+    calendar_event,
+    batch_multiple_events,
+    gcal_event_handler,
+)
+from utils.token_manager import tokens, refreshes
+from utils.user_context import user_context
+
+
+class ScriptedCalendar(FakeCalendar):
+    """Fake calendar failing the calls of chosen events, by event name.
+
+    Events in fail_once get a 503 the first time they are sent, events in
+    rejected a 400 every time.
+    """
+
+    def __init__(self, fail_once=(), rejected=()):
+        super().__init__()
+        self.fail_once = set(fail_once)
+        self.rejected = set(rejected)
+        self.sent = []
+
+    def call(self, method, path, query, body):
+        name = (body or {}).get("summary")
+        self.sent.append(name)
+        if name in self.rejected:
+            return 400, {"error": {"message": "invalid event"}}
+        if name in self.fail_once:
+            self.fail_once.discard(name)
+            return 503, {"error": {"message": "try again"}}
+        return super().call(method, path, query, body)
+
+
+class LostAnswerCalendar(FakeCalendar):
+    """Fake calendar that creates events but loses the first answer of each.
+
+    Events in lost get a 503 after they were added, and when transport is
+    set the request of the first insert fails with a connection error once it
+    was handled.
+    """
+
+    def __init__(self, lost=(), transport=False):
+        super().__init__()
+        self.lost = set(lost)
+        self.transport = transport
+
+    def call(self, method, path, query, body):
+        status, data = super().call(method, path, query, body)
+        name = (body or {}).get("summary")
+        if name in self.lost and status == 200:
+            self.lost.discard(name)
+            return 503, {"error": {"message": "backend error"}}
+        return status, data
+
+    async def handle(self, request):
+        response = await super().handle(request)
+        if self.transport and request.method == "POST":
+            self.transport = False
+            raise httpx.ConnectError("connection reset", request=request)
+        return response
+
+
+class RejectingCalendar(FakeCalendar):
+    """Fake calendar that accepts no access token, not even a new one."""
+
+    async def handle(self, request):
+        if request.url.host == "oauth2.googleapis.com":
+            return await super().handle(request)
+        self.requests.append(request)
+        return httpx.Response(401, json={"error": {"message": "invalid token"}})
+
+
+@pytest.fixture
+def calendar_user(monkeypatch, tmp_path):
+    """Returns a function storing a user whose calendar is on a fake, and their context."""
+    from utils.sqlite_store import SQLiteClient
+
+    db = SQLiteClient(str(tmp_path / "calendar.db"))
+    monkeypatch.setattr(calendar_client, "retry_delay", lambda response, attempt: 0)
+
+    async def create(calendar, access_token=None, expiry=None):
+        chat_id = new_chat_id()
+        await db.collection("user_records").document(str(chat_id)).set(
+            {
+                "chat_id": chat_id,
+                "access_token": access_token or calendar.token,
+                "refresh_token": "refresh",
+                "token_expiry": expiry or time.time() + 3000,
+            }
+        )
+        return user_context(db, chat_id)
+
+    return create
+
+
+def api_requests(calendar):
+    """Returns the requests the fake got on the Calendar API, not the token endpoint."""
+    return [r for r in calendar.requests if r.url.host == "www.googleapis.com"]
+
+
+def event(name):
+    return calendar_event([name, "2030-01-15", "2030-01-15", "10:00", None, None, None])
+
+
+def insert_calls(calendar_id, names):
+    path = calendar_client.calendar_path(calendar_id)
+    return [("POST", path, event(name)) for name in names]
+
+
+def test_parse_batch_response():
+    body = (
+        "--batch_abc\r\n"
+        "Content-Type: application/http\r\n"
+        "Content-ID: <response-item-2>\r\n\r\n"
+        "HTTP/1.1 204 No Content\r\n\r\n\r\n"
+        "--batch_abc\r\n"
+        "Content-Type: application/http\r\n"
+        "content-id: <response-item-0>\r\n\r\n"
+        "HTTP/1.1 200 OK\r\n"
+        "Content-Type: application/json\r\n\r\n"
+        '{"id": "ev1", "htmlLink": "https://calendar/event?eid=ev1"}\r\n'
+        "--batch_abc\r\n"
+        "Content-Type: application/http\r\n"
+        "Content-ID: <response-item-1>\r\n\r\n"
+        "HTTP/1.1 429 Too Many Requests\r\n"
+        "Content-Type: application/json\r\n\r\n"
+        '{"error": {"message": "rate"}}\r\n'
+        "--batch_abc--"
+    )
+    response = httpx.Response(
+        200,
+        content=body,
+        headers={"Content-Type": 'multipart/mixed; boundary="batch_abc"'},
+    )
+
+    assert parse_batch_response(response) == {
+        0: (200, {"id": "ev1", "htmlLink": "https://calendar/event?eid=ev1"}),
+        1: (429, {"error": {"message": "rate"}}),
+        2: (204, None),
+    }
+
+
+def test_batch_retries_failed_calls_and_keeps_the_order(calendar_user, monkeypatch):
+    monkeypatch.setattr(calendar_client, "CALENDAR_BATCH_SIZE", 2)
+    calendar = ScriptedCalendar(fail_once={"Event 1", "Event 4"}, rejected={"Event 2"})
+    calendar_id = calendar.add_calendar()
+    names = [f"Event {i}" for i in range(5)]
+
+    async def scenario():
+        context = await calendar_user(calendar)
+        async with fake_session(calendar=calendar) as session:
+            return await calendar_batch(
+                session, context, insert_calls(calendar_id, names)
+            )
+
+    results = asyncio.run(scenario())
+
+    assert [status for status, _ in results] == [200, 200, 400, 200, 200]
+    assert [body["summary"] for status, body in results if status == 200] == [
+        "Event 0",
+        "Event 1",
+        "Event 3",
+        "Event 4",
+    ]
+    # the calls that succeeded are not sent again, the rejected one is not retried
+    assert sorted(calendar.sent) == sorted(names + ["Event 1", "Event 4"])
+
+
+def test_batch_insert_created_before_a_failure_is_not_duplicated(calendar_user):
+    calendar = LostAnswerCalendar(lost={"Event 1"})
+    calendar_id = calendar.add_calendar()
+
+    async def scenario():
+        context = await calendar_user(calendar)
+        async with fake_session(calendar=calendar) as session:
+            return await batch_multiple_events(
+                session, context, calendar_id, [event(f"Event {i}") for i in range(3)]
+            )
+
+    results = asyncio.run(scenario())
+
+    events = calendar.calendars[calendar_id]
+    assert sorted(event["summary"] for event in events.values()) == [
+        "Event 0",
+        "Event 1",
+        "Event 2",
+    ]
+    assert [events[result["id"]]["summary"] for result in results] == [
+        "Event 0",
+        "Event 1",
+        "Event 2",
+    ]
+    assert results[1]["link"] == f"https://calendar/event?eid={results[1]['id']}"
+
+
+def test_insert_sent_again_after_a_connection_error_is_not_duplicated(
+    calendar_user,
+):
+    calendar = LostAnswerCalendar(transport=True)
+    calendar_id = calendar.add_calendar()
+    body = event("Team sync")
+
+    async def scenario():
+        context = await calendar_user(calendar)
+        async with fake_session(calendar=calendar) as session:
+            return await insert_event(session, context, calendar_id, body)
+
+    response = asyncio.run(scenario())
+
+    assert response.status_code == 200
+    assert response.json()["id"] == body["id"]
+    assert list(calendar.calendars[calendar_id]) == [body["id"]]
+
+
+def test_failed_events_leave_a_gap(calendar_user):
+    calendar = ScriptedCalendar(rejected={"Event 1"})
+    calendar_id = calendar.add_calendar()
+
+    async def scenario():
+        context = await calendar_user(calendar)
+        async with fake_session(calendar=calendar) as session:
+            return await batch_multiple_events(
+                session, context, calendar_id, [event(f"Event {i}") for i in range(3)]
+            )
+
+    first, failed, last = asyncio.run(scenario())
+
+    assert failed is None
+    assert calendar.calendars[calendar_id][first["id"]]["summary"] == "Event 0"
+    assert calendar.calendars[calendar_id][last["id"]]["summary"] == "Event 2"
+
+
+def test_event_handler_matches_links_to_events_after_an_error(calendar_user):
+    calendar = FakeCalendar()
+    calendar_id = calendar.add_calendar()
+    events = [
+        ValueError("The message does not contain the date of the event."),
+        ["Team sync", "2030-01-15", "2030-01-15", "10:00", None, "Office", None],
+        ["Review", "2030-01-16", "2030-01-16", "15:00", None, None, None],
+    ]
+
+    async def scenario():
+        context = await calendar_user(calendar)
+        writes = []
+        async with fake_session(calendar=calendar) as session:
+            processed = await gcal_event_handler(
+                context["db"],
+                session,
+                "",
+                context["chat_id"],
+                1,
+                2,
+                events,
+                None,
+                calendar_id,
+                asyncio.Queue(),
+                context,
+                writes,
+            )
+        return processed, writes
+
+    processed, writes = asyncio.run(scenario())
+
+    assert processed[0] is events[0]
+    links = {
+        event["summary"]: f"https://calendar/event?eid={event_id}"
+        for event_id, event in calendar.calendars[calendar_id].items()
+    }
+    assert processed[1]["link"] == links["Team sync"]
+    assert processed[2]["link"] == links["Review"]
+    assert [(data["name"], data["link"]) for _, data in writes] == [
+        ("Team sync", links["Team sync"]),
+        ("Review", links["Review"]),
+    ]
+
+
+def test_rejected_token_is_refreshed_once(calendar_user):
+    calendar = FakeCalendar()
+    calendar_id = calendar.add_calendar()
+
+    async def scenario():
+        context = await calendar_user(calendar, access_token="revoked")
+        async with fake_session(calendar=calendar) as session:
+            return await list_events(session, context, calendar_id)
+
+    assert asyncio.run(scenario()) == []
+    assert calendar.refreshes == 1
+
+
+def test_new_token_rejected_too_gives_up(calendar_user):
+    calendar = RejectingCalendar()
+    calendar_id = calendar.add_calendar()
+
+    async def scenario():
+        context = await calendar_user(calendar)
+        async with fake_session(calendar=calendar) as session:
+            return await list_events(session, context, calendar_id)
+
+    assert asyncio.run(scenario()) is None
+    assert calendar.refreshes == 1
+    # the request with the old token, and once more with the new one
+    assert len(api_requests(calendar)) == 2
+
+
+def test_batch_call_rejected_with_401_is_refreshed_once(calendar_user):
+    calendar = RejectingCalendar()
+    calendar_id = calendar.add_calendar()
+
+    async def scenario():
+        context = await calendar_user(calendar)
+        async with fake_session(calendar=calendar) as session:
+            return await calendar_batch(
+                session, context, insert_calls(calendar_id, ["Event 0"])
+            )
+
+    assert asyncio.run(scenario()) == [(401, None)]
+    assert calendar.refreshes == 1
+
+
+def test_concurrent_requests_share_a_refresh(calendar_user):
+    calendar = FakeCalendar(latency=0.01)
+    calendar_id = calendar.add_calendar()
+
+    async def scenario():
+        context = await calendar_user(calendar, expiry=time.time() - 1)
+        async with fake_session(calendar=calendar) as session:
+            return await asyncio.gather(
+                *(list_events(session, context, calendar_id) for _ in range(20))
+            )
+
+    assert asyncio.run(scenario()) == [[]] * 20
+    assert calendar.refreshes == 1
+
+
+def test_token_close_to_its_expiry_is_refreshed_ahead(calendar_user):
+    calendar = FakeCalendar(latency=0.01)
+    calendar_id = calendar.add_calendar()
+
+    async def scenario():
+        context = await calendar_user(
+            calendar, expiry=time.time() + TOKEN_EXPIRY_MARGIN + 60
+        )
+        async with fake_session(calendar=calendar) as session:
+            listed = await list_events(session, context, calendar_id)
+            # the request went out with the old token, the new one comes after
+            used = api_requests(calendar)[-1].headers["authorization"]
+            await asyncio.gather(*refreshes.values())
+            return listed, used, tokens[context["chat_id"]]["access_token"]
+
+    listed, used, cached = asyncio.run(scenario())
+    assert listed == []
+    assert calendar.refreshes == 1
+    assert (used, cached) == ("Bearer token-0", "token-1")
@@ -0,0 +1,86 @@
+"""Chat turns are sent to the model until they are folded into the summary, once."""
+
+import asyncio
+import types
+
+from conftest import new_chat_id
+from config import CHAT_WINDOW_MESSAGES, CHAT_SUMMARY_BATCH
+from utils import chat_handlers
+from utils.chat_handlers import chat_contents, chat_history_updater
+
+
+def turns(first, last):
+    return [
+        {"index": i, "role": "user" if i % 2 == 0 else "model", "text": f"turn {i}"}
+        for i in range(first, last)
+    ]
+
+
+def test_turns_waiting_for_the_summary_are_sent():
+    count = CHAT_WINDOW_MESSAGES + CHAT_SUMMARY_BATCH - 2
+    chat_session = {
+        "context": "Events",
+        "summary": "Earlier",
+        "summarized_upto": 4,
+        "turn_count": 4 + count,
+        "turns": turns(4, 4 + count),
+    }
+
+    messages = chat_contents(chat_session)
+
+    assert "Earlier" in messages[0]["parts"][0]
+    assert [message["parts"][0] for message in messages[1:]] == [
+        f"turn {i}" for i in range(4, 4 + count)
+    ]
+
+
+def test_one_compaction_at_a_time(monkeypatch, tmp_path):
+    from utils.sqlite_store import SQLiteClient
+
+    db = SQLiteClient(str(tmp_path / "chat.db"))
+    chat_id = new_chat_id()
+    # one more turn and the oldest batch leaves the window
+    turn_count = CHAT_WINDOW_MESSAGES + CHAT_SUMMARY_BATCH - 2
+    chat_session = {
+        "context": "Events",
+        "links": {},
+        "summary": None,
+        "summarized_upto": 0,
+        "turn_count": turn_count,
+        "turns": turns(0, turn_count),
+    }
+    prompts = []
+
+    async def generate(model, prompt, *args, **kwargs):
+        prompts.append(prompt)
+        await asyncio.sleep(0.05)
+        return types.SimpleNamespace(text=f"Summary {len(prompts)}")
+
+    monkeypatch.setattr(chat_handlers, "generate", generate)
+
+    async def scenario():
+        await db.collection("user_records").document(str(chat_id)).set(
+            {"chat_session": {k: v for k, v in chat_session.items() if k != "turns"}}
+        )
+        first = asyncio.create_task(
+            chat_history_updater(db, chat_id, chat_session, "question 1", "reply 1")
+        )
+        while not prompts:
+            await asyncio.sleep(0.01)
+        # the next turn arrives while the summary is being written
+        await chat_history_updater(db, chat_id, chat_session, "question 2", "reply 2")
+        await first
+
+    asyncio.run(scenario())
+
+    assert len(prompts) == 1
+    assert chat_session["summary"] == "Summary 1"
+    assert chat_session["summarized_upto"] == chat_session["turn_count"] - (
+        CHAT_WINDOW_MESSAGES + 2
+    )
+    # the turns of the second update are kept
+    assert [turn["text"] for turn in chat_session["turns"][-2:]] == [
+        "question 2",
+        "reply 2",
+    ]
+    assert chat_handlers.compactions == set()
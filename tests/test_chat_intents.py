@@ -0,0 +1,51 @@
+"""Simple chat questions are answered from the upcoming events, the rest go to the model."""
+
+import datetime
+
+import pytest
+
+from utils.chat_intents import match_intent
+
+TODAY = datetime.date(2030, 1, 16)  # a Wednesday
+EVENTS = {
+    "past": {
+        "name": "Retro",
+        "start_date": "2030-01-14",
+        "start_time": "10:00",
+        "location": "Office",
+    },
+    "upcoming": {
+        "name": "Team sync",
+        "start_date": "2030-01-18",
+        "start_time": "10:00",
+        "location": "Office",
+    },
+}
+
+
+@pytest.mark.parametrize(
+    "question, intent",
+    [
+        ("what's my next event", "next_event"),
+        ("anything on friday", "events_on"),
+        ("am i busy 2030-01-18", "events_on"),
+        ("how many events this week", "how_many"),
+    ],
+)
+def test_upcoming_questions_are_answered(question, intent):
+    assert match_intent(1, EVENTS, question, TODAY)[0] == intent
+
+
+@pytest.mark.parametrize(
+    "question",
+    [
+        "what did i have on monday",
+        "was there anything on 2030-01-14",
+        "what events did i have last week",
+        "anything on 2030-01-14",
+        "events two days ago",
+        "how many events were there this week",
+    ],
+)
+def test_past_questions_go_to_the_model(question):
+    assert match_intent(1, EVENTS, question, TODAY) == (None, None)
@@ -0,0 +1,104 @@
+"""The final edit of a streamed chat reply fits in a Telegram message, and
+the model calls of a reply each take a model slot."""
+
+import asyncio
+import json
+
+import httpx
+import pytest
+
+from conftest import new_chat_id
+from utils import chat_handlers, model_scheduler
+
+
+@pytest.fixture
+def chat(bot, monkeypatch):
+    """Returns a function sending a question the model answers with reply, in chat mode."""
+    chat_id = new_chat_id()
+
+    async def ask(reply):
+        async def stream_chat_reply(*args, **kwargs):
+            return reply
+
+        monkeypatch.setattr(chat_handlers, "stream_chat_reply", stream_chat_reply)
+        await bot.add_user(chat_id)
+        await bot.callback(chat_id, "Confirm CHAT")
+        await bot.text(chat_id, "can you plan my evenings around these events")
+        return [
+            payload for name, payload in bot.telegram.calls if name == "editMessageText"
+        ][-1]
+
+    return ask
+
+
+def test_long_reply_is_cut_after_escaping(bot, chat):
+    # the cut falls right after the backslash escaping a dot
+    reply = "Hi" + "Plans. " * 1000
+
+    edit = bot.run(chat(reply))
+
+    assert edit["parse_mode"] == "MarkdownV2"
+    assert len(edit["text"]) <= 4096
+    assert edit["text"].startswith("HiPlans\\. Plans\\.")
+    assert not edit["text"].endswith("\\")
+
+
+def test_plain_text_fallback_is_not_escaped(bot, chat, monkeypatch):
+    handle = bot.telegram.handle
+
+    def markdown_rejected(request):
+        payload = json.loads(request.content) if request.content else {}
+        if payload.get("parse_mode") == "MarkdownV2":
+            return httpx.Response(400, json={"ok": False})
+        return handle(request)
+
+    monkeypatch.setattr(bot.telegram, "handle", markdown_rejected)
+
+    edit = bot.run(chat("See you at 10.30 (room 2)!"))
+
+    assert "parse_mode" not in edit
+    assert edit["text"] == "See you at 10.30 (room 2)!"
+
+
+def test_empty_reply_replaces_the_placeholder(bot, chat):
+    edit = bot.run(chat(""))
+
+    assert edit["text"] != "💬 ..."
+    assert "try asking again" in edit["text"]
+
+
+def test_each_model_call_takes_a_slot_released_before_the_tools(monkeypatch):
+    rounds = [
+        ("", [{"name": "list_events", "args": {}}]),
+        ("", [{"name": "list_events", "args": {}}]),
+        ("Nothing tomorrow", []),
+    ]
+    slots_during_tools = []
+
+    class Model:
+        async def generate_content_async(self, messages, stream, tools):
+            assert model_scheduler.active == 1
+            return None
+
+    async def edit_streamed_chunks(*args):
+        return rounds.pop(0)
+
+    async def execute_tool(db, chat_id, name, args, tool_state):
+        slots_during_tools.append(model_scheduler.active)
+        return {"events": []}
+
+    monkeypatch.setattr(chat_handlers, "chat_model", Model())
+    monkeypatch.setattr(chat_handlers, "edit_streamed_chunks", edit_streamed_chunks)
+    monkeypatch.setattr(chat_handlers, "execute_tool", execute_tool)
+    monkeypatch.setattr(chat_handlers, "record_model_usage", lambda *args: None)
+    monkeypatch.setattr(model_scheduler, "call_times", model_scheduler.deque())
+
+    text = asyncio.run(
+        chat_handlers.stream_chat_reply(None, None, 1, 2, [], tool_state={})
+    )
+
+    assert text == "Nothing tomorrow"
+    assert slots_during_tools == [0, 0]
+    # every call counts against MODEL_RPM
+    assert len(model_scheduler.call_times) == 3
+    assert model_scheduler.active == 0
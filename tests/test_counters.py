@@ -0,0 +1,109 @@
+"""The global counters count every document once."""
+
+import asyncio
+
+import pytest
+
+from google.api_core.exceptions import DeadlineExceeded
+
+from utils import firebase_handlers
+from utils.firebase_handlers import commit_writes, event_info_add, seed_counters
+from utils.sharded_counter import (
+    global_counter,
+    counter_increment,
+    counter_value,
+    cached_values,
+)
+
+
+@pytest.fixture
+def db(tmp_path):
+    from utils.sqlite_store import SQLiteClient
+
+    cached_values.clear()
+    yield SQLiteClient(str(tmp_path / "counters.db"))
+    cached_values.clear()
+
+
+def events(db, count):
+    writes = []
+    for i in range(count):
+        event_info_add(
+            db,
+            writes,
+            1,
+            1,
+            [f"Event {i}", "2030-01-15", None, "10:00", None, None, None],
+            "https://calendar/event",
+        )
+    return writes
+
+
+def test_batch_committed_before_a_timeout_is_counted_once(db, monkeypatch):
+    from utils.sqlite_store import WriteBatch
+
+    commit = WriteBatch.commit
+    failures = []
+
+    async def committed_then_timed_out(self):
+        await commit(self)
+        if not failures:
+            failures.append(True)
+            raise DeadlineExceeded("deadline exceeded")
+
+    async def no_wait(delay):
+        pass
+
+    monkeypatch.setattr(WriteBatch, "commit", committed_then_timed_out)
+    monkeypatch.setattr(firebase_handlers.asyncio, "sleep", no_wait)
+
+    async def scenario():
+        assert await commit_writes(db, events(db, 3))
+        return await counter_value(global_counter(db, "events"))
+
+    assert asyncio.run(scenario()) == 3
+
+
+def test_failed_batch_is_sent_again(db, monkeypatch):
+    from utils.sqlite_store import WriteBatch
+
+    commit = WriteBatch.commit
+    failures = []
+
+    async def timed_out_once(self):
+        if not failures:
+            failures.append(True)
+            raise DeadlineExceeded("deadline exceeded")
+        await commit(self)
+
+    async def no_wait(delay):
+        pass
+
+    monkeypatch.setattr(WriteBatch, "commit", timed_out_once)
+    monkeypatch.setattr(firebase_handlers.asyncio, "sleep", no_wait)
+
+    async def scenario():
+        assert await commit_writes(db, events(db, 2))
+        return await counter_value(global_counter(db, "events"))
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_seed_leaves_out_what_the_shards_counted(db):
+    async def scenario():
+        # two events stored before the counter existed
+        await commit_writes(db, events(db, 2), counted=False)
+        # and one counted in the shards before the counter was seeded
+        await commit_writes(db, events(db, 1))
+        await seed_counters(db)
+        seeded = await counter_value(global_counter(db, "events"))
+
+        cached_values.clear()
+        batch = db.batch()
+        counter_increment(batch, global_counter(db, "events"), 4)
+        await batch.commit()
+        # seeding again changes nothing
+        await seed_counters(db)
+        return seeded, await counter_value(global_counter(db, "events"))
+
+    assert asyncio.run(scenario()) == (3, 7)
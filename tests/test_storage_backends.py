@@ -0,0 +1,277 @@
+"""The SQLite backend answers the queries and writes of the handlers like Firestore.
+
+Every test runs on both backends. Firestore is the emulator at
+FIRESTORE_EMULATOR_HOST (e.g. started with `gcloud emulators firestore start`),
+the Firestore tests are skipped when it is not set. Each test writes to
+collections of its own, so they can share a database.
+"""
+
+import os
+import uuid
+import asyncio
+
+import pytest
+
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+from google.cloud.firestore_v1.transforms import Increment
+
+
+@pytest.fixture(params=["sqlite", "firestore"])
+def backend(request, tmp_path):
+    """Returns a function creating a client of the backend.
+
+    The client is created on the event loop of the test, which the async
+    Firestore client is bound to.
+    """
+    if request.param == "sqlite":
+        from utils.sqlite_store import SQLiteClient
+
+        path = str(tmp_path / "conformance.db")
+        return lambda: SQLiteClient(path)
+
+    if not os.environ.get("FIRESTORE_EMULATOR_HOST"):
+        pytest.skip("FIRESTORE_EMULATOR_HOST is not set")
+    from google.cloud import firestore
+
+    project = os.environ.get("FIRESTORE_PROJECT", "timesked-test")
+    return lambda: firestore.AsyncClient(project=project)
+
+
+def run(backend, scenario):
+    """Runs scenario(db, collection name) on a new event loop."""
+
+    async def main():
+        return await scenario(backend(), f"conformance_{uuid.uuid4().hex[:12]}")
+
+    return asyncio.run(main())
+
+
+async def add_events(db, name):
+    """Stores the events the query tests page through, returns their IDs in order."""
+    events = [
+        ("a", 1, "2030-01-01"),
+        ("b", 1, "2030-01-02"),
+        ("c", 1, "2030-01-02"),
+        ("d", 1, "2030-01-03"),
+        ("e", 1, "2030-01-04"),
+        ("f", 2, "2030-01-02"),
+    ]
+    batch = db.batch()
+    for doc_id, chat_id, start_date in events:
+        batch.set(
+            db.collection(name).document(doc_id),
+            {"chat_id": chat_id, "start_date": start_date, "name": f"Event {doc_id}"},
+        )
+    await batch.commit()
+
+
+def events_query(db, name, chat_id=1):
+    """The query of the event list pages, see retrieve_events_page."""
+    return (
+        db.collection(name)
+        .where(filter=FieldFilter("chat_id", "==", chat_id))
+        .where(filter=FieldFilter("start_date", ">=", "2030-01-01"))
+        .order_by("start_date")
+        .order_by(FieldPath.document_id())
+    )
+
+
+def ids(docs):
+    return [doc.id for doc in docs]
+
+
+def test_order_by_document_id(backend):
+    async def scenario(db, name):
+        await add_events(db, name)
+        return ids(await events_query(db, name).get())
+
+    # events starting on the same day are ordered by document ID
+    assert run(backend, scenario) == ["a", "b", "c", "d", "e"]
+
+
+def test_cursors_compare_start_date_and_document_id(backend):
+    async def scenario(db, name):
+        await add_events(db, name)
+        position = {"start_date": "2030-01-02", FieldPath.document_id(): "b"}
+        query = events_query(db, name)
+        return (
+            ids(await query.start_at(position).limit(2).get()),
+            ids(await query.start_after(position).limit(2).get()),
+            ids(await query.end_before(position).get()),
+            ids(await query.end_at(position).get()),
+        )
+
+    start_at, start_after, end_before, end_at = run(backend, scenario)
+    assert start_at == ["b", "c"]
+    assert start_after == ["c", "d"]
+    assert end_before == ["a"]
+    assert end_at == ["a", "b"]
+
+
+def test_limit_to_last_returns_the_last_documents_in_query_order(backend):
+    async def scenario(db, name):
+        await add_events(db, name)
+        position = {"start_date": "2030-01-03", FieldPath.document_id(): "d"}
+        query = events_query(db, name).end_before(position)
+        return ids(await query.limit_to_last(2).get())
+
+    assert run(backend, scenario) == ["b", "c"]
+
+
+def test_select_returns_only_the_selected_fields(backend):
+    async def scenario(db, name):
+        await add_events(db, name)
+        query = events_query(db, name).limit(1)
+        selected = await query.select(["name", "start_date"]).get()
+        no_fields = await query.select([]).get()
+        return selected[0].to_dict(), ids(no_fields)
+
+    selected, no_fields = run(backend, scenario)
+    assert selected == {"name": "Event a", "start_date": "2030-01-01"}
+    assert no_fields == ["a"]
+
+
+def test_where_in_and_range(backend):
+    async def scenario(db, name):
+        await add_events(db, name)
+        in_query = db.collection(name).where(
+            filter=FieldFilter("start_date", "in", ["2030-01-01", "2030-01-03"])
+        )
+        range_query = (
+            db.collection(name)
+            .where(filter=FieldFilter("start_date", ">", "2030-01-01"))
+            .where(filter=FieldFilter("start_date", "<", "2030-01-03"))
+        )
+        return sorted(ids(await in_query.get())), sorted(ids(await range_query.get()))
+
+    in_ids, range_ids = run(backend, scenario)
+    assert in_ids == ["a", "d"]
+    assert range_ids == ["b", "c", "f"]
+
+
+def test_count(backend):
+    async def scenario(db, name):
+        await add_events(db, name)
+        everything = await db.collection(name).count().get()
+        of_chat = await events_query(db, name, chat_id=2).count().get()
+        return everything[0][0].value, of_chat[0][0].value
+
+    assert run(backend, scenario) == (6, 1)
+
+
+def test_stream(backend):
+    async def scenario(db, name):
+        await add_events(db, name)
+        return [doc.id async for doc in events_query(db, name, chat_id=2).stream()]
+
+    assert run(backend, scenario) == ["f"]
+
+
+def test_create_of_an_existing_document_raises_already_exists(backend):
+    async def scenario(db, name):
+        doc_ref = db.collection(name).document("user")
+        await doc_ref.create({"no_of_uses": 1})
+        with pytest.raises(AlreadyExists):
+            await doc_ref.create({"no_of_uses": 2})
+        return (await doc_ref.get()).to_dict()
+
+    assert run(backend, scenario) == {"no_of_uses": 1}
+
+
+def test_update_with_dotted_fields(backend):
+    async def scenario(db, name):
+        doc_ref = db.collection(name).document("user")
+        with pytest.raises(NotFound):
+            await doc_ref.update({"chat_session.turn_count": 1})
+        missing = (await doc_ref.get()).exists
+
+        await doc_ref.set({"no_of_uses": 1, "chat_session": {"turn_count": 1}})
+        await doc_ref.update(
+            {
+                "no_of_uses": Increment(2),
+                "chat_session.turn_count": Increment(1),
+                "chat_session.summary": "Summary",
+            }
+        )
+        return missing, (await doc_ref.get()).to_dict()
+
+    missing, data = run(backend, scenario)
+    assert missing is False
+    assert data == {
+        "no_of_uses": 3,
+        "chat_session": {"turn_count": 2, "summary": "Summary"},
+    }
+
+
+def test_set_with_merge_and_increment(backend):
+    async def scenario(db, name):
+        doc_ref = db.collection(name).document("shard")
+        # on a missing document the increment starts from zero
+        await doc_ref.set({"count": Increment(2)}, merge=True)
+        await doc_ref.set({"count": Increment(3), "name": "users"}, merge=True)
+        await doc_ref.set({"map": {"a": 1, "b": 1}}, merge=True)
+        await doc_ref.set({"map": {"b": 2}}, merge=True)
+        merged = (await doc_ref.get()).to_dict()
+
+        # without merge the document is replaced
+        await doc_ref.set({"count": Increment(1)})
+        return merged, (await doc_ref.get()).to_dict()
+
+    merged, replaced = run(backend, scenario)
+    assert merged == {"count": 5, "name": "users", "map": {"a": 1, "b": 2}}
+    assert replaced == {"count": 1}
+
+
+def test_subcollections_are_scoped_to_their_parent(backend):
+    async def scenario(db, name):
+        first = db.collection(name).document("1").collection("chat_turns")
+        second = db.collection(name).document("2").collection("chat_turns")
+        for index in range(3):
+            await first.document(f"{index:06d}").set({"index": index})
+        await second.document("000000").set({"index": 0})
+
+        query = (
+            first.where(filter=FieldFilter("index", ">=", 1))
+            .where(filter=FieldFilter("index", "<", 3))
+            .order_by("index")
+        )
+        return (
+            [doc.get("index") for doc in await query.get()],
+            (await second.count().get())[0][0].value,
+        )
+
+    assert run(backend, scenario) == ([1, 2], 1)
+
+
+def test_delete(backend):
+    async def scenario(db, name):
+        doc_ref = db.collection(name).document("event")
+        await doc_ref.set({"name": "Event"})
+        await doc_ref.delete()
+        # deleting a missing document is not an error
+        await doc_ref.delete()
+        return (await doc_ref.get()).exists
+
+    assert run(backend, scenario) is False
+
+
+def test_failed_batch_writes_nothing(backend):
+    async def scenario(db, name):
+        existing = db.collection(name).document("existing")
+        await existing.set({"count": 1})
+
+        batch = db.batch()
+        batch.set(db.collection(name).document("new"), {"count": 1})
+        batch.update(existing, {"count": Increment(1)})
+        batch.create(existing, {"count": 5})
+        with pytest.raises(AlreadyExists):
+            await batch.commit()
+
+        return (
+            (await db.collection(name).document("new").get()).exists,
+            (await existing.get()).to_dict(),
+        )
+
+    assert run(backend, scenario) == (False, {"count": 1})
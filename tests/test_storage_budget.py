@@ -0,0 +1,127 @@
+"""Every update type stays within its storage budget (STORAGE_BUDGETS).
+
+The updates go through the real webhook and handlers, with the network faked
+(see conftest.py). Each flow runs once to warm the caches, then the storage
+usage of its next run is checked, including the writes it left to
+background tasks.
+"""
+
+import pytest
+
+from conftest import new_chat_id, extraction
+from utils.storage_metrics import STORAGE_BUDGETS
+
+
+def check_budget(usage, update_type):
+    assert usage["type"] == update_type
+    budget = STORAGE_BUDGETS[update_type]
+    over = {name: usage[name] for name, limit in budget.items() if usage[name] > limit}
+    assert not over, f"{update_type} update over {budget}: {usage['handlers']}"
+
+
+async def event_ids(bot, chat_id):
+    docs = await bot.db.collection("event_info").where("chat_id", "==", chat_id).get()
+    return [doc.id for doc in docs]
+
+
+@pytest.mark.parametrize("linked", [False, True], ids=["unlinked", "linked"])
+def test_text_update(bot, linked):
+    chat_id = new_chat_id()
+
+    async def scenario():
+        if linked:
+            await bot.link_calendar(chat_id)
+        await bot.text(chat_id, "Team sync tomorrow at 10am")
+        return await bot.text(chat_id, "Review on friday at 3pm")
+
+    usage = bot.run(scenario())
+    check_budget(usage, "text")
+    # the user's record is read once, whatever the handlers need from it
+    assert usage["reads"] == 1
+
+
+def test_photo_update(bot):
+    chat_id = new_chat_id()
+    # nothing is found on the first size of each photo, so it escalates
+    bot.extractions += [[], extraction(), [], extraction(2, "Review")]
+
+    async def scenario():
+        await bot.link_calendar(chat_id)
+        await bot.photo(chat_id)
+        return await bot.photo(chat_id)
+
+    usage = bot.run(scenario())
+    check_budget(usage, "photo")
+    assert [name for name, _ in bot.telegram.calls].count("getFile") == 4
+    # the escalation step stays in the progress message once extraction succeeds
+    assert any(
+        "sharper image" in text and "extraction successful" in text
+        for text in bot.telegram.texts("editMessageText")
+    )
+
+
+def test_regenerate_callback(bot):
+    chat_id = new_chat_id()
+    message = bot.message(chat_id, text="Team sync tomorrow at 10am")
+    message_id = message["message"]["message_id"]
+
+    async def scenario():
+        await bot.link_calendar(chat_id)
+        await bot.update(message)
+        await bot.callback(chat_id, f"RE^!{message_id}", reply_to=message["message"])
+        return await bot.callback(
+            chat_id, f"RE^!{message_id}", reply_to=message["message"]
+        )
+
+    check_budget(bot.run(scenario()), "callback")
+
+
+def test_view_and_delete_callbacks(bot):
+    chat_id = new_chat_id()
+    bot.extractions.append(
+        extraction(1, "Team sync") + extraction(2, "Review") + extraction(3, "Demo")
+    )
+
+    async def scenario():
+        await bot.link_calendar(chat_id)
+        await bot.text(chat_id, "Team sync, review and demo this week")
+        first, second, third = await event_ids(bot, chat_id)
+        usages = [
+            await bot.callback(chat_id, f"E#{first}"),
+            await bot.callback(chat_id, f"D3L%{first}"),
+            await bot.callback(chat_id, f"E#{second}"),
+            await bot.callback(chat_id, f"D3L%{second}"),
+        ]
+        return usages, await event_ids(bot, chat_id), third
+
+    usages, left, third = bot.run(scenario())
+    for usage in usages[2:]:
+        check_budget(usage, "callback")
+    assert left == [third]
+
+
+@pytest.mark.parametrize("cached", [True, False], ids=["cached", "uncached"])
+def test_chat_update(bot, cached):
+    from utils.session_cache import session_flush, session_drop
+
+    chat_id = new_chat_id()
+
+    async def scenario():
+        await bot.link_calendar(chat_id)
+        await bot.text(chat_id, "Team sync tomorrow at 10am")
+        await bot.callback(chat_id, "Confirm CHAT")
+        await bot.text(chat_id, "what's my next event")
+        if not cached:
+            # as after a restart or once the session went idle
+            await session_flush(bot.db, chat_id)
+            session_drop(chat_id)
+        return await bot.text(chat_id, "anything on tomorrow")
+
+    usage = bot.run(scenario())
+    if cached:
+        check_budget(usage, "chat")
+        # the turn is only queued in the session cache
+        assert usage["writes"] == 0
+    else:
+        check_budget(usage, "chat_resume")
+    assert "Team sync" in bot.telegram.texts("sendMessage")[-1]
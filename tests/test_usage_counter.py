@@ -0,0 +1,82 @@
+"""Buffered no_of_uses increments are written in batches Firestore accepts."""
+
+import asyncio
+
+import pytest
+
+from google.api_core.exceptions import ServiceUnavailable
+
+from utils import usage_counter
+from utils.sharded_counter import user_counter, counter_value, cached_values
+from utils.usage_counter import BATCH_LIMIT, flush_uses, pending_uses
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    """SQLite client recording the size of every committed batch."""
+    from utils.sqlite_store import SQLiteClient
+
+    client = SQLiteClient(str(tmp_path / "usage.db"))
+    client.batch_sizes = []
+    commit = SQLiteClient.commit
+
+    def recorded_commit(self, operations):
+        self.batch_sizes.append(len(operations))
+        return commit(self, operations)
+
+    monkeypatch.setattr(SQLiteClient, "commit", recorded_commit)
+    # the lock belongs to the event loop of the test
+    monkeypatch.setattr(usage_counter, "flush_lock", asyncio.Lock())
+    pending_uses.clear()
+    cached_values.clear()
+    yield client
+    pending_uses.clear()
+
+
+def uses(db, chat_id):
+    return asyncio.run(counter_value(user_counter(db, chat_id, "no_of_uses")))
+
+
+def test_flush_is_split_into_batches(db):
+    for chat_id in range(2 * BATCH_LIMIT + 1):
+        pending_uses[chat_id] = 2
+
+    asyncio.run(flush_uses(db))
+
+    assert db.batch_sizes == [BATCH_LIMIT, BATCH_LIMIT, 1]
+    assert pending_uses == {}
+    assert uses(db, 0) == 2
+    assert uses(db, 2 * BATCH_LIMIT) == 2
+
+
+def test_transient_failure_is_retried_on_the_next_flush(db, monkeypatch):
+    pending_uses.update({1: 1, 2: 3})
+    commit_uses = usage_counter.commit_uses
+
+    async def unavailable(db, uses):
+        raise ServiceUnavailable("try again")
+
+    monkeypatch.setattr(usage_counter, "commit_uses", unavailable)
+    asyncio.run(flush_uses(db))
+    assert pending_uses == {1: 1, 2: 3}
+
+    monkeypatch.setattr(usage_counter, "commit_uses", commit_uses)
+    asyncio.run(flush_uses(db))
+    assert pending_uses == {}
+    assert (uses(db, 1), uses(db, 2)) == (1, 3)
+
+
+def test_permanent_failure_drops_only_the_failing_entry(db, monkeypatch):
+    pending_uses.update({1: 1, 2: 3, 3: 5})
+    commit_uses = usage_counter.commit_uses
+
+    async def rejecting(db, uses):
+        if 2 in uses:
+            raise ValueError("bad entry")
+        await commit_uses(db, uses)
+
+    monkeypatch.setattr(usage_counter, "commit_uses", rejecting)
+    asyncio.run(flush_uses(db))
+
+    assert pending_uses == {}
+    assert (uses(db, 1), uses(db, 2), uses(db, 3)) == (1, 0, 5)
@@ -0,0 +1,129 @@
+"""The user's document is read once per update and its changes merged into one write."""
+
+import pytest
+
+from conftest import new_chat_id, extraction
+
+
+@pytest.fixture
+def user_record_ops(monkeypatch):
+    """Records the reads and writes of user_records documents, by document ID."""
+    from utils import sqlite_store
+
+    ops = {"reads": [], "writes": []}
+    document_get = sqlite_store.DocumentReference.get
+    query_get = sqlite_store.Query.get
+    commit = sqlite_store.SQLiteClient.commit
+
+    def user_document(reference):
+        return reference.parent.id == "user_records" and reference.parent.parent is None
+
+    async def counted_document_get(self):
+        if user_document(self):
+            ops["reads"].append(self.id)
+        return await document_get(self)
+
+    async def counted_query_get(self):
+        docs = await query_get(self)
+        if self.collection.id == "user_records" and self.collection.parent is None:
+            ops["reads"] += [doc.id for doc in docs]
+        return docs
+
+    def counted_commit(self, operations):
+        for operation, reference, *data in operations:
+            if user_document(reference):
+                ops["writes"].append((operation, reference.id, *data))
+        return commit(self, operations)
+
+    monkeypatch.setattr(sqlite_store.DocumentReference, "get", counted_document_get)
+    monkeypatch.setattr(sqlite_store.Query, "get", counted_query_get)
+    monkeypatch.setattr(sqlite_store.SQLiteClient, "commit", counted_commit)
+    return ops
+
+
+def test_text_update_of_new_user(bot, user_record_ops):
+    chat_id = new_chat_id()
+
+    bot.run(bot.text(chat_id, "Team sync tomorrow at 10am in the office"))
+
+    assert user_record_ops["reads"] == [str(chat_id)]
+    assert [write[:2] for write in user_record_ops["writes"]] == [
+        ("create", str(chat_id))
+    ]
+    assert "Team sync" in bot.telegram.texts("editMessageText")[-1]
+
+
+def test_text_update_of_known_user_writes_nothing_to_its_document(bot, user_record_ops):
+    chat_id = new_chat_id()
+
+    async def scenario():
+        await bot.add_user(chat_id)
+        user_record_ops["reads"].clear()
+        user_record_ops["writes"].clear()
+        await bot.text(chat_id, "Team sync tomorrow at 10am in the office")
+
+    bot.run(scenario())
+
+    # the use is counted in the buffered usage counters, not the document
+    assert user_record_ops["reads"] == [str(chat_id)]
+    assert user_record_ops["writes"] == []
+
+
+def test_photo_update_of_new_user(bot, user_record_ops):
+    chat_id = new_chat_id()
+    # nothing found on the first size, the events on the larger one
+    bot.extractions += [[], extraction()]
+
+    bot.run(bot.photo(chat_id))
+
+    assert user_record_ops["reads"] == [str(chat_id)]
+    assert [write[:2] for write in user_record_ops["writes"]] == [
+        ("create", str(chat_id))
+    ]
+    assert [name for name, _ in bot.telegram.calls].count("getFile") == 2
+
+
+def test_callback_update_merges_its_changes(bot, user_record_ops):
+    chat_id = new_chat_id()
+
+    async def scenario():
+        await bot.add_user(chat_id)
+        user_record_ops["reads"].clear()
+        user_record_ops["writes"].clear()
+        await bot.callback(chat_id, "Confirm CHAT")
+
+    bot.run(scenario())
+
+    # chat mode needs nothing of the document, so it is not read at all
+    assert user_record_ops["reads"] == []
+    assert len(user_record_ops["writes"]) == 1
+    operation, doc_id, fields = user_record_ops["writes"][0]
+    assert (operation, doc_id) == ("update", str(chat_id))
+    assert fields["position"] == "CHATTING"
+    assert "chat_session" in fields
+
+
+def test_callback_update_reads_the_document_once(bot, user_record_ops):
+    chat_id = new_chat_id()
+    message = bot.message(chat_id, text="Team sync tomorrow at 10am in the office")
+    calendar_ids = []
+
+    async def scenario():
+        calendar_ids.append(await bot.link_calendar(chat_id))
+        await bot.update(message)
+        user_record_ops["reads"].clear()
+        user_record_ops["writes"].clear()
+        # the old events are deleted and the new ones added to the calendar,
+        # with the calendar ID and the tokens of a single read
+        await bot.callback(
+            chat_id,
+            f"RE^!{message['message']['message_id']}",
+            reply_to=message["message"],
+        )
+
+    bot.run(scenario())
+
+    assert user_record_ops["reads"] == [str(chat_id)]
+    assert user_record_ops["writes"] == []
+    events = bot.calendar.calendars[calendar_ids[0]].values()
+    assert [event["summary"] for event in events] == ["Team sync"]
@@ -0,0 +1,379 @@
+import asyncio
+import json
+import random
+import time
+import uuid
+from urllib.parse import quote
+
+import httpx
+
+from utils.token_manager import token_get, token_rejected
+from utils.metrics import increment, observe
+from config import CALENDAR_MAX_ATTEMPTS, CALENDAR_BATCH_SIZE
+
+API_ROOT = "https://www.googleapis.com"
+BATCH_URL = f"{API_ROOT}/batch/calendar/v3"
+
+# responses worth sending the request again for
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def calendar_path(calendar_id, event_id=None):
+    """Returns the API path of a calendar's events, or of one of its events."""
+    path = f"/calendar/v3/calendars/{quote(calendar_id, safe='')}/events"
+    if event_id is not None:
+        path += f"/{quote(event_id, safe='')}"
+    return path
+
+
+def retry_delay(response, attempt):
+    """Returns how long to wait before the next attempt of a request.
+
+    Uses the Retry-After header of the response when Google sends one,
+    exponential backoff with jitter otherwise.
+    """
+    if response is not None:
+        retry_after = response.headers.get("retry-after", "")
+        if retry_after.isdigit():
+            return min(int(retry_after), 30)
+    return min(0.5 * 2**attempt, 8) * random.uniform(0.5, 1.5)
+
+
+# There is no per-user Calendar service object to build or cache any more:
+# every request goes out on the shared httpx session, and the token manager
+# keeps each user's access token in memory, which is what the service cache
+# used to save.
+
+
+async def calendar_request(session, context, method, url, headers=None, **kwargs):
+    """Sends a request to the Google Calendar API with the user's access token.
+
+    Responses with a status in RETRY_STATUSES and connection errors are
+    retried, up to CALENDAR_MAX_ATTEMPTS attempts in all. The access token
+    comes from the token manager, a 401 gets a new one once and sends the
+    request again.
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        method (str): HTTP method.
+        url (str): Full URL of the request.
+        headers (dict, optional): Extra headers. Defaults to None.
+        **kwargs: Passed on to session.request (json, params, content).
+
+    Returns:
+        httpx.Response: The last response received.
+
+    Raises:
+        httpx.TransportError: If the last attempt could not reach Google.
+    """
+    token = await token_get(session, context)
+    refreshed = False
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            response = await session.request(
+                method,
+                url,
+                headers={"Authorization": f"Bearer {token}", **(headers or {})},
+                **kwargs,
+            )
+        except httpx.TransportError:
+            if attempt + 1 >= CALENDAR_MAX_ATTEMPTS:
+                raise
+            response = None
+        observe("calendar.request", time.perf_counter() - start)
+
+        if response is not None and response.status_code == 401 and not refreshed:
+            refreshed = True
+            token = await token_rejected(session, context, token)
+            if token is None:
+                return response
+            continue
+
+        if response is None or response.status_code in RETRY_STATUSES:
+            attempt += 1
+            if attempt < CALENDAR_MAX_ATTEMPTS:
+                increment("calendar.retries")
+                await asyncio.sleep(retry_delay(response, attempt - 1))
+                continue
+
+        return response
+
+
+def batch_body(calls, indices, boundary):
+    """Encodes calls as the multipart/mixed body of a batch request.
+
+    Args:
+        calls (list): (method, path, JSON body or None) tuples.
+        indices (list): Indices of the calls to include.
+        boundary (str): Multipart boundary.
+
+    Returns:
+        str: The request body.
+    """
+    parts = []
+    for index in indices:
+        method, path, body = calls[index]
+        part = (
+            f"--{boundary}\r\n"
+            "Content-Type: application/http\r\n"
+            f"Content-ID: <item-{index}>\r\n\r\n"
+            f"{method} {path} HTTP/1.1\r\n"
+        )
+        if body is not None:
+            part += f"Content-Type: application/json\r\n\r\n{json.dumps(body)}"
+        parts.append(part + "\r\n")
+    parts.append(f"--{boundary}--")
+    return "".join(parts)
+
+
+def parse_batch_response(response):
+    """Decodes the multipart/mixed response of a batch request.
+
+    Args:
+        response (httpx.Response): Response of the batch request.
+
+    Returns:
+        dict: Call index -> (HTTP status, decoded JSON body or None).
+    """
+    content_type = response.headers.get("content-type", "")
+    boundary = content_type.partition("boundary=")[2].split(";")[0].strip('"')
+    text = response.text.replace("\r\n", "\n")
+
+    results = {}
+    for part in text.split(f"--{boundary}")[1:]:
+        if part.startswith("--"):
+            break
+        part_headers, _, http = part.strip("\n").partition("\n\n")
+        content_id = ""
+        for line in part_headers.split("\n"):
+            name, _, value = line.partition(":")
+            if name.strip().lower() == "content-id":
+                content_id = value.strip().strip("<>")
+        index = int(content_id.rpartition("-")[2])
+
+        status_line, _, rest = http.partition("\n")
+        status = int(status_line.split()[1])
+        body = rest.partition("\n\n")[2].strip()
+        results[index] = (status, json.loads(body) if body else None)
+
+    return results
+
+
+async def calendar_batch(session, context, calls):
+    """Sends calls to the Calendar API in batch requests of CALENDAR_BATCH_SIZE.
+
+    Calls answered with a status in RETRY_STATUSES, or with a 401 before the
+    token was refreshed, are sent again in a new batch, up to
+    CALENDAR_MAX_ATTEMPTS times. An insert carrying its own event ID that is
+    answered 409 was created by an earlier attempt, the event is read back
+    and counts as created.
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        calls (list): (method, path, JSON body or None) tuples, the path
+                      starting with /calendar/v3.
+
+    Returns:
+        list: (HTTP status, decoded JSON body or None) of every call, in order.
+              The status is None for calls whose batch request failed.
+    """
+    results = [(None, None)] * len(calls)
+    pending = list(range(len(calls)))
+    refreshed = False
+
+    for attempt in range(CALENDAR_MAX_ATTEMPTS):
+        retry = []
+        for i in range(0, len(pending), CALENDAR_BATCH_SIZE):
+            indices = pending[i : i + CALENDAR_BATCH_SIZE]
+            boundary = f"batch_{uuid.uuid4().hex}"
+            try:
+                response = await calendar_request(
+                    session,
+                    context,
+                    "POST",
+                    BATCH_URL,
+                    headers={"Content-Type": f"multipart/mixed; boundary={boundary}"},
+                    content=batch_body(calls, indices, boundary),
+                )
+            except httpx.TransportError as e:
+                print(f"An error occurred in calendar_batch : {e}")
+                continue
+
+            if response.status_code != 200:
+                print(f"An error occurred in calendar_batch : {response.text}")
+                for index in indices:
+                    results[index] = (response.status_code, None)
+                continue
+
+            for index, result in parse_batch_response(response).items():
+                results[index] = result
+                if result[0] in RETRY_STATUSES or (result[0] == 401 and not refreshed):
+                    retry.append(index)
+
+        if not retry or attempt + 1 >= CALENDAR_MAX_ATTEMPTS:
+            break
+        if any(results[index][0] == 401 for index in retry):
+            refreshed = True
+            # the calls were rejected with the token currently in use
+            rejected = await token_get(session, context)
+            if await token_rejected(session, context, rejected) is None:
+                break
+        increment("calendar.retries", len(retry))
+        await asyncio.sleep(retry_delay(None, attempt))
+        pending = retry
+
+    # inserts refused because an earlier attempt already created the event
+    created = [
+        index
+        for index, (status, _) in enumerate(results)
+        if status == 409 and calls[index][0] == "POST" and inserted_id(calls[index][2])
+    ]
+    if created:
+        increment("calendar.insert_conflicts", len(created))
+        fetched = await calendar_batch(
+            session,
+            context,
+            [
+                (
+                    "GET",
+                    f"{calls[index][1]}/{quote(inserted_id(calls[index][2]), safe='')}",
+                    None,
+                )
+                for index in created
+            ],
+        )
+        for index, result in zip(created, fetched):
+            results[index] = result
+
+    return results
+
+
+async def insert_calendar(session, context, body):
+    """Creates a secondary calendar (calendars.insert).
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        body (dict): Calendar resource, e.g. {"summary": ..., "timeZone": ...}.
+
+    Returns:
+        httpx.Response: Response of the API.
+    """
+    return await calendar_request(
+        session, context, "POST", f"{API_ROOT}/calendar/v3/calendars", json=body
+    )
+
+
+def inserted_id(body):
+    """Returns the client-chosen event ID of an insert body, or None."""
+    return body.get("id") if isinstance(body, dict) else None
+
+
+async def insert_event(session, context, calendar_id, body):
+    """Creates an event (events.insert).
+
+    When body has an ID and the insert is answered 409, an earlier attempt
+    whose answer was lost created the event, and the event is read back.
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        calendar_id (str): Google Calendar ID.
+        body (dict): Event resource.
+
+    Returns:
+        httpx.Response: Response of the API.
+    """
+    response = await calendar_request(
+        session,
+        context,
+        "POST",
+        f"{API_ROOT}{calendar_path(calendar_id)}",
+        json=body,
+    )
+    if response.status_code == 409 and inserted_id(body):
+        increment("calendar.insert_conflicts")
+        return await get_event(session, context, calendar_id, inserted_id(body))
+    return response
+
+
+async def get_event(session, context, calendar_id, event_id):
+    """Reads an event (events.get).
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        calendar_id (str): Google Calendar ID.
+        event_id (str): ID of the event.
+
+    Returns:
+        httpx.Response: Response of the API.
+    """
+    return await calendar_request(
+        session,
+        context,
+        "GET",
+        f"{API_ROOT}{calendar_path(calendar_id, event_id)}",
+    )
+
+
+async def delete_event(session, context, calendar_id, event_id):
+    """Deletes an event (events.delete).
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        calendar_id (str): Google Calendar ID.
+        event_id (str): ID of the event.
+
+    Returns:
+        httpx.Response: Response of the API.
+    """
+    return await calendar_request(
+        session,
+        context,
+        "DELETE",
+        f"{API_ROOT}{calendar_path(calendar_id, event_id)}",
+    )
+
+
+async def list_events(session, context, calendar_id, time_min=None, max_results=250):
+    """Lists the events of a calendar (events.list), following the result pages.
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        calendar_id (str): Google Calendar ID.
+        time_min (str, optional): RFC 3339 lower bound of the events' end times.
+                                  Defaults to None.
+        max_results (int, optional): Events per page. Defaults to 250.
+
+    Returns:
+        list or None: Event resources, or None if a page could not be read.
+    """
+    params = {"maxResults": max_results, "singleEvents": "true"}
+    if time_min:
+        params["timeMin"] = time_min
+
+    events = []
+    while True:
+        response = await calendar_request(
+            session,
+            context,
+            "GET",
+            f"{API_ROOT}{calendar_path(calendar_id)}",
+            params=params,
+        )
+        if response.status_code != 200:
+            print(f"Error listing events : {response.text}")
+            return None
+
+        page = response.json()
+        events += page.get("items", [])
+        if not page.get("nextPageToken"):
+            return events
+        params["pageToken"] = page["nextPageToken"]
@@ -1,11 +1,45 @@
 from utils.telegram_handlers import send_msg, edit_msg, pin_msg, unpin_msg
 from utils.data_validation import escape_markdownv2
-from utils.firebase_handlers import retrieve_upcoming_events
-from config import chat_model
+from utils.firebase_handlers import (
+    retrieve_upcoming_events,
+    retrieve_all_events,
+    event_to_list,
+)
+from utils.event_index import index_build, index_exists, index_search
+from utils.metrics import observe
+from utils.gemini_models import record_model_usage, generate
+from utils.model_scheduler import model_slot
+from utils.chat_tools import CHAT_TOOLS, execute_tool
+from utils.chat_intents import answer_chat_intent
+from utils.user_context import user_context_set
+from utils.session_cache import (
+    session_put,
+    session_add_turns,
+    session_flush,
+    session_drop,
+)
+from config import (
+    chat_model,
+    CHAT_STREAM_EDIT_INTERVAL,
+    CHAT_WINDOW_MESSAGES,
+    CHAT_SUMMARY_BATCH,
+    EVENT_INDEX_TOP_K,
+    CHAT_TOOLS_ENABLED,
+    CHAT_MAX_TOOL_ROUNDS,
+)
+from google.cloud.firestore_v1.base_query import FieldFilter
 import asyncio
+import datetime
+import re
+import time
 
+# chat IDs whose older turns are being folded into the summary
+compactions = set()
 
-async def search_handler(db, session, chat_id, confirm=False, sent_message_id=None):
+
+async def search_handler(
+    db, session, chat_id, context, confirm=False, sent_message_id=None
+):
     """Initiates the chat functionality for a user.
 
     If confirm is False, sends a confirmation message to the user to share
@@ -17,6 +51,7 @@ async def search_handler(db, session, chat_id, confirm=False, sent_message_id=No
         db: Firestore client instance.
         session: httpx client session object.
         chat_id (int): Telegram chat ID of the user.
+        context (dict): Context of the user for this update.
         confirm (bool, optional): Whether the user confirmed the chat initiation.
             Defaults to False.
         sent_message_id (int, optional): Message ID of the previously sent
@@ -28,7 +63,7 @@ async def search_handler(db, session, chat_id, confirm=False, sent_message_id=No
     """
     try:
         if not confirm:
-            text = "By clicking confirm, your 10 upcoming event details will be shared with Gemini. Your chat history will be cleared when this chat session is closed."
+            text = "By clicking confirm, your event details will be shared with Gemini. Your chat history will be cleared when this chat session is closed."
             reply_markup = {
                 "inline_keyboard": [
                     [
@@ -51,11 +86,11 @@ async def search_handler(db, session, chat_id, confirm=False, sent_message_id=No
                 sent_message_id,
                 "Getting chat mode ready! TimeSked will be right with you to talk about your events. 💬🗓️",
             )
-            col_ref = db.collection("user_records")
-            doc_ref = col_ref.document(str(chat_id))
-            doc_ref.update({"position": "CHATTING"})
+            user_context_set(context, {"position": "CHATTING"})
 
-            chat_history_creator(db, chat_id, doc_ref)
+            chat_session = await chat_history_creator(db, chat_id, context)
+            if chat_session is not None:
+                session_put(chat_id, "CHATTING", chat_session)
             await edit_msg(
                 session,
                 chat_id,
@@ -81,45 +116,177 @@ async def search_handler(db, session, chat_id, confirm=False, sent_message_id=No
         print(f"Error in search_handler {e}")
 
 
-def chat_history_creator(db, chat_id, doc_ref):
-    """Creates and initializes the chat history for a user.
+async def chat_history_creator(db, chat_id, context):
+    """Creates and initializes the chat session of a user.
 
-    Retrieves upcoming events from the database, formats them into a message,
-    and updates the user's document in Firestore with the initial chat history.
+    Retrieves upcoming events from the database, formats them into a compact
+    table as the context message, and records a new chat session (along with
+    the link aliases used in the table) in the user's context, so it is written
+    together with the new position. In function calling mode the events are
+    left out, as the model queries them through tools. The turns of the
+    conversation are stored separately, in the chat_turns subcollection.
 
     Args:
         db: Firestore client instance.
         chat_id (int): Telegram chat ID of the user.
-        doc_ref: Firestore document reference of the user.
+        context (dict): Context of the user for this update.
+
+    Returns:
+        dict: The new chat session, with an empty list of turns, or None if an
+              error occurs.
 
     Raises:
         Exception: If an error occurs during the process, prints the error
             message to the console.
     """
     try:
-        result = retrieve_upcoming_events(db, chat_id)
-        output = f"{result} This list contains the details about the upcoming events of the user."
-        messages = [{"role": "user", "parts": [output]}]
-        doc_ref.update({"chat_history": messages})
+        if CHAT_TOOLS_ENABLED:
+            today = datetime.date.today()
+            output = f"Today is {today.strftime('%A')}, {today.strftime('%Y-%m-%d')}. Use the tools to look up the user's events whenever a question needs them."
+            links = {}
+        else:
+            result = await retrieve_upcoming_events(db, chat_id)
+            output, links = compact_event_table(result)
+        chat_session = {
+            "context": output,
+            "links": links,
+            "summary": None,
+            "turn_count": 0,
+            "summarized_upto": 0,
+        }
+        user_context_set(context, {"chat_session": chat_session})
+        return {**chat_session, "turns": []}
 
     except Exception as e:
         print(f"Error in chat_history_creator {e}")
+        return None
+
+
+def compact_event_table(events, header=None, alias_prefix="L"):
+    """Serializes events into a compact table for the chat model context.
+
+    Each event takes a single "|" separated line. Empty values are written as
+    "-", the end date is left out when it equals the start date, and the long
+    Google Calendar links are replaced by short aliases (L1, L2, ...) that are
+    resolved again after generation. Internal IDs are never included.
+
+    Args:
+        events (list or None): Events as returned by retrieve_upcoming_events.
+        header (str, optional): First line of the table. Defaults to a header
+                                for the user's upcoming events.
+        alias_prefix (str, optional): Prefix of the link aliases.
+                                      Defaults to "L".
+
+    Returns:
+        tuple: The table as a string, and a dictionary mapping every link alias
+               to its link.
+    """
+    if header is None:
+        today = datetime.date.today().strftime("%Y-%m-%d")
+        header = f"Upcoming events of the user (today is {today}):"
+    lines = [header]
+    links = {}
+
+    if not isinstance(events, list) or not events:
+        lines.append("No events.")
+        return "\n".join(lines), links
+
+    lines.append(
+        "#|name|start date|end date|start time|end time|location|description|link"
+    )
+    for idx, event in enumerate(events, start=1):
+        start_date, end_date = event[1], event[2]
+        start_time, end_time = event[3], event[4]
+
+        alias = None
+        if event[7]:
+            alias = f"{alias_prefix}{idx}"
+            links[alias] = event[7]
+
+        values = [
+            event[0],
+            start_date,
+            end_date if end_date != start_date else None,
+            start_time[:5] if start_time else None,
+            end_time[:5] if end_time else None,
+            event[5],
+            event[6],
+            alias,
+        ]
+        values = [
+            " ".join(str(value).replace("|", "/").split()) if value else "-"
+            for value in values
+        ]
+        lines.append(f"{idx}|" + "|".join(values))
+
+    return "\n".join(lines), links
+
+
+def resolve_link_aliases(text, links):
+    """Replaces the link aliases written by the chat model with the real links.
+
+    Args:
+        text (str): Reply of the chat model.
+        links (dict): Mapping of link aliases to links.
+
+    Returns:
+        str: The reply with every known alias replaced by its link.
+    """
+    if not links:
+        return text
+
+    return re.sub(
+        r"\b[A-Z]\d+\b", lambda alias: links.get(alias.group(0), alias.group(0)), text
+    )
+
+
+async def relevant_events(db, chat_id, query_message):
+    """Selects the events of the user's whole history most relevant to a question.
+
+    The user's search index is built from all their events on first use, and
+    kept up to date as events are added and deleted.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+        query_message (str): The user's question.
+
+    Returns:
+        tuple: A compact table of up to EVENT_INDEX_TOP_K relevant events (None
+               if nothing matched), and the dictionary of its link aliases.
+    """
+    if not index_exists(chat_id):
+        index_build(chat_id, await retrieve_all_events(db, chat_id))
+
+    matches = index_search(chat_id, query_message, EVENT_INDEX_TOP_K)
+    if not matches:
+        return None, {}
+
+    events = [event_to_list(doc_id, event) for doc_id, event in matches]
+    return compact_event_table(
+        events,
+        "Events from the user's full history that may be relevant to the question:",
+        "R",
+    )
 
 
 async def chat_handler(
-    db, session, chat_id, previous_messages, query_message, received_message_id
+    db, session, chat_id, chat_session, query_message, received_message_id
 ):
     """Handles user queries in the chat.
 
-    Appends the user's message to the chat history, generates a response
-    using the chat model, sends the response back to the user, and updates
-    the chat history in Firestore.
+    Simple questions about the user's events are answered directly by
+    answer_chat_intent. Otherwise the model context is built from the chat
+    session and either the events most relevant to the question or, in
+    function calling mode, the event tools.
+    Streams a response from the chat model into a placeholder message, renders
+    the final reply with MarkdownV2, and stores the new turn in Firestore.
 
     Args:
         db: Firestore client instance.
         session: httpx client session object.
         chat_id (int): Telegram chat ID of the user.
-        previous_messages (list): List of previous messages in the chat.
+        chat_session (dict): Chat session returned by chat_history_retriever.
         query_message (str): The user's query message.
         received_message_id (int): Message ID of the received user message.
 
@@ -128,77 +295,430 @@ async def chat_handler(
             message to the console.
     """
     try:
-        previous_messages.append(
-            {
-                "role": "user",
-                "parts": [query_message],
-            }
-        )
+        reply = await answer_chat_intent(db, chat_id, query_message)
+        if reply is not None:
+            await send_msg(
+                session,
+                chat_id,
+                received_message_id,
+                escape_markdownv2(reply),
+                None,
+                "MarkdownV2",
+            )
+            asyncio.create_task(
+                chat_history_updater(db, chat_id, chat_session, query_message, reply)
+            )
+            return
 
-        response = chat_model.generate_content(previous_messages)
-        previous_messages.append({"role": "model", "parts": [response.text]})
+        messages = chat_contents(chat_session)
+        links = dict(chat_session.get("links") or {})
+        tool_state = None
+        parts = [query_message]
 
-        text = response.text
-        output_text = escape_markdownv2(text)
-        send_response = await send_msg(
-            session, chat_id, received_message_id, output_text, parse_mode="MarkdownV2"
+        if CHAT_TOOLS_ENABLED:
+            tool_state = {"refs": {}, "links": links}
+        else:
+            retrieved, retrieved_links = await relevant_events(
+                db, chat_id, query_message
+            )
+            links.update(retrieved_links)
+            if retrieved:
+                parts = [retrieved, query_message]
+
+        messages.append({"role": "user", "parts": parts})
+
+        response = await send_msg(session, chat_id, received_message_id, "💬 ...")
+        sent_message_id = response.json()["result"]["message_id"]
+
+        text = await stream_chat_reply(
+            db, session, chat_id, sent_message_id, messages, tool_state
         )
 
-        if not send_response:
-            await send_msg(session, chat_id, received_message_id, text)
+        if not text.strip():
+            # an empty stream would leave the placeholder as the reply
+            await edit_msg(
+                session,
+                chat_id,
+                sent_message_id,
+                "❌ TimeSked couldn't come up with a reply. Please try asking again.",
+            )
+            return
+
+        # the aliases of tool results and retrieved events only live for this
+        # turn, so the history keeps the reply with its links resolved
+        text = resolve_link_aliases(text, links)
+
+        # final edit with MarkdownV2, edit_msg falls back to the plain text on
+        # failure. Telegram messages are limited to 4096 characters, escapes
+        # included.
+        await edit_msg(
+            session,
+            chat_id,
+            sent_message_id,
+            truncate_markdownv2(escape_markdownv2(text), 4096),
+            None,
+            None,
+            "MarkdownV2",
+            text[:4096],
+        )
 
-        asyncio.create_task(chat_history_updater(db, chat_id, previous_messages))
+        asyncio.create_task(
+            chat_history_updater(db, chat_id, chat_session, query_message, text)
+        )
 
     except Exception as e:
         print(f"Error in chat_handler {e}")
 
 
-async def chat_history_updater(db, chat_id, output):
-    """Updates the chat history of a user in Firestore.
+async def stream_chat_reply(
+    db, session, chat_id, sent_message_id, messages, tool_state=None
+):
+    """Streams a chat model reply into an already sent Telegram message.
+
+    The accumulated text is written into the message with plain text edits,
+    at most once every CHAT_STREAM_EDIT_INTERVAL seconds. When tool_state is
+    given the model can call the event tools; their results are sent back and
+    the model is called again, for at most CHAT_MAX_TOOL_ROUNDS rounds. The
+    time to the first token, the total streaming time, the tool rounds and the
+    token usage are recorded.
+
+    Args:
+        db: Firestore client instance.
+        session: httpx client session object.
+        chat_id (int): Telegram chat ID of the user.
+        sent_message_id (int): Message ID of the placeholder message to edit.
+        messages (list): Chat history, ending with the user's query.
+        tool_state (dict, optional): Refs and link aliases handed out by the
+                                     tools during this turn. Defaults to None,
+                                     which disables the tools.
+
+    Returns:
+        str: The complete reply text.
+    """
+    messages = list(messages)
+    start = time.perf_counter()
+
+    for tool_round in range(CHAT_MAX_TOOL_ROUNDS + 1):
+        # the last round goes without tools so the model has to answer
+        use_tools = tool_state is not None and tool_round < CHAT_MAX_TOOL_ROUNDS
+        # a slot per model call, held while the reply streams in and given back
+        # before the tools run
+        async with model_slot("chat"):
+            call_start = time.perf_counter()
+            response = None
+            try:
+                response = await chat_model.generate_content_async(
+                    messages, stream=True, tools=CHAT_TOOLS if use_tools else None
+                )
+                text, function_calls = await edit_streamed_chunks(
+                    session, chat_id, sent_message_id, response, start
+                )
+            finally:
+                record_model_usage(
+                    chat_model,
+                    "chat",
+                    response,
+                    time.perf_counter() - call_start,
+                    tool_round + 1,
+                    chat_id,
+                )
+
+        if not function_calls:
+            break
+
+        messages.append(
+            {
+                "role": "model",
+                "parts": [{"function_call": call} for call in function_calls],
+            }
+        )
+        results = await asyncio.gather(
+            *(
+                execute_tool(db, chat_id, call["name"], call["args"], tool_state)
+                for call in function_calls
+            )
+        )
+        messages.append(
+            {
+                "role": "function",
+                "parts": [
+                    {
+                        "function_response": {
+                            "name": call["name"],
+                            "response": result,
+                        }
+                    }
+                    for call, result in zip(function_calls, results)
+                ],
+            }
+        )
+
+    if tool_state is not None:
+        observe("chat.tool_rounds", tool_round)
+    observe("chat.stream_duration", time.perf_counter() - start)
+    return text
+
+
+async def edit_streamed_chunks(session, chat_id, sent_message_id, response, start):
+    """Accumulates streamed chunks and edits them into the placeholder message.
+
+    Args:
+        session: httpx client session object.
+        chat_id (int): Telegram chat ID of the user.
+        sent_message_id (int): Message ID of the placeholder message to edit.
+        response: Streaming response of generate_content_async.
+        start (float): time.perf_counter() value when the chat turn started.
+
+    Returns:
+        tuple: The text of the response, and the list of function calls
+               ({"name", "args"}) the model made.
+    """
+    text = ""
+    function_calls = []
+    last_edit = None
+    async for chunk in response:
+        try:
+            parts = chunk.parts
+        except ValueError:
+            # chunk without any candidate (eg. only a finish reason)
+            continue
+
+        chunk_text = ""
+        for part in parts:
+            if part.function_call.name:
+                function_calls.append(
+                    {
+                        "name": part.function_call.name,
+                        "args": dict(part.function_call.args.items()),
+                    }
+                )
+            else:
+                chunk_text += part.text
+
+        if not text and chunk_text:
+            ttft = time.perf_counter() - start
+            observe("chat.time_to_first_token", ttft)
+            print(f"Chat time to first token : {ttft:.2f}s")
+
+        text += chunk_text
+        now = time.perf_counter()
+        if text and (last_edit is None or now - last_edit >= CHAT_STREAM_EDIT_INTERVAL):
+            # Telegram messages are limited to 4096 characters
+            await edit_msg(session, chat_id, sent_message_id, text[:4096])
+            last_edit = now
+
+    return text, function_calls
+
+
+def truncate_markdownv2(text, limit):
+    """Cuts escaped MarkdownV2 text to at most limit characters.
+
+    A cut right after an escaping backslash would leave it dangling, so the
+    backslash goes too.
+
+    Args:
+        text (str): Text escaped with escape_markdownv2.
+        limit (int): Maximum number of characters.
+
+    Returns:
+        str: The text, cut to the limit.
+    """
+    text = text[:limit]
+    if (len(text) - len(text.rstrip("\\"))) % 2:
+        text = text[:-1]
+    return text
+
+
+def chat_contents(chat_session):
+    """Builds the model contents for a chat turn from the chat session.
+
+    The contents are the event context (with the rolling summary of the older
+    turns, if any) followed by every turn not folded into the summary yet: the
+    sliding window of recent turns and those waiting to be summarized. No turn
+    is left out of both, and the size of every request stays below
+    CHAT_WINDOW_MESSAGES + CHAT_SUMMARY_BATCH turns however long the chat gets.
+
+    Args:
+        chat_session (dict): Chat session returned by chat_history_retriever.
+
+    Returns:
+        list: List of messages to be sent to the chat model.
+    """
+    context = chat_session["context"]
+    if chat_session.get("summary"):
+        context += f"\n\nSummary of the earlier conversation with the user: {chat_session['summary']}"
+
+    messages = [{"role": "user", "parts": [context]}]
+    for turn in chat_session["turns"]:
+        if turn["index"] < chat_session["summarized_upto"]:
+            continue
+        messages.append({"role": turn["role"], "parts": [turn["text"]]})
+
+    return messages
+
+
+def chat_turns_ref(db, chat_id):
+    """Returns the chat_turns subcollection of a user.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+
+    Returns:
+        google.cloud.firestore.CollectionReference: The chat_turns collection.
+    """
+    return db.collection("user_records").document(str(chat_id)).collection("chat_turns")
+
+
+async def chat_history_updater(db, chat_id, chat_session, query_message, reply):
+    """Stores a chat turn.
+
+    The user's query and the model's reply are added to the chat session as two
+    turns. For cached sessions they are queued and written by the session cache
+    in its next flush, otherwise they are written right away as two small
+    documents in the chat_turns subcollection, in a single batch with the new
+    turn count. Once enough turns have dropped out of the window, they are
+    folded into the rolling summary.
 
     Args:
         db: Firestore client instance.
         chat_id (int): Telegram chat ID of the user.
-        output (list): Updated list of messages representing the chat history.
+        chat_session (dict): Chat session returned by chat_history_retriever.
+        query_message (str): The user's query message.
+        reply (str): The model's reply.
 
     Raises:
         Exception: If an error occurs during the process, prints the error
             message to the console.
     """
     try:
-        col_ref = db.collection("user_records")
-        doc_ref = col_ref.document(str(chat_id))
-        doc_ref.update({"chat_history": output})
+        turn_count = chat_session["turn_count"]
+        turns = [
+            {"index": turn_count, "role": "user", "text": query_message},
+            {"index": turn_count + 1, "role": "model", "text": reply},
+        ]
+        turn_count += 2
+
+        if not session_add_turns(chat_id, turns):
+            turns_ref = chat_turns_ref(db, chat_id)
+            batch = db.batch()
+            for turn in turns:
+                batch.set(turns_ref.document(f"{turn['index']:06d}"), turn)
+            user_ref = db.collection("user_records").document(str(chat_id))
+            batch.update(user_ref, {"chat_session.turn_count": turn_count})
+            await batch.commit()
+
+        chat_session["turns"] += turns
+        chat_session["turn_count"] = turn_count
+        unsummarized = (
+            turn_count - CHAT_WINDOW_MESSAGES - chat_session["summarized_upto"]
+        )
+        # summarized_upto only moves once the summary is stored, so a turn
+        # arriving meanwhile must not start a second compaction
+        if unsummarized >= CHAT_SUMMARY_BATCH and chat_id not in compactions:
+            compactions.add(chat_id)
+            try:
+                await chat_history_compactor(db, chat_id, chat_session)
+            finally:
+                compactions.discard(chat_id)
+
     except Exception as e:
         print(f"Error in chat_history_updater {e}")
 
 
-def chat_history_retriever(db, chat_id):
-    """Retrieves the chat history of a user from Firestore.
+async def chat_history_compactor(db, chat_id, chat_session):
+    """Folds the turns that left the window into the rolling summary.
+
+    The chat session holds every turn that is not summarized yet, so nothing is
+    read. Pending turns of a cached session are flushed first, then the folded
+    turns are deleted from the chat_turns subcollection and the new summary is
+    stored in the chat session.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+        chat_session (dict): Chat session returned by chat_history_retriever.
+    """
+    cutoff = chat_session["turn_count"] - CHAT_WINDOW_MESSAGES
+    folded = [turn for turn in chat_session["turns"] if turn["index"] < cutoff]
+    transcript = "\n".join(f"{turn['role']}: {turn['text']}" for turn in folded)
+
+    prompt = "Summarise the following conversation between a user and TimeSked (the model) in at most 120 words. Keep every fact, date, and event name the user asked about or was told."
+    if chat_session.get("summary"):
+        prompt += f"\n\nSummary of the conversation before this part: {chat_session['summary']}"
+    prompt += f"\n\nConversation:\n{transcript}"
+
+    response = await generate(
+        chat_model, prompt, "chat_summary", chat_id=chat_id, priority="background"
+    )
+    summary = response.text
+
+    await session_flush(db, chat_id)
+
+    turns_ref = chat_turns_ref(db, chat_id)
+    batch = db.batch()
+    for turn in folded:
+        batch.delete(turns_ref.document(f"{turn['index']:06d}"))
+    user_ref = db.collection("user_records").document(str(chat_id))
+    batch.update(
+        user_ref,
+        {
+            "chat_session.summary": summary,
+            "chat_session.summarized_upto": cutoff,
+        },
+    )
+    await batch.commit()
+
+    chat_session["summary"] = summary
+    chat_session["summarized_upto"] = cutoff
+    chat_session["turns"] = [
+        turn for turn in chat_session["turns"] if turn["index"] >= cutoff
+    ]
+
+
+async def chat_history_retriever(db, chat_id, user_doc=None):
+    """Retrieves the chat session of a user from Firestore.
+
+    Reads the session from the user's document, unless it was already read,
+    along with the turns from the chat_turns subcollection that are not
+    summarized yet (at most CHAT_WINDOW_MESSAGES + CHAT_SUMMARY_BATCH of them).
 
     Args:
         db: Firestore client instance.
         chat_id (int): Telegram chat ID of the user.
+        user_doc (dict, optional): Contents of the user's document, if already
+            read. Defaults to None.
 
     Returns:
-        list: List of messages representing the chat history, or None if
-            an error occurs.
+        dict: The chat session (context, summary, turn_count, summarized_upto
+              and the unsummarized turns), or None if an error occurs.
     """
     try:
-        col_ref = db.collection("user_records")
-        doc_ref = col_ref.document(str(chat_id)).get()
-        return doc_ref.to_dict()["chat_history"]
+        if user_doc is None:
+            col_ref = db.collection("user_records")
+            user_doc = (await col_ref.document(str(chat_id)).get()).to_dict()
+        chat_session = user_doc["chat_session"]
+
+        docs = await (
+            chat_turns_ref(db, chat_id)
+            .where(filter=FieldFilter("index", ">=", chat_session["summarized_upto"]))
+            .where(filter=FieldFilter("index", "<", chat_session["turn_count"]))
+            .order_by("index")
+            .get()
+        )
+        chat_session["turns"] = [doc.to_dict() for doc in docs]
+        return chat_session
 
     except Exception as e:
         print(f"Error in chat_history_retriever {e}")
         return None
 
 
-def chat_history_deleter(db, chat_id):
-    """Deletes the chat history of a user in Firestore.
+async def chat_history_deleter(db, chat_id):
+    """Deletes the chat session of a user in Firestore.
 
-    Sets the 'chat_history' and 'position' fields to None in the user's
-    document.
+    Deletes the stored turns and sets the 'chat_session' and 'position' fields
+    to None in the user's document.
 
     Args:
         db: Firestore client instance.
@@ -209,9 +729,14 @@ def chat_history_deleter(db, chat_id):
             message to the console.
     """
     try:
+        batch = db.batch()
+        async for doc in chat_turns_ref(db, chat_id).select([]).stream():
+            batch.delete(doc.reference)
+
         col_ref = db.collection("user_records")
         doc_ref = col_ref.document(str(chat_id))
-        doc_ref.update({"chat_history": None, "position": None})
+        batch.update(doc_ref, {"chat_session": None, "position": None})
+        await batch.commit()
 
     except Exception as e:
         print(f"Error in chat_history_deleter {e}")
@@ -220,8 +745,8 @@ def chat_history_deleter(db, chat_id):
 async def cancel_handler(db, session, chat_id):
     """Handles the /cancel command, ending the chat session.
 
-    Deletes the user's chat history, sends a goodbye message,
-    and unpins the exit chat message.
+    Flushes and drops the cached session, deletes the user's chat history,
+    sends a goodbye message, and unpins the exit chat message.
 
     Args:
         db: Firestore client instance.
@@ -233,7 +758,9 @@ async def cancel_handler(db, session, chat_id):
             to the user and prints the error message to the console.
     """
     try:
-        chat_history_deleter(db, chat_id)
+        await session_flush(db, chat_id)
+        session_drop(chat_id)
+        await chat_history_deleter(db, chat_id)
         await send_msg(
             session,
             chat_id,
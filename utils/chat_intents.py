@@ -0,0 +1,231 @@
+from re import search, IGNORECASE
+import datetime
+import time
+
+from utils.firebase_handlers import retrieve_all_events
+from utils.event_index import (
+    index_build,
+    index_exists,
+    index_search,
+    indexes,
+    tokenize,
+)
+from utils.data_validation import date_cleaner, time_cleaner
+from utils.metrics import increment, observe, observations
+
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+# Longer questions usually carry more than a lookup, they go to the model
+MAX_QUESTION_WORDS = 10
+
+FILLER_WORDS = {"my", "the", "a", "an", "event", "meeting"}
+
+DAY = r"(?P<day>today|tomorrow|monday|tuesday|wednesday|thursday|friday|saturday|sunday|\d{4}-\d{2}-\d{2})"
+PERIOD = r"(?P<period>today|tomorrow|this week|next week|this month)"
+
+NEXT_EVENT = r"^\W*((what|when)('?s| is) )?(my )?(the )?next (event|one)\b|^\W*what('?s| is) next\b"
+HOW_MANY = rf"\bhow many (events|things)\b.*\b{PERIOD}\b"
+EVENTS_ON = rf"\b(anything|events?|what do i have|what('?s| is) (on|happening)|am i busy|plans)\b.*\b{DAY}\b"
+WHERE_IS = r"^\W*where('s| is| will) (?P<name>.+?)( be| happening| held)?\W*$"
+
+# questions about past events, which the upcoming events cannot answer
+PAST_TENSE = r"\b(did|was|were|had|went|attended|last|ago|yesterday|previous|past)\b"
+
+
+def upcoming(events, today):
+    """Returns the events starting today or later, in start order.
+
+    Args:
+        events (dict): Contents of the event_info documents, keyed by document ID.
+        today (datetime.date): Today's date.
+
+    Returns:
+        list: The upcoming events (dictionaries), soonest first.
+    """
+    today_str = today.strftime("%Y-%m-%d")
+    result = [
+        event
+        for event in events.values()
+        if event.get("start_date") and event["start_date"] >= today_str
+    ]
+    return sorted(result, key=lambda e: (e["start_date"], e["start_time"] or ""))
+
+
+def describe(event):
+    """Formats a single event as one line of a reply.
+
+    Args:
+        event (dict): Contents of the event_info document.
+
+    Returns:
+        str: Name, date, time and location of the event.
+    """
+    line = f"{event['name']} on {date_cleaner(event['start_date'])}"
+    if event.get("start_time"):
+        line += f" at {time_cleaner(event['start_time'])}"
+    if event.get("location"):
+        line += f", {event['location']}"
+    return line
+
+
+def resolve_range(word, today):
+    """Converts a day or period word of a question into a date range.
+
+    Args:
+        word (str): "today", "tomorrow", a weekday, "this week", "next week",
+                    "this month" or a YYYY-MM-DD date.
+        today (datetime.date): Today's date.
+
+    Returns:
+        tuple: First and last date (datetime.date) of the range, and a label
+               for the reply.
+    """
+    if word == "today":
+        return today, today, "today"
+    if word == "tomorrow":
+        day = today + datetime.timedelta(days=1)
+        return day, day, "tomorrow"
+    if word in WEEKDAYS:
+        days_ahead = (WEEKDAYS.index(word) - today.weekday()) % 7
+        day = today + datetime.timedelta(days=days_ahead)
+        return day, day, f"on {date_cleaner(day.strftime('%Y-%m-%d'))}"
+    if word == "this week":
+        return today, today + datetime.timedelta(days=6 - today.weekday()), word
+    if word == "next week":
+        start = today + datetime.timedelta(days=7 - today.weekday())
+        return start, start + datetime.timedelta(days=6), word
+    if word == "this month":
+        next_month = (today.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+        return today, next_month - datetime.timedelta(days=1), word
+
+    day = datetime.datetime.strptime(word, "%Y-%m-%d").date()
+    return day, day, f"on {date_cleaner(word)}"
+
+
+def in_range(events, first, last):
+    """Returns the events starting within a date range, in start order.
+
+    Args:
+        events (list): Upcoming events, soonest first.
+        first (datetime.date): First date of the range.
+        last (datetime.date): Last date of the range.
+
+    Returns:
+        list: The events starting within the range.
+    """
+    first_str = first.strftime("%Y-%m-%d")
+    last_str = last.strftime("%Y-%m-%d")
+    return [e for e in events if first_str <= e["start_date"] <= last_str]
+
+
+def match_intent(chat_id, events, question, today):
+    """Answers a chat question directly from the user's events, if it is a simple one.
+
+    Only upcoming events are answered from, so questions about the past (in
+    the past tense, or about a date before today) go to the chat model.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        events (dict): Contents of the user's event_info documents.
+        question (str): The user's question.
+        today (datetime.date): Today's date.
+
+    Returns:
+        tuple: The name of the matched intent and the reply, or (None, None)
+               when the question should go to the chat model.
+    """
+    question = question.strip().lower()
+    if len(question.split()) > MAX_QUESTION_WORDS:
+        return None, None
+    if search(PAST_TENSE, question, IGNORECASE):
+        return None, None
+
+    future = upcoming(events, today)
+
+    if search(NEXT_EVENT, question, IGNORECASE):
+        if not future:
+            return "next_event", "You don't have any upcoming events."
+        return "next_event", f"Your next event is {describe(future[0])}."
+
+    found = search(HOW_MANY, question, IGNORECASE)
+    if found:
+        first, last, label = resolve_range(found.group("period"), today)
+        count = len(in_range(future, first, last))
+        plural = "event" if count == 1 else "events"
+        return "how_many", f"You have {count} {plural} {label}."
+
+    found = search(EVENTS_ON, question, IGNORECASE)
+    if found:
+        first, last, label = resolve_range(found.group("day"), today)
+        if last < today:
+            return None, None
+        matches = in_range(future, first, last)
+        if not matches:
+            return "events_on", f"You don't have any events {label}."
+        lines = "\n".join(f"• {describe(event)}" for event in matches)
+        return "events_on", f"Here's what you have {label}:\n{lines}"
+
+    found = search(WHERE_IS, question, IGNORECASE)
+    if found:
+        words = set(tokenize(found.group("name"))) - FILLER_WORDS
+        matches = index_search(chat_id, " ".join(words), 1)
+        # the best match must share a word of its name with the question,
+        # a date or description hit alone is too loose to answer with
+        event = matches[0][1] if matches else {}
+        if words & set(tokenize(event.get("name"))) and event.get("location"):
+            return "where_is", f"{event['name']} is at {event['location']}."
+
+    return None, None
+
+
+async def answer_chat_intent(db, chat_id, question):
+    """Answers common, structurally simple chat questions without a model call.
+
+    Handles questions like "what's my next event", "anything on Friday",
+    "where is X" and "how many events this week". Hits, misses, the latency
+    of the local answer and the time saved against the average chat model
+    turn are recorded.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+        question (str): The user's question.
+
+    Returns:
+        str or None: The reply, or None if the question needs the chat model.
+    """
+    start = time.perf_counter()
+    try:
+        if not index_exists(chat_id):
+            index_build(chat_id, await retrieve_all_events(db, chat_id))
+        events = indexes[chat_id]["events"]
+
+        intent, reply = match_intent(chat_id, events, question, datetime.date.today())
+
+    except Exception as e:
+        print(f"Error in answer_chat_intent {e}")
+        intent, reply = None, None
+
+    latency = time.perf_counter() - start
+    if intent is None:
+        increment("chat.intent_misses")
+        return None
+
+    increment(f"chat.intent_hits.{intent}")
+    observe("chat.intent_latency", latency)
+
+    model_turn = observations.get("chat.stream_duration")
+    if model_turn:
+        saved = model_turn["total"] / model_turn["count"] - latency
+        observe("chat.intent_saved_seconds", saved)
+        print(f"Chat intent {intent} answered locally, saved {saved:.2f}s")
+
+    return reply
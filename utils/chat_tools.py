@@ -0,0 +1,171 @@
+import time
+
+from utils.firebase_handlers import retrieve_all_events, retrieve_events_in_range
+from utils.event_index import index_build, index_exists, index_search
+from utils.data_validation import date_valid
+from utils.metrics import increment, observe
+
+CHAT_TOOLS = [
+    {
+        "function_declarations": [
+            {
+                "name": "list_events",
+                "description": "Lists the user's events that start between two dates, both inclusive, in start date order.",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "start_date": {
+                            "type": "STRING",
+                            "description": "First date of the range, in YYYY-MM-DD format.",
+                        },
+                        "end_date": {
+                            "type": "STRING",
+                            "description": "Last date of the range, in YYYY-MM-DD format.",
+                        },
+                    },
+                    "required": ["start_date", "end_date"],
+                },
+            },
+            {
+                "name": "search_events",
+                "description": "Searches all of the user's events, past and upcoming, by keywords such as the event name, location, topic, month or weekday.",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "keywords": {
+                            "type": "STRING",
+                            "description": "Keywords to search for.",
+                        },
+                    },
+                    "required": ["keywords"],
+                },
+            },
+            {
+                "name": "get_event_details",
+                "description": "Returns every detail of an event (times, description and the alias of its google calendar link), by the ref returned from list_events or search_events.",
+                "parameters": {
+                    "type": "OBJECT",
+                    "properties": {
+                        "ref": {
+                            "type": "STRING",
+                            "description": "Ref of the event, for example E1.",
+                        },
+                    },
+                    "required": ["ref"],
+                },
+            },
+        ]
+    }
+]
+
+
+def event_summary(event, tool_state):
+    """Returns the short summary of an event used in tool results.
+
+    The event is given a ref (E1, E2, ...) in tool_state, so the model can ask
+    for its details without seeing any internal IDs.
+
+    Args:
+        event (tuple): Document ID and contents of the event_info document.
+        tool_state (dict): Refs and link aliases handed out during this turn.
+
+    Returns:
+        dict: Ref, name, start date, start time and location of the event.
+    """
+    doc_id, doc = event
+    refs = tool_state["refs"]
+    ref = next((key for key, value in refs.items() if value[0] == doc_id), None)
+    if ref is None:
+        ref = f"E{len(refs) + 1}"
+        refs[ref] = event
+
+    return {
+        "ref": ref,
+        "name": doc["name"],
+        "start_date": doc["start_date"],
+        "start_time": doc["start_time"],
+        "location": doc["location"],
+    }
+
+
+async def list_events(db, chat_id, args, tool_state):
+    """Tool listing the user's events that start within a date range."""
+    start_date = args.get("start_date")
+    end_date = args.get("end_date")
+    if not date_valid(start_date, end_date) or not start_date or not end_date:
+        return {"error": "start_date and end_date must be in YYYY-MM-DD format."}
+
+    events = await retrieve_events_in_range(db, chat_id, start_date, end_date)
+    return {"events": [event_summary(event, tool_state) for event in events.items()]}
+
+
+async def search_events(db, chat_id, args, tool_state):
+    """Tool searching all of the user's events through the event index."""
+    if not index_exists(chat_id):
+        index_build(chat_id, await retrieve_all_events(db, chat_id))
+
+    matches = index_search(chat_id, args.get("keywords", ""), 5)
+    return {"events": [event_summary(event, tool_state) for event in matches]}
+
+
+async def get_event_details(db, chat_id, args, tool_state):
+    """Tool returning every detail of an event handed out earlier in the turn."""
+    event = tool_state["refs"].get(args.get("ref"))
+    if event is None:
+        return {"error": "Unknown ref, use list_events or search_events first."}
+
+    _, doc = event
+    details = {
+        key: doc.get(key)
+        for key in (
+            "name",
+            "start_date",
+            "end_date",
+            "start_time",
+            "end_time",
+            "location",
+            "description",
+        )
+    }
+    if doc.get("link"):
+        alias = f"T{len(tool_state['links']) + 1}"
+        tool_state["links"][alias] = doc["link"]
+        details["link"] = alias
+
+    return details
+
+
+TOOL_HANDLERS = {
+    "list_events": list_events,
+    "search_events": search_events,
+    "get_event_details": get_event_details,
+}
+
+
+async def execute_tool(db, chat_id, name, args, tool_state):
+    """Runs a tool called by the chat model against the user's events.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+        name (str): Name of the called function.
+        args (dict): Arguments of the function call.
+        tool_state (dict): Refs and link aliases handed out during this turn.
+
+    Returns:
+        dict: The function response sent back to the model.
+    """
+    start = time.perf_counter()
+    increment(f"chat.tool_calls.{name}")
+    try:
+        handler = TOOL_HANDLERS.get(name)
+        if handler is None:
+            return {"error": f"Unknown function {name}."}
+        return await handler(db, chat_id, args, tool_state)
+
+    except Exception as e:
+        print(f"Error in execute_tool {name} : {e}")
+        return {"error": "The events could not be retrieved."}
+
+    finally:
+        observe(f"chat.tool_latency.{name}", time.perf_counter() - start)
@@ -8,7 +8,7 @@ from utils.telegram_handlers import (
     send_venue,
 )
 import asyncio
-from utils.firebase_handlers import new_msg_updater, event_info_add
+from utils.firebase_handlers import new_msg_updater, event_info_add, commit_writes
 from utils.data_validation import process_events, date_cleaner, escape_markdownv2
 from utils.gemini_models import prompter
 from utils.weather_info import (
@@ -21,18 +21,25 @@ from utils.view_events import (
     view_specific_event,
     view_upcoming_events,
     delete_specific_event,
+    parse_anchor,
 )
 from utils.chat_handlers import search_handler
-from utils.gcal_events import get_authenticated_service, delete_event_calendar
+from utils.image_processing import photo_size_ladder, photo_extraction_adequate
+from utils.metrics import increment, observe
+from utils.event_index import index_remove
+from utils.upcoming_view import view_remove
+from utils.user_context import user_context_data
+from utils.gcal_events import batch_delete_events
 from google.cloud.firestore_v1.base_query import FieldFilter
 import traceback
 from config import weather_api_key, TOKEN
 import datetime
+import time
 from urllib.parse import quote as url_quote
 import traceback
 
 
-async def text_logic(db, session, msg, chat_id, received_message_id, queue):
+async def text_logic(db, session, msg, chat_id, received_message_id, queue, context):
     """Handles logic for incoming text messages.
 
     Extracts text from the message, sends a waiting message, triggers event
@@ -46,6 +53,7 @@ async def text_logic(db, session, msg, chat_id, received_message_id, queue):
         chat_id (int): Telegram chat ID of the user.
         received_message_id (int): Message ID of the received user message.
         queue (asyncio.Queue): Queue for managing asynchronous operations.
+        context (dict): Context of the user for this update.
 
     Raises:
         Exception: If an error occurs during the process, sends an error message
@@ -63,6 +71,8 @@ async def text_logic(db, session, msg, chat_id, received_message_id, queue):
         asyncio.create_task(send_typing_action(session, chat_id))
         sent_message_id = response.json()["result"]["message_id"]
 
+        # the message log entry and the events go to Firestore in one batch
+        writes = []
         await text_img_handler(
             db,
             session,
@@ -72,9 +82,12 @@ async def text_logic(db, session, msg, chat_id, received_message_id, queue):
             received_message_id,
             txt,
             queue,
+            context,
+            writes,
         )
 
-        asyncio.create_task(new_msg_updater(db, chat_id, received_message_id, txt))
+        new_msg_updater(db, writes, chat_id, received_message_id, txt)
+        asyncio.create_task(commit_writes(db, writes))
 
     except Exception as e:
         await queue.join()
@@ -89,7 +102,7 @@ async def text_logic(db, session, msg, chat_id, received_message_id, queue):
         )
 
 
-async def photo_logic(db, session, msg, chat_id, received_message_id, queue):
+async def photo_logic(db, session, msg, chat_id, received_message_id, queue, context):
     """Handles logic for incoming photo messages.
 
     Downloads the photo, sends a waiting message, triggers event detail
@@ -103,6 +116,7 @@ async def photo_logic(db, session, msg, chat_id, received_message_id, queue):
         chat_id (int): Telegram chat ID of the user.
         received_message_id (int): Message ID of the received user message.
         queue (asyncio.Queue): Queue for managing asynchronous operations.
+        context (dict): Context of the user for this update.
 
     Raises:
         Exception: If an error occurs during the process, sends an error message
@@ -120,7 +134,8 @@ async def photo_logic(db, session, msg, chat_id, received_message_id, queue):
         sent_message_id = response.json()["result"]["message_id"]
         asyncio.create_task(send_typing_action(session, chat_id))
 
-        file_id = msg["message"]["photo"][-2]["file_id"]
+        photo_ladder = photo_size_ladder(msg["message"]["photo"])
+        file_id = photo_ladder[0]["file_id"]
         image = await image_downloader(session, file_id)
 
     except Exception as e:
@@ -140,6 +155,7 @@ async def photo_logic(db, session, msg, chat_id, received_message_id, queue):
         await queue.put((chat_id, sent_message_id, waiting_msg, received_message_id))
         try:
             asyncio.create_task(send_typing_action(session, chat_id))
+            writes = []
             await text_img_handler(
                 db,
                 session,
@@ -149,11 +165,13 @@ async def photo_logic(db, session, msg, chat_id, received_message_id, queue):
                 received_message_id,
                 image,
                 queue,
+                context,
+                writes,
+                photo_ladder,
             )
             db_file_id = "F!L3" + str(file_id)
-            asyncio.create_task(
-                new_msg_updater(db, chat_id, received_message_id, db_file_id)
-            )
+            new_msg_updater(db, writes, chat_id, received_message_id, db_file_id)
+            asyncio.create_task(commit_writes(db, writes))
 
         except Exception as e:
             await queue.join()
@@ -169,12 +187,25 @@ async def photo_logic(db, session, msg, chat_id, received_message_id, queue):
 
 
 async def text_img_handler(
-    db, session, type, chat_id, sent_message_id, received_message_id, message, queue
+    db,
+    session,
+    type,
+    chat_id,
+    sent_message_id,
+    received_message_id,
+    message,
+    queue,
+    context,
+    writes,
+    photo_ladder=None,
+    priority=None,
 ):
     """Handles event extraction, processing, and calendar interaction for text and image messages.
 
     Processes the extracted events, retrieves calendar ID, handles both Google Calendar
     and link-based event creation, and constructs the final message with event details.
+    For photos, extraction starts on the smallest adequate size and escalates to the
+    next larger size in photo_ladder when the result is empty or low confidence.
 
     Args:
         db: Firestore client instance.
@@ -185,62 +216,93 @@ async def text_img_handler(
         received_message_id (int): Message ID of the received user message.
         message (str or bytes): Text content or image data.
         queue (asyncio.Queue): Queue for managing asynchronous operations.
+        context (dict): Context of the user for this update.
+        writes (list): Pending Firestore writes of the update, the new events
+                       are added to it.
+        photo_ladder (list, optional): Telegram PhotoSize entries, smallest first,
+                                       where the first entry is the image passed
+                                       in message. Defaults to None.
+        priority (str, optional): Model scheduler priority class, eg. "regenerate".
+                                  Defaults to None (chosen from the message type).
 
     Raises:
         Exception: If an error occurs during the process, sends an error message
             to the user and prints the error message to the console.
     """
     try:
-        retries = 3
-        for attempt in range(retries):
-            unprocessed_events = None
-            # send the corresponding message
-            if type == "text":
-                waiting_msg = "⏳ Please Wait while TimeSked does its job... \nThis might take upto 10 seconds !⏳\n\n - Extracting event details 🔍"
-            else:
-                waiting_msg = "⏳ Please Wait while TimeSked does its job... \nThis might take upto 10 seconds !⏳\n\n - Image downloaded successfully ✨\n - Extracting event details 🔍"
+        # the escalation steps are added to it, so they stay on the next attempts
+        if type == "text":
+            waiting_msg = "⏳ Please Wait while TimeSked does its job... \nThis might take upto 10 seconds !⏳\n\n - Extracting event details 🔍"
+        else:
+            waiting_msg = "⏳ Please Wait while TimeSked does its job... \nThis might take upto 10 seconds !⏳\n\n - Image downloaded successfully ✨\n - Extracting event details 🔍"
+
+        rung = 0
+        while True:
+            retries = 3
+            for attempt in range(retries):
+                unprocessed_events = None
+                # send the corresponding message
+                await queue.put(
+                    (chat_id, sent_message_id, waiting_msg, received_message_id)
+                )
+                asyncio.create_task(send_typing_action(session, chat_id))
 
-            await queue.put(
-                (chat_id, sent_message_id, waiting_msg, received_message_id)
-            )
-            asyncio.create_task(send_typing_action(session, chat_id))
+                # prompt the model
+                unprocessed_events = await prompter(
+                    type, message, attempt + 1, chat_id, priority
+                )
 
-            # prompt the model
-            unprocessed_events = prompter(type, message)
+                if isinstance(unprocessed_events, list):
+                    break
+                else:
+                    output_msg = f"Attempt {attempt + 1} failed ❌. \nReattempting, Please Wait... ⌛"
+                    await queue.put(
+                        (chat_id, sent_message_id, output_msg, received_message_id)
+                    )
+                    asyncio.create_task(send_typing_action(session, chat_id))
+                    retries -= 1
 
-            if isinstance(unprocessed_events, list):
-                break
             else:
-                output_msg = f"Attempt {attempt + 1} failed ❌. \nReattempting, Please Wait... ⌛"
-                await queue.put(
-                    (chat_id, sent_message_id, output_msg, received_message_id)
+                await queue.join()
+
+                if "internal error" in unprocessed_events:
+                    output_msg = "Gemini is currently experiencing a temporary hiccup. Please try again in a little while."
+                else:
+                    output_msg = "All attempts to extract event details failed, sorry for the incovenience caused. Please try again later"
+
+                await final_edit_msg(
+                    session,
+                    chat_id,
+                    sent_message_id,
+                    output_msg,
+                    received_message_id,
                 )
-                asyncio.create_task(send_typing_action(session, chat_id))
-                retries -= 1
+                return None
 
-        else:
-            await queue.join()
+            events = process_events(unprocessed_events)
 
-            if "internal error" in unprocessed_events:
-                output_msg = "Gemini is currently experiencing a temporary hiccup. Please try again in a little while."
-            else:
-                output_msg = "All attempts to extract event details failed, sorry for the incovenience caused. Please try again later"
+            # escalate to a larger photo size if the result is empty or low confidence
+            if (
+                not photo_ladder
+                or rung + 1 >= len(photo_ladder)
+                or photo_extraction_adequate(events)
+            ):
+                break
 
-            await final_edit_msg(
-                session,
-                chat_id,
-                sent_message_id,
-                output_msg,
-                received_message_id,
+            rung += 1
+            waiting_msg += "\n - Taking a closer look at a sharper image 🔎"
+            await queue.put(
+                (chat_id, sent_message_id, waiting_msg, received_message_id)
             )
-            return None
+            message = await image_downloader(session, photo_ladder[rung]["file_id"])
+
+        if photo_ladder:
+            record_photo_extraction(photo_ladder, rung)
 
         waiting_msg += "\n - Event detail extraction successful 🎉"
         await queue.put((chat_id, sent_message_id, waiting_msg, received_message_id))
         asyncio.create_task(send_typing_action(session, chat_id))
 
-        events = process_events(unprocessed_events)
-
         # sent the appropriate message if model response is []
         if events == [] or events == [[]]:
             output_msg = "Oops! Looks like that message is missing some key event details. Please try again, and I'll get it added to your calendar. 🗓️"
@@ -282,14 +344,13 @@ async def text_img_handler(
                 suggestions = suggestion_giver(weather)
 
         # retrives calendar id of that user (if present)
-        col_ref = db.collection("user_records")
-        doc = col_ref.document(str(chat_id)).get()
-        calendar_id = doc.to_dict()["calendar_id"]
+        calendar_id = (await user_context_data(context)).get("calendar_id")
 
         if calendar_id:
             flag = "gcal"
             list_of_events = await gcal_event_handler(
                 db,
+                session,
                 waiting_msg,
                 chat_id,
                 received_message_id,
@@ -298,6 +359,8 @@ async def text_img_handler(
                 suggestions,
                 calendar_id,
                 queue,
+                context,
+                writes,
             )
 
         else:
@@ -311,6 +374,7 @@ async def text_img_handler(
                 events,
                 suggestions,
                 queue,
+                writes,
             )
 
         print(f"\nProcessed events : \n{list_of_events}")
@@ -331,6 +395,30 @@ async def text_img_handler(
         print("Error in text_img_handler \n", e)
 
 
+def record_photo_extraction(photo_ladder, rung):
+    """Records which photo size an extraction settled on and whether it escalated.
+
+    Args:
+        photo_ladder (list): Telegram PhotoSize entries, smallest first.
+        rung (int): Index in photo_ladder of the size that was finally used.
+    """
+    used_sizes = photo_ladder[: rung + 1]
+    final_size = photo_ladder[rung]
+
+    increment("photo.extractions")
+    if rung > 0:
+        increment("photo.escalations")
+    observe("photo.long_edge", max(final_size["width"], final_size["height"]))
+    observe(
+        "photo.bytes_downloaded",
+        sum(size.get("file_size", 0) for size in used_sizes),
+    )
+    print(
+        f"Photo extraction used {final_size['width']}x{final_size['height']} "
+        f"after {rung} escalation(s)"
+    )
+
+
 async def link_event_handler(
     db,
     waiting_msg,
@@ -340,11 +428,12 @@ async def link_event_handler(
     events,
     suggestions,
     queue,
+    writes,
 ):
     """Handles the creation and storage of pre-filled Google Calendar event links.
 
-    Processes each event, generates a shortened Google Calendar link, updates the database
-    with event information, and manages the asynchronous operations through the queue.
+    Processes each event, generates a shortened Google Calendar link, queues the event
+    information for Firestore, and manages the asynchronous operations through the queue.
 
     Args:
         db: Firestore client instance.
@@ -356,6 +445,8 @@ async def link_event_handler(
         suggestions (str, optional): Weather-based suggestions for the event.
                                      Defaults to None.
         queue (asyncio.Queue): Queue for managing asynchronous operations.
+        writes (list): Pending Firestore writes of the update, the new events
+                       are added to it.
 
     Returns:
         list: List of dictionaries, each containing event details and the generated link.
@@ -377,10 +468,8 @@ async def link_event_handler(
                     "suggestions": suggestions,
                 }
             )
-            asyncio.create_task(
-                event_info_add(
-                    db, chat_id, received_message_id, event_details, short_link
-                )
+            event_info_add(
+                db, writes, chat_id, received_message_id, event_details, short_link
             )
         else:
             list_of_events.append(event_details)
@@ -565,7 +654,7 @@ def categorize(event_details):
         return "❌ An error has occurred. Please try again later"
 
 
-async def handle_callback_query(db, session, callback_query, queue):
+async def handle_callback_query(db, session, callback_query, queue, context):
     """Handles all callback queries from inline keyboard buttons.
 
     Manages various callback actions, including event regeneration, location sharing,
@@ -576,6 +665,7 @@ async def handle_callback_query(db, session, callback_query, queue):
         session: httpx asynchronous client session object.
         callback_query (dict): Telegram callback query data.
         queue (asyncio.Queue): Queue for managing asynchronous operations.
+        context (dict): Context of the user for this update.
 
     Raises:
         Exception: If an error occurs during event regeneration, restores the previous
@@ -596,12 +686,17 @@ async def handle_callback_query(db, session, callback_query, queue):
                     received_message_id,
                 )
             )
-            regen_deleter(db, chat_id, received_message_id)
+            # the old events are cleaned up while the message is re-extracted,
+            # and the new events are only stored once the cleanup is done
+            cleanup = asyncio.create_task(
+                regen_deleter(db, session, chat_id, received_message_id, context)
+            )
+            writes = []
 
             tg_response = callback_query["message"]["reply_to_message"]
             if "photo" in tg_response:
-                file_id = tg_response["photo"][-2]["file_id"]
-                message = await image_downloader(session, file_id)
+                photo_ladder = photo_size_ladder(tg_response["photo"])
+                message = await image_downloader(session, photo_ladder[0]["file_id"])
                 await text_img_handler(
                     db,
                     session,
@@ -611,6 +706,10 @@ async def handle_callback_query(db, session, callback_query, queue):
                     received_message_id,
                     message,
                     queue,
+                    context,
+                    writes,
+                    photo_ladder,
+                    "regenerate",
                 )
             else:
                 message = tg_response["text"]
@@ -623,7 +722,12 @@ async def handle_callback_query(db, session, callback_query, queue):
                     received_message_id,
                     message,
                     queue,
+                    context,
+                    writes,
+                    priority="regenerate",
                 )
+            await cleanup
+            asyncio.create_task(commit_writes(db, writes))
 
         elif callback_query["data"].startswith("L0C@"):
             asyncio.create_task(send_location_action(session, chat_id))
@@ -633,10 +737,10 @@ async def handle_callback_query(db, session, callback_query, queue):
             data = {"callback_query_id": callback_query["id"]}
             await session.post(url, json=data)
 
-        elif callback_query["data"].startswith("Button"):
-            button_number = int(callback_query["data"][6:])
+        elif callback_query["data"].startswith("E#"):
+            doc_id, _, anchor = callback_query["data"][2:].partition("|")
             await view_specific_event(
-                db, session, chat_id, sent_message_id, button_number
+                db, session, chat_id, sent_message_id, doc_id, anchor
             )
 
             url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
@@ -644,8 +748,11 @@ async def handle_callback_query(db, session, callback_query, queue):
             await session.post(url, json=data)
 
         elif callback_query["data"].startswith("D3L%"):
-            doc_id = callback_query["data"][4:]
-            delete_flag = delete_specific_event(db, chat_id, doc_id)
+            # older messages carry no anchor, they return to the first page
+            doc_id, _, anchor = callback_query["data"][4:].partition("|")
+            delete_flag = await delete_specific_event(
+                db, session, chat_id, doc_id, context
+            )
 
             if delete_flag:
                 url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
@@ -656,17 +763,38 @@ async def handle_callback_query(db, session, callback_query, queue):
                 }
                 await session.post(url, json=data)
                 await view_upcoming_events(
-                    db, session, chat_id, sent_message_id, edit=True
+                    db, session, chat_id, sent_message_id, True, parse_anchor(anchor)
                 )
 
-        elif callback_query["data"] == "Back to event_list":
+        elif callback_query["data"][:4] in ("EVP>", "EVP<", "EVA>"):
+            direction = {"EVP>": "after", "EVP<": "before", "EVA>": "at"}[
+                callback_query["data"][:4]
+            ]
+            await view_upcoming_events(
+                db,
+                session,
+                chat_id,
+                sent_message_id,
+                True,
+                parse_anchor(callback_query["data"][4:]),
+                direction,
+            )
+            url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
+            data = {"callback_query_id": callback_query["id"]}
+            await session.post(url, json=data)
+
+        elif callback_query["data"].startswith("Button") or (
+            callback_query["data"] == "Back to event_list"
+        ):
+            # buttons of event lists sent before paging, their positions
+            # no longer match, so the first page is shown again
             await view_upcoming_events(db, session, chat_id, sent_message_id, edit=True)
             url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
             data = {"callback_query_id": callback_query["id"]}
             await session.post(url, json=data)
 
         elif callback_query["data"] == "Confirm CHAT":
-            await search_handler(db, session, chat_id, True, sent_message_id)
+            await search_handler(db, session, chat_id, context, True, sent_message_id)
             url = f"https://api.telegram.org/bot{TOKEN}/answerCallbackQuery"
             data = {"callback_query_id": callback_query["id"]}
             await session.post(url, json=data)
@@ -693,44 +821,55 @@ async def handle_callback_query(db, session, callback_query, queue):
         traceback.print_exc()
 
 
-def regen_deleter(db, chat_id, message_id):
+async def regen_deleter(db, session, chat_id, message_id, context):
     """Deletes events from both Google Calendar and Firestore related to a specific message.
 
-    Retrieves event IDs and document IDs from Firestore, deletes the documents,
-    authenticates with Google Calendar API, and deletes the corresponding events.
+    Retrieves event IDs and document IDs from Firestore, deletes all the
+    documents in a single batch, and deletes the corresponding calendar events
+    in a single batch HTTP request.
 
     Args:
         db: Firestore client instance.
+        session: httpx asynchronous client session object.
         chat_id (int): Telegram chat ID of the user.
         message_id (int): Message ID associated with the events to be deleted.
+        context (dict): Context of the user for this update.
     """
-    col_ref = db.collection("event_info")
-    # gets the event ids and doc ids of the events to be deleted from calendar and documents respectively
-    events_ids = []
-    doc_ids = []
-
-    docs = col_ref.where(filter=FieldFilter("message_id", "==", message_id)).get()
-    for doc in docs:
-        events_ids.append(doc.to_dict()["event_id"])
-        doc_ids.append(doc.id)
-
-    # deleting docs from firebase
-    for doc_id in doc_ids:
-        col_ref.document(str(doc_id)).delete()
-
-    if len(events_ids) > 0:
-        if events_ids[0]:
-            # deleting events from calendar
-            col_ref = db.collection("user_records")
-            doc = col_ref.document(str(chat_id)).get().to_dict()
-            calendar_id = doc["calendar_id"]
-            access_token = doc["access_token"]
-            refresh_token = doc["refresh_token"]
-            service = get_authenticated_service(
-                db, chat_id, access_token, refresh_token
-            )
-            for event_id in events_ids:
-                delete_event_calendar(service, calendar_id, event_id)
+    try:
+        start = time.perf_counter()
+        col_ref = db.collection("event_info")
+        # message ids are only unique within a chat
+        docs = await (
+            col_ref.where(filter=FieldFilter("chat_id", "==", chat_id))
+            .where(filter=FieldFilter("message_id", "==", message_id))
+            .get()
+        )
+        if not docs:
+            return
+
+        # deleting docs from firebase
+        batch = db.batch()
+        for doc in docs:
+            batch.delete(doc.reference)
+        await batch.commit()
+        for doc in docs:
+            index_remove(chat_id, doc.id)
+            view_remove(chat_id, doc.id)
+
+        # deleting events from calendar
+        events_ids = [doc.get("event_id") for doc in docs]
+        events_ids = [
+            event_id for event_id in events_ids if event_id not in (None, "None")
+        ]
+        if events_ids:
+            calendar_id = (await user_context_data(context))["calendar_id"]
+            await batch_delete_events(session, context, calendar_id, events_ids)
+
+        observe("regenerate.cleanup_duration", time.perf_counter() - start)
+
+    except Exception as e:
+        print(f"Error in regen_deleter {e}")
+        traceback.print_exc()
 
 
 async def start_handler(session, msg, chat_id, received_message_id):
@@ -0,0 +1,183 @@
+from collections import OrderedDict
+from math import log
+from re import findall
+import datetime
+
+from config import EVENT_INDEX_MAX_USERS
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+# chat_id -> {"events", "terms", "lengths", "postings", "total_length"},
+# least recently used first
+indexes = OrderedDict()
+
+
+def tokenize(text):
+    """Splits text into lowercase word and ISO date tokens.
+
+    Args:
+        text (str): Text to be tokenized.
+
+    Returns:
+        list: List of tokens.
+    """
+    return findall(r"\d{4}-\d{2}-\d{2}|\w+", text.lower()) if text else []
+
+
+def event_terms(event):
+    """Returns the terms an event is indexed under.
+
+    Besides the words of the name, location and description, the start and end
+    dates are indexed as the full date, the month (YYYY-MM), the year, the
+    month name and the weekday, so questions like "anything in june" or
+    "what's on saturday" match.
+
+    Args:
+        event (dict): Contents of an event_info document.
+
+    Returns:
+        list: List of terms.
+    """
+    terms = tokenize(event.get("name"))
+    terms += tokenize(event.get("location"))
+    terms += tokenize(event.get("description"))
+
+    for date_str in {event.get("start_date"), event.get("end_date")}:
+        try:
+            date = datetime.datetime.strptime(date_str, "%Y-%m-%d")
+        except (TypeError, ValueError):
+            continue
+        terms += [
+            date_str,
+            date_str[:7],
+            date_str[:4],
+            date.strftime("%B").lower(),
+            date.strftime("%A").lower(),
+        ]
+
+    return terms
+
+
+def index_build(chat_id, events):
+    """Builds the search index of a user from all of their events.
+
+    The least recently used index is dropped once more than
+    EVENT_INDEX_MAX_USERS users are indexed.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        events (dict): Contents of the user's event_info documents, keyed by
+                       document ID.
+    """
+    indexes[chat_id] = {
+        "events": {},
+        "terms": {},
+        "lengths": {},
+        "postings": {},
+        "total_length": 0,
+    }
+    for doc_id, event in events.items():
+        index_add(chat_id, doc_id, event)
+
+    while len(indexes) > EVENT_INDEX_MAX_USERS:
+        indexes.popitem(last=False)
+
+
+def index_exists(chat_id):
+    """Checks whether the search index of a user has been built.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+
+    Returns:
+        bool: True if the index is in memory.
+    """
+    return chat_id in indexes
+
+
+def index_add(chat_id, doc_id, event):
+    """Adds an event to the search index of a user, if the index is built.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        doc_id (str): Document ID of the event.
+        event (dict): Contents of the event_info document.
+    """
+    index = indexes.get(chat_id)
+    if index is None:
+        return
+
+    index_remove(chat_id, doc_id)
+
+    terms = event_terms(event)
+    frequencies = {}
+    for term in terms:
+        frequencies[term] = frequencies.get(term, 0) + 1
+
+    index["events"][doc_id] = event
+    index["terms"][doc_id] = frequencies
+    index["lengths"][doc_id] = len(terms)
+    index["total_length"] += len(terms)
+    for term, frequency in frequencies.items():
+        index["postings"].setdefault(term, {})[doc_id] = frequency
+
+
+def index_remove(chat_id, doc_id):
+    """Removes an event from the search index of a user, if it is present.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        doc_id (str): Document ID of the event.
+    """
+    index = indexes.get(chat_id)
+    if index is None or doc_id not in index["events"]:
+        return
+
+    frequencies = index["terms"].pop(doc_id)
+    del index["events"][doc_id]
+    index["total_length"] -= index["lengths"].pop(doc_id)
+    for term in frequencies:
+        postings = index["postings"][term]
+        del postings[doc_id]
+        if not postings:
+            del index["postings"][term]
+
+
+def index_search(chat_id, text, k):
+    """Returns the events of a user that are most relevant to a question.
+
+    Events are ranked with BM25 over the terms of event_terms.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        text (str): The user's question.
+        k (int): Maximum number of events to return.
+
+    Returns:
+        list: Up to k (document ID, event) tuples, most relevant first.
+    """
+    index = indexes.get(chat_id)
+    if not index or not index["events"]:
+        return []
+
+    indexes.move_to_end(chat_id)
+    count = len(index["events"])
+    average_length = index["total_length"] / count
+
+    scores = {}
+    for term in set(tokenize(text)):
+        postings = index["postings"].get(term)
+        if not postings:
+            continue
+
+        idf = log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+        for doc_id, frequency in postings.items():
+            norm = K1 * (1 - B + B * index["lengths"][doc_id] / average_length)
+            scores[doc_id] = scores.get(doc_id, 0) + idf * frequency * (K1 + 1) / (
+                frequency + norm
+            )
+
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [(doc_id, index["events"][doc_id]) for doc_id in ranked]
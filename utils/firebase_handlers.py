@@ -1,23 +1,46 @@
+import asyncio
 import datetime
-from firebase_admin import firestore
 from google.cloud.firestore_v1.base_query import FieldFilter
-
+from google.cloud.firestore_v1.field_path import FieldPath
+from utils.event_index import index_add
+from utils.upcoming_view import view_get, view_build, view_add, view_page
+from utils.metrics import increment, observe
+from utils.usage_counter import count_use
+from utils.sharded_counter import (
+    global_counter,
+    counter_increment,
+    counter_value,
+    counter_seed,
+)
+from utils.user_context import user_context_known, user_context_create
+from utils.storage import TRANSIENT_ERRORS
+from config import (
+    FIRESTORE_WRITE_ATTEMPTS,
+    EVENTS_PAGE_SIZE,
+    UPCOMING_VIEW_MAX_EVENTS,
+)
+
+# collection -> global counter of its documents
+COUNTED_COLLECTIONS = {"message_log": "messages", "event_info": "events"}
 
 today = datetime.date.today()
 date_today = today.strftime("%Y-%m-%d")
 
 
-def user_handler(db, msg):
+async def user_handler(db, msg, context):
     """Handles user information and updates user records in Firestore.
 
-    Extracts user details from the Telegram message, retrieves the user's record
-    from Firestore, and either creates a new record or updates the existing one.
+    Extracts user details from the Telegram message. Uses of existing users are
+    buffered by the usage counter and written in its next batch. Unknown users
+    get a create-if-absent write through their context, flushed with the other
+    changes of the update, which counts the use instead if the record exists
+    after all.
 
     Args:
         db: Firestore client instance.
         msg (dict): Telegram message data containing user information.
+        context (dict): Context of the user for this update.
     """
-    col_ref = db.collection("user_records")
     try:
         # Extract user information
         chat_id = msg["message"]["from"]["id"]
@@ -33,14 +56,12 @@ def user_handler(db, msg):
             else first_name or last_name or "Not Available"
         )
 
-        doc_ref = col_ref.document(str(chat_id))
-        doc = doc_ref.get()
-
         # Insert new user or update existing record
-        if doc.exists:
-            doc_ref.update({"no_of_uses": firestore.Increment(1)})
+        if user_context_known(context):
+            count_use(db, chat_id)
         else:
-            doc_ref.set(
+            user_context_create(
+                context,
                 {
                     "chat_id": chat_id,
                     "name": name,
@@ -49,47 +70,54 @@ def user_handler(db, msg):
                     "no_of_uses": 1,
                     "access_token": None,
                     "calendar_id": None,
-                    "chat_history": None,
+                    "chat_session": None,
                     "position": None,
                     "refresh_token": None,
-                }
+                    "token_expiry": None,
+                },
+                {"no_of_uses": 1},
             )
 
     except Exception as e:
         print(f"An error occurred in user_handler function : {e}")
 
 
-async def new_msg_updater(db, chat_id, message_id, message_text):
-    """Updates the message log in Firestore with new message details.
+def new_msg_updater(db, writes, chat_id, message_id, message_text):
+    """Adds the message log entry of a new message to the writes of the update.
 
     Args:
         db: Firestore client instance.
+        writes (list): Pending (document reference, data) writes of the update,
+                       committed by commit_writes.
         chat_id (int): Telegram chat ID of the user.
         message_id (int): Message ID of the received message.
         message_text (str): Text content of the received message.
     """
     col_ref = db.collection("message_log")
-    try:
-        doc_ref = col_ref.document(str(message_id))
-        doc_ref.set(
+    writes.append(
+        (
+            col_ref.document(str(message_id)),
             {
                 "chat_id": chat_id,
                 "message_id": message_id,
                 "message_text": message_text,
                 "date": date_today,
-            }
+            },
         )
-    except Exception as e:
-        print(f"An error occurred while updating message: {e}")
+    )
 
 
-async def event_info_add(db, chat_id, message_id, event_details, link, event_id=None):
-    """Adds event information to the Firestore database.
+def event_info_add(db, writes, chat_id, message_id, event_details, link, event_id=None):
+    """Adds event information to the writes of the update.
 
-    Formats the event details and stores them in the 'event_info' collection.
+    Formats the event details into an 'event_info' document. The document ID is
+    generated here, so retrying the commit rewrites the same document instead
+    of adding a duplicate.
 
     Args:
         db: Firestore client instance.
+        writes (list): Pending (document reference, data) writes of the update,
+                       committed by commit_writes.
         chat_id (int): Telegram chat ID of the user.
         message_id (int): Message ID associated with the event.
         event_details (list): List containing event name, start date, end date,
@@ -127,65 +155,202 @@ async def event_info_add(db, chat_id, message_id, event_details, link, event_id=
         else:
             formatted_end_time = None
 
-        col_ref.add(
-            {
-                "chat_id": chat_id,
-                "message_id": message_id,
-                "name": name,
-                "start_date": start_date,
-                "end_date": end_date,
-                "start_time": formatted_start_time,
-                "end_time": formatted_end_time,
-                "location": location,
-                "description": description,
-                "link": link,
-                "event_id": event_id,
-            }
-        )
+        event = {
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "name": name,
+            "start_date": start_date,
+            "end_date": end_date,
+            "start_time": formatted_start_time,
+            "end_time": formatted_end_time,
+            "location": location,
+            "description": description,
+            "link": link,
+            "event_id": event_id,
+        }
+        writes.append((col_ref.document(), event))
 
     except Exception as e:
         print(f"An error occurred while adding event info : {e}")
 
 
-def retrieve_upcoming_events(db, chat_id):
-    """Retrieves upcoming events for a specific user from Firestore.
+async def writes_committed(writes):
+    """Tells whether a batch of writes was already committed.
+
+    Batches are atomic, so the first write being stored with its data is
+    enough to tell. Used before sending a failed batch again.
+
+    Args:
+        writes (list): Pending (document reference, data) writes.
+
+    Returns:
+        bool: True if the writes are stored.
+    """
+    doc_ref, data = writes[0]
+    try:
+        doc = await doc_ref.get()
+    except Exception as e:
+        print(f"Could not check the failed batch : {e}")
+        return False
+    return doc.exists and doc.to_dict() == data
+
+
+async def commit_writes(db, writes, attempts=FIRESTORE_WRITE_ATTEMPTS, counted=True):
+    """Commits the writes of an update in a single batch.
+
+    Transient errors are retried with exponential backoff, unless the failed
+    batch turns out to be committed. The global message and event counters are
+    incremented in the same batch. Once the batch is
+    committed, the new events are added to the user's search index.
+
+    Args:
+        db: Firestore client instance.
+        writes (list): Pending (document reference, data) writes, at most 498
+            (500 with counted False).
+        attempts (int, optional): Number of attempts. Defaults to
+            FIRESTORE_WRITE_ATTEMPTS.
+        counted (bool, optional): Whether the new messages and events are
+            added to the global counters. Defaults to True.
+
+    Returns:
+        bool: True if the batch was committed.
+    """
+    if not writes:
+        return True
+
+    for attempt in range(attempts):
+        # a batch that failed with a timeout may have been committed all the
+        # same, sending it again would count its documents twice
+        if attempt and counted and await writes_committed(writes):
+            break
+
+        batch = db.batch()
+        for doc_ref, data in writes:
+            batch.set(doc_ref, data)
+        if counted:
+            for collection, name in COUNTED_COLLECTIONS.items():
+                count = sum(ref.parent.id == collection for ref, _ in writes)
+                if count:
+                    counter_increment(batch, global_counter(db, name), count)
+
+        try:
+            await batch.commit()
+            break
+
+        except TRANSIENT_ERRORS as e:
+            print(f"Batch of {len(writes)} writes failed, attempt {attempt + 1} : {e}")
+            await asyncio.sleep(0.5 * 2**attempt)
+
+        except Exception as e:
+            print(f"An error occurred while committing writes : {e}")
+            increment("firestore.batch_failures")
+            return False
+    else:
+        increment("firestore.batch_failures")
+        return False
+
+    increment("firestore.batches")
+    observe("firestore.batch_writes", len(writes))
+    for doc_ref, data in writes:
+        if doc_ref.parent.id == "event_info":
+            index_add(data["chat_id"], doc_ref.id, data)
+            view_add(data["chat_id"], doc_ref.id, data)
+    return True
+
+
+async def bulk_write(db, writes, batch_size=500, concurrency=4):
+    """Commits any number of writes in batches, for backfills and migrations.
+
+    The writes are split into batches of at most batch_size (the Firestore
+    limit is 500), and up to concurrency batches are committed at a time, each
+    with the retries of commit_writes.
+
+    Args:
+        db: Firestore client instance.
+        writes (list): Pending (document reference, data) writes.
+        batch_size (int, optional): Writes per batch. Defaults to 500.
+        concurrency (int, optional): Batches committed at a time. Defaults to 4.
 
-    Queries the 'event_info' collection for events associated with the given chat ID
-    and starting from today's date or later.
+    Returns:
+        int: Number of writes that could not be committed.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def commit_chunk(chunk):
+        async with semaphore:
+            return 0 if await commit_writes(db, chunk, counted=False) else len(chunk)
+
+    failed = await asyncio.gather(
+        *(
+            commit_chunk(writes[i : i + batch_size])
+            for i in range(0, len(writes), batch_size)
+        )
+    )
+    return sum(failed)
+
+
+async def retrieve_upcoming_view(db, chat_id):
+    """Returns the upcoming events view of a user, building it on first use.
+
+    The view holds the user's first UPCOMING_VIEW_MAX_EVENTS upcoming events
+    in start order and is kept up to date as events are added and deleted, so
+    listing, paging through and opening events costs no reads once it is built.
 
     Args:
         db: Firestore client instance.
         chat_id (int): Telegram chat ID of the user.
 
     Returns:
-        list or str: A list of lists, where each inner list represents an event's details,
-                      or an error message string if retrieval fails.
+        dict or None: The view, or None if it could not be built.
     """
+    view = view_get(chat_id)
+    if view is not None and (view["complete"] or view["keys"]):
+        increment("upcoming_view.hits")
+        return view
+
+    increment("upcoming_view.misses")
     col_ref = db.collection("event_info")
     try:
-        docs = (
+        docs = await (
             col_ref.where(filter=FieldFilter("chat_id", "==", chat_id))
-            .where(filter=FieldFilter("start_date", ">=", date_today))
+            .where(
+                filter=FieldFilter(
+                    "start_date", ">=", datetime.date.today().strftime("%Y-%m-%d")
+                )
+            )
             .order_by("start_date")
-            .limit(10)
+            .order_by(FieldPath.document_id())
+            .limit(UPCOMING_VIEW_MAX_EVENTS + 1)
             .get()
         )
-        result = []
-        for doc in docs:
-            doc_id = doc.id
-            doc = doc.to_dict()
-            event = [
-                doc["name"],
-                doc["start_date"],
-                doc["end_date"],
-                doc["start_time"],
-                doc["end_time"],
-                doc["location"],
-                doc["description"],
-                doc["link"],
-                doc_id,
-            ]
-            result.append(event)
+        complete = len(docs) <= UPCOMING_VIEW_MAX_EVENTS
+        docs = docs[:UPCOMING_VIEW_MAX_EVENTS]
+        view_build(chat_id, {doc.id: doc.to_dict() for doc in docs}, complete)
+        return view_get(chat_id)
+
+    except Exception as e:
+        print(f"An error occurred while building the upcoming events view: {e}")
+        return None
+
+
+async def retrieve_upcoming_events(db, chat_id):
+    """Retrieves upcoming events for a specific user from Firestore.
+
+    Returns the first 10 events of the user's upcoming events view, which
+    holds the events associated with the given chat ID starting from today's
+    date or later.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+
+    Returns:
+        list or str: A list of lists, where each inner list represents an event's details,
+                      or an error message string if retrieval fails.
+    """
+    try:
+        page, _, _ = await retrieve_events_page(db, chat_id, page_size=10, fields=None)
+        result = [event_to_list(doc_id, event) for doc_id, event in page]
 
         if result:
             return result
@@ -195,10 +360,174 @@ def retrieve_upcoming_events(db, chat_id):
         return "An error occurred. Please try again later."
 
 
-def dashboard_data(db):
+async def retrieve_event(db, chat_id, doc_id):
+    """Retrieves a single event of a user, from the upcoming events view if possible.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+        doc_id (str): Document ID of the event.
+
+    Returns:
+        dict or None: Contents of the event_info document, or None if it does
+                      not exist or belongs to another user.
+    """
+    view = view_get(chat_id)
+    if view is not None and doc_id in view["events"]:
+        increment("upcoming_view.hits")
+        return view["events"][doc_id]
+
+    doc = await db.collection("event_info").document(doc_id).get()
+    if not doc.exists or doc.to_dict().get("chat_id") != chat_id:
+        return None
+    return doc.to_dict()
+
+
+async def retrieve_all_events(db, chat_id):
+    """Retrieves every event (past and upcoming) of a specific user from Firestore.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+
+    Returns:
+        dict: Contents of the event_info documents, keyed by document ID.
+    """
+    col_ref = db.collection("event_info")
+    docs = await col_ref.where(filter=FieldFilter("chat_id", "==", chat_id)).get()
+    return {doc.id: doc.to_dict() for doc in docs}
+
+
+async def retrieve_events_in_range(db, chat_id, start_date, end_date, limit=25):
+    """Retrieves the events of a specific user starting within a date range.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+        start_date (str): First start date of the range, in YYYY-MM-DD format.
+        end_date (str): Last start date of the range, in YYYY-MM-DD format.
+        limit (int, optional): Maximum number of events. Defaults to 25.
+
+    Returns:
+        dict: Contents of the event_info documents in start date order, keyed
+              by document ID.
+    """
+    col_ref = db.collection("event_info")
+    docs = await (
+        col_ref.where(filter=FieldFilter("chat_id", "==", chat_id))
+        .where(filter=FieldFilter("start_date", ">=", start_date))
+        .where(filter=FieldFilter("start_date", "<=", end_date))
+        .order_by("start_date")
+        .limit(limit)
+        .get()
+    )
+    return {doc.id: doc.to_dict() for doc in docs}
+
+
+async def retrieve_events_page(
+    db,
+    chat_id,
+    cursor=None,
+    direction="at",
+    page_size=EVENTS_PAGE_SIZE,
+    fields=("name", "start_date"),
+):
+    """Retrieves one page of the upcoming events of a user, in start order.
+
+    Pages are addressed by cursors on (start_date, document ID). They are
+    served from the upcoming events view of the user. Pages past what the view
+    holds cost one small query however deep they are, fetching only the fields
+    shown in the event list.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+        cursor (tuple, optional): (start_date, document ID) of an event.
+            Defaults to None, the first page.
+        direction (str, optional): "at" for the page starting at the cursor,
+            "after" for the page following it and "before" for the page
+            preceding it. Defaults to "at".
+        page_size (int, optional): Events per page. Defaults to
+            EVENTS_PAGE_SIZE.
+        fields (tuple, optional): Fields fetched when the page is queried,
+            None for all of them. Defaults to name and start_date.
+
+    Returns:
+        tuple: List of (document ID, event) tuples, and whether there are
+               events before and after the page.
+    """
+    view = await retrieve_upcoming_view(db, chat_id)
+    page = view_page(view, cursor, direction, page_size) if view else None
+    if page is not None:
+        return page
+
+    col_ref = db.collection("event_info")
+    query = (
+        col_ref.where(filter=FieldFilter("chat_id", "==", chat_id))
+        .where(
+            filter=FieldFilter(
+                "start_date", ">=", datetime.date.today().strftime("%Y-%m-%d")
+            )
+        )
+        .order_by("start_date")
+        .order_by(FieldPath.document_id())
+    )
+    if fields is not None:
+        query = query.select(list(fields))
+    if cursor is not None:
+        position = {"start_date": cursor[0], FieldPath.document_id(): cursor[1]}
+        if direction == "after":
+            query = query.start_after(position)
+        elif direction == "before":
+            query = query.end_before(position)
+        else:
+            query = query.start_at(position)
+
+    # one extra event tells whether there is another page in that direction
+    if direction == "before" and cursor is not None:
+        docs = await query.limit_to_last(page_size + 1).get()
+        has_previous = len(docs) > page_size
+        has_next = True
+        docs = docs[-page_size:]
+    else:
+        docs = await query.limit(page_size + 1).get()
+        has_previous = cursor is not None
+        has_next = len(docs) > page_size
+        docs = docs[:page_size]
+
+    return [(doc.id, doc.to_dict()) for doc in docs], has_previous, has_next
+
+
+def event_to_list(doc_id, doc):
+    """Converts an event_info document into the list format used by the handlers.
+
+    Args:
+        doc_id (str): Document ID of the event.
+        doc (dict): Contents of the event_info document.
+
+    Returns:
+        list: Name, start date, end date, start time, end time, location,
+              description, link and document ID of the event.
+    """
+    return [
+        doc["name"],
+        doc["start_date"],
+        doc["end_date"],
+        doc["start_time"],
+        doc["end_time"],
+        doc["location"],
+        doc["description"],
+        doc["link"],
+        doc_id,
+    ]
+
+
+async def dashboard_data(db):
     """Retrieves data for the administrative dashboard from Firestore.
 
-    Fetches the count of users, messages, and events from their respective collections.
+    Reads the totals of users, messages, and events from their sharded
+    counters, which are cached for COUNTER_CACHE_TTL seconds, so the
+    dashboard costs a few reads however large the collections grow.
 
     Args:
         db: Firestore client instance.
@@ -208,13 +537,13 @@ def dashboard_data(db):
               returns a list with "None" for each value.
     """
     try:
-        user_ref = db.collection("user_records")
-        msg_ref = db.collection("message_log")
-        event_ref = db.collection("event_info")
-
-        user_count = user_ref.count().get()[0][0].value
-        msg_count = msg_ref.count().get()[0][0].value + 210
-        event_count = event_ref.count().get()[0][0].value + 154
+        user_count, msg_count, event_count = await asyncio.gather(
+            counter_value(global_counter(db, "users")),
+            counter_value(global_counter(db, "messages")),
+            counter_value(global_counter(db, "events")),
+        )
+        msg_count += 210
+        event_count += 154
 
         results = [user_count, msg_count, event_count]
 
@@ -223,3 +552,29 @@ def dashboard_data(db):
     except Exception as e:
         print(f"Could not retrieve values {e}")
         return ["None", "None", "None"]
+
+
+async def seed_counters(db):
+    """Seeds the global counters with the documents counted before they existed.
+
+    Runs on startup. Only counters without a base are seeded, so after the
+    first run this costs three reads.
+
+    Args:
+        db: Firestore client instance.
+    """
+    try:
+        await asyncio.gather(
+            counter_seed(
+                global_counter(db, "users"), db.collection("user_records").count()
+            ),
+            *(
+                counter_seed(
+                    global_counter(db, name), db.collection(collection).count()
+                )
+                for collection, name in COUNTED_COLLECTIONS.items()
+            ),
+        )
+
+    except Exception as e:
+        print(f"Could not seed counters {e}")
@@ -1,16 +1,26 @@
-from googleapiclient.discovery import build
-from google.auth.transport.requests import Request
-from googleapiclient.errors import HttpError
-from google.oauth2.credentials import Credentials
 from config import return_flow
 
 import datetime
-import asyncio
-
+import uuid
 
 from utils.telegram_handlers import send_msg
 from utils.firebase_handlers import event_info_add
-from config import CAL_CLIENT_ID, CAL_CLIENT_SECRET
+from utils.user_context import (
+    user_context,
+    user_context_data,
+    user_context_set,
+    user_context_flush,
+)
+from utils.token_manager import token_store, token_forget
+from utils.calendar_client import (
+    calendar_path,
+    calendar_batch,
+    insert_calendar,
+    delete_event,
+)
+
+# responses to the deletion of an event, 404 and 410 when it was already gone
+DELETED_STATUSES = {200, 204, 404, 410}
 
 
 async def link_handler(session, chat_id, calendar_id):
@@ -56,7 +66,7 @@ async def link_handler(session, chat_id, calendar_id):
         print(f"Error in link_handler : {e}")
 
 
-async def unlink_handler(db, session, chat_id, text=None, position=None):
+async def unlink_handler(db, session, chat_id, context, text=None, position=None):
     """Handles the unlinking process of the user's Google Calendar from TimeSked.
 
     If the user has a linked calendar, prompts for confirmation before revoking
@@ -67,6 +77,7 @@ async def unlink_handler(db, session, chat_id, text=None, position=None):
         db: Firestore client instance.
         session: httpx asynchronous client session object.
         chat_id (int): Telegram chat ID of the user.
+        context (dict): Context of the user for this update.
         text (str, optional): User's input text for confirmation. Defaults to None.
         position (str, optional): Current state of the unlinking process.
                                    Defaults to None.
@@ -76,15 +87,13 @@ async def unlink_handler(db, session, chat_id, text=None, position=None):
             error message to the console.
     """
     try:
-        col_ref = db.collection("user_records")
-        doc_ref = col_ref.document(str(chat_id))
-        doc = doc_ref.get().to_dict()
+        doc = await user_context_data(context)
 
         calendar_id = doc["calendar_id"]
 
         if not position:
             if calendar_id:
-                doc_ref.update({"position": "DELETING"})
+                user_context_set(context, {"position": "DELETING"})
                 warning_msg = "⚠️ Warning: Unlinking will permanently revoke TimeSked's access to your Google Calendar. TimeSked will no longer be able to create, view, or delete events on your behalf. This action cannot be reversed. 🤔 \n\nTo confirm deletion, please type 'CONFIRM'. Typing anything else will cancel the operation."
                 await send_msg(session, chat_id, None, warning_msg)
 
@@ -99,23 +108,26 @@ async def unlink_handler(db, session, chat_id, text=None, position=None):
                 # delete_calendar(service, calendar_id) -- cannot delete calendar with this scope
                 await revoke_google_token(session, access_token)
                 await revoke_google_token(session, refresh_token)
+                token_forget(chat_id)
 
                 info_msg = "👋 Okay, I've unlinked your Google Calendar from TimeSked. \nJust a heads-up: TimeSked does not have permission to delete calendars automatically. If you want to remove the TimeSked calendar completely, you can do that directly in your Google Calendar settings."
                 await send_msg(session, chat_id, None, info_msg)
 
-                doc_ref.update(
+                user_context_set(
+                    context,
                     {
                         "position": None,
                         "calendar_id": None,
                         "access_token": None,
                         "refresh_token": None,
-                    }
+                        "token_expiry": None,
+                    },
                 )
 
             else:
                 info_msg = "🎉 The delete operation was canceled. Your calendar and events remain unchanged. "
                 await send_msg(session, chat_id, None, info_msg)
-                doc_ref.update({"position": None})
+                user_context_set(context, {"position": None})
 
     except Exception as e:
         print(f"Error in unlink_handler {e}")
@@ -135,7 +147,9 @@ async def revoke_google_token(session, token):
         print(f"Error revoking token: {response.text}")
 
 
-async def first_signin(db, chat_id, access_token, refresh_token):
+async def first_signin(
+    db, session, chat_id, access_token, refresh_token, token_expiry=None
+):
     """Handles the first-time sign-in process, creating a calendar and updating user data.
 
     Retrieves user information, creates a new Google Calendar specifically for TimeSked
@@ -143,81 +157,44 @@ async def first_signin(db, chat_id, access_token, refresh_token):
 
     Args:
         db: Firestore client instance.
+        session: httpx asynchronous client session object.
         chat_id (int): Telegram chat ID of the user.
         access_token (str): Google Calendar API access token.
         refresh_token (str): Google Calendar API refresh token.
+        token_expiry (float, optional): Unix timestamp the access token expires
+                                        at. Defaults to None.
 
     Raises:
         Exception: If an error occurs during the sign-in process, prints the error
             message to the console.
     """
     try:
-        col_ref = db.collection("user_records")
-        doc_ref = col_ref.document(str(chat_id))
-        doc = doc_ref.get().to_dict()
-        calendar_id = doc["calendar_id"]
-        if not calendar_id:
-            service = get_authenticated_service(
-                db, chat_id, access_token, refresh_token
-            )
-            calendar_id = create_calendar(service, "TimeSked")
-
-        doc_ref.update(
+        context = user_context(db, chat_id)
+        calendar_id = (await user_context_data(context))["calendar_id"]
+        user_context_set(
+            context,
             {
                 "access_token": access_token,
                 "refresh_token": refresh_token,
-                "calendar_id": calendar_id,
-            }
+                "token_expiry": token_expiry,
+            },
         )
+        token_store(chat_id, access_token, refresh_token, token_expiry)
+        if not calendar_id:
+            calendar_id = await create_calendar(session, context, "TimeSked")
+
+        user_context_set(context, {"calendar_id": calendar_id})
+        await user_context_flush(context)
     except Exception as e:
         print(f"Error in first_signin : {e}")
 
 
-def get_authenticated_service(db, chat_id, access_token, refresh_token):
-    """Authenticates with the Google Calendar API using provided credentials.
-
-    Builds and returns a Google Calendar API service object after refreshing
-    the access token if necessary.
-
-    Args:
-        db: Firestore client instance.
-        chat_id (int): Telegram chat ID of the user.
-        access_token (str): Google Calendar API access token.
-        refresh_token (str): Google Calendar API refresh token.
-
-    Returns:
-        googleapiclient.discovery.Resource: A Google Calendar API service object.
-    """
-
-    credentials = Credentials(
-        token=access_token,
-        refresh_token=refresh_token,
-        token_uri="https://oauth2.googleapis.com/token",
-        client_id=CAL_CLIENT_ID,
-        client_secret=CAL_CLIENT_SECRET,
-    )
-
-    # Check if the token is expired
-    if credentials.expired:
-        credentials.refresh(Request())  # Refresh the token
-        print("Access token refreshed!")
-
-        updated_access_token = credentials.token
-
-        col_ref = db.collection("user_records")
-        doc_ref = col_ref.document(str(chat_id))
-        doc_ref.update({"access_token": updated_access_token})
-
-    service = build("calendar", "v3", credentials=credentials)
-
-    return service
-
-
-def create_calendar(service, summary, time_zone="Asia/Kolkata"):
+async def create_calendar(session, context, summary, time_zone="Asia/Kolkata"):
     """Creates a new Google Calendar with the specified summary and time zone.
 
     Args:
-        service: Google Calendar API service object.
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
         summary (str): Name of the calendar to be created.
         time_zone (str, optional): Time zone for the calendar.
                                     Defaults to "Asia/Kolkata".
@@ -227,28 +204,28 @@ def create_calendar(service, summary, time_zone="Asia/Kolkata"):
     """
     try:
         calendar = {"summary": summary, "timeZone": time_zone}
-        created_calendar = service.calendars().insert(body=calendar).execute()
-        return created_calendar["id"]
+        response = await insert_calendar(session, context, calendar)
+        if response.status_code != 200:
+            print(f"Error creating calendar: {response.text}")
+            return None
+        return response.json()["id"]
     except Exception as e:
         print(f"Error creating calendar: {e}")
         return None
 
 
-async def add_event_to_calendar(service, calendar_id, event_details):
-    """Adds an event to the specified Google Calendar.
-
-    Constructs the event data from the provided details and inserts it into
-    the specified calendar.
+def calendar_event(event_details):
+    """Builds the Google Calendar event resource of an event.
 
     Args:
-        service: Google Calendar API service object.
-        calendar_id (str): Google Calendar ID where the event should be added.
         event_details (list): List containing event name, start date, end date,
                               start time, end time, location, and description.
 
+    The event gets its ID here, so an insert sent again after a lost answer
+    is refused with a 409 instead of creating the event twice.
+
     Returns:
-        googleapiclient.http.HttpRequest: An HTTP request object representing
-                                           the event insertion operation.
+        dict: The event resource, as sent to events.insert.
     """
     (
         name,
@@ -261,6 +238,8 @@ async def add_event_to_calendar(service, calendar_id, event_details):
     ) = event_details
 
     event = {
+        # base32hex, as Google requires of event IDs
+        "id": uuid.uuid4().hex,
         "summary": name,
         "start": {
             "timeZone": "Asia/Kolkata",
@@ -292,15 +271,15 @@ async def add_event_to_calendar(service, calendar_id, event_details):
     if description:
         event["description"] = description
 
-    event = service.events().insert(calendarId=calendar_id, body=event)
     return event
 
 
-def delete_event_calendar(service, calendar_id, event_id):
+async def delete_event_calendar(session, context, calendar_id, event_id):
     """Deletes an event from the specified Google Calendar.
 
     Args:
-        service: Google Calendar API service object.
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
         calendar_id (str): Google Calendar ID where the event is located.
         event_id (str): ID of the event to be deleted.
 
@@ -309,14 +288,16 @@ def delete_event_calendar(service, calendar_id, event_id):
             message to the console.
     """
     try:
-        service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
-        print("Event deleted successfully.")
+        response = await delete_event(session, context, calendar_id, event_id)
+        if response.status_code not in DELETED_STATUSES:
+            print(f"Error in delete event calendar {response.text}")
     except Exception as e:
         print(f"Error in delete event calendar {e}")
 
 
 async def gcal_event_handler(
     db,
+    session,
     waiting_msg,
     chat_id,
     received_message_id,
@@ -325,15 +306,18 @@ async def gcal_event_handler(
     suggestions,
     calendar_id,
     queue,
+    context,
+    writes,
 ):
     """Handles the process of adding events to the user's Google Calendar.
 
     Authenticates with the Google Calendar API, adds each event to the calendar,
-    retrieves event links and IDs, updates event information in Firestore,
+    retrieves event links and IDs, queues the event information for Firestore,
     and manages the asynchronous operations using the queue.
 
     Args:
         db: Firestore client instance.
+        session: httpx asynchronous client session object.
         waiting_msg (str): Waiting message to be sent to the user.
         chat_id (int): Telegram chat ID of the user.
         received_message_id (int): Message ID of the received user message.
@@ -343,6 +327,9 @@ async def gcal_event_handler(
                                      Defaults to None.
         calendar_id (str): Google Calendar ID where events should be added.
         queue (asyncio.Queue): Queue for managing asynchronous operations.
+        context (dict): Context of the user for this update.
+        writes (list): Pending Firestore writes of the update, the new events
+                       are added to it.
 
     Returns:
         list: A list of dictionaries, each containing event details and their
@@ -353,19 +340,13 @@ async def gcal_event_handler(
 
     list_of_events = []
     g_events = []
+    # position in events of every calendar event, events may hold errors too
+    positions = []
 
-    col_ref = db.collection("user_records")
-    doc_ref = col_ref.document(str(chat_id))
-    doc = doc_ref.get().to_dict()
-
-    access_token = doc["access_token"]
-    refresh_token = doc["refresh_token"]
-
-    service = get_authenticated_service(db, chat_id, access_token, refresh_token)
-    for event_details in events:
+    for idx, event_details in enumerate(events):
         if isinstance(event_details, list):
-            g_event = await add_event_to_calendar(service, calendar_id, event_details)
-            g_events.append(g_event)
+            g_events.append(calendar_event(event_details))
+            positions.append(idx)
             list_of_events.append(
                 {
                     "name": event_details[0],
@@ -379,57 +360,89 @@ async def gcal_event_handler(
         else:
             list_of_events.append(event_details)
 
-    event_links_ids = batch_multiple_events(service, g_events)
-    for idx, link_id in enumerate(event_links_ids):
-        event_id = link_id["id"]
+    event_links_ids = await batch_multiple_events(
+        session, context, calendar_id, g_events
+    )
+    for idx, link_id in zip(positions, event_links_ids):
+        # events Google did not add are left out, as before
+        if link_id is None:
+            continue
         list_of_events[idx].update({"link": link_id["link"]})
-        asyncio.create_task(
-            event_info_add(
-                db,
-                chat_id,
-                received_message_id,
-                events[idx],
-                link_id["link"],
-                event_id,
-            )
+        event_info_add(
+            db,
+            writes,
+            chat_id,
+            received_message_id,
+            events[idx],
+            link_id["link"],
+            link_id["id"],
         )
 
     return list_of_events
 
 
-def batch_multiple_events(service, g_events):
+async def batch_multiple_events(session, context, calendar_id, g_events):
     """Uses batch requests to add multiple events to Google Calendar efficiently.
 
     This function helps to reduce the number of API calls and improve performance
     when adding multiple events.
 
     Args:
-        service: Google Calendar API service object.
-        g_events (list): A list of Google Calendar event insertion requests.
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        calendar_id (str): Google Calendar ID where the events should be added.
+        g_events (list): Event resources built by calendar_event.
 
     Returns:
-        list: A list of dictionaries, each containing the event ID and link
-              for successfully added events.
+        list: For every event, in order, a dictionary with its event ID and
+              link, or None if it could not be added.
     """
-    event_links_ids = []
+    path = calendar_path(calendar_id)
+    results = await calendar_batch(
+        session, context, [("POST", path, g_event) for g_event in g_events]
+    )
 
-    def callback(request_id, response, exception):
-        if exception is not None:
-            print(f"Error for request {request_id}: {exception}")
+    event_links_ids = []
+    for idx, (status, response) in enumerate(results):
+        if status != 200:
+            print(f"Error for request {idx}: {status} {response}")
+            event_links_ids.append(None)
         else:
             event_links_ids.append(
                 {"id": response.get("id"), "link": response.get("htmlLink")}
             )
 
-    batch = service.new_batch_http_request(callback=callback)
+    return event_links_ids
 
-    for g_event in g_events:
-        batch.add(g_event)
 
-    # Execute the batch request
-    try:
-        batch.execute()
-    except HttpError as error:
-        print(f"An error occurred in batch_multiple_events : {error}")
+async def batch_delete_events(session, context, calendar_id, event_ids):
+    """Uses batch requests to delete multiple events from Google Calendar.
 
-    return event_links_ids
+    The deletions are sent in batch HTTP requests of up to CALENDAR_BATCH_SIZE
+    events each, instead of one request per event.
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        calendar_id (str): Google Calendar ID where the events are located.
+        event_ids (list): IDs of the events to be deleted.
+
+    Returns:
+        int: Number of events that could not be deleted.
+    """
+    results = await calendar_batch(
+        session,
+        context,
+        [
+            ("DELETE", calendar_path(calendar_id, event_id), None)
+            for event_id in event_ids
+        ],
+    )
+
+    failed = 0
+    for event_id, (status, response) in zip(event_ids, results):
+        if status not in DELETED_STATUSES:
+            print(f"Error deleting event {event_id}: {status} {response}")
+            failed += 1
+
+    return failed
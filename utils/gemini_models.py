@@ -1,9 +1,119 @@
 from ast import literal_eval
+import time
 
-from config import text_model, img_model, query
+from utils.model_scheduler import model_slot
+from config import text_model, img_model, query, MODEL_USAGE_PER_CHAT
 
+model_usage = {}
+chat_usage = {}
 
-def prompter(type, message):
+
+def record_model_usage(model, call_site, response, latency, attempt=1, chat_id=None):
+    """Adds the token usage and latency of a Gemini call to the in-memory aggregates.
+
+    Usage is aggregated per model and call site, and additionally per chat ID
+    when MODEL_USAGE_PER_CHAT is enabled.
+
+    Args:
+        model: The genai.GenerativeModel that was called.
+        call_site (str): Name of the code path that made the call
+                         (eg. "extract_text", "chat").
+        response: The Gemini response, or None if the call failed.
+        latency (float): Duration of the call in seconds.
+        attempt (int, optional): Attempt number of the call. Defaults to 1.
+        chat_id (int, optional): Telegram chat ID the call was made for.
+                                 Defaults to None.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    candidate_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+
+    model_name = getattr(model, "model_name", str(model))
+    key = f"{model_name}|{call_site}"
+    buckets = [model_usage.setdefault(key, {})]
+    if MODEL_USAGE_PER_CHAT and chat_id is not None:
+        buckets.append(chat_usage.setdefault(str(chat_id), {}).setdefault(key, {}))
+
+    for bucket in buckets:
+        bucket["calls"] = bucket.get("calls", 0) + 1
+        bucket["failed_calls"] = bucket.get("failed_calls", 0) + int(response is None)
+        bucket["prompt_tokens"] = bucket.get("prompt_tokens", 0) + prompt_tokens
+        bucket["candidate_tokens"] = (
+            bucket.get("candidate_tokens", 0) + candidate_tokens
+        )
+        bucket["cached_tokens"] = bucket.get("cached_tokens", 0) + cached_tokens
+        bucket["latency_total"] = bucket.get("latency_total", 0.0) + latency
+        attempts = bucket.setdefault("calls_by_attempt", {})
+        attempts[str(attempt)] = attempts.get(str(attempt), 0) + 1
+
+
+def model_usage_snapshot(chat_id=None):
+    """Returns the aggregated model usage.
+
+    Args:
+        chat_id (int, optional): If given, returns the usage of that chat only.
+                                 Defaults to None.
+
+    Returns:
+        dict: Usage keyed by "model|call_site", with the average latency added.
+    """
+    usage = model_usage if chat_id is None else chat_usage.get(str(chat_id), {})
+
+    summary = {}
+    for key, bucket in usage.items():
+        summary[key] = dict(
+            bucket, latency_average=bucket["latency_total"] / bucket["calls"]
+        )
+    return summary
+
+
+async def generate(
+    model,
+    contents,
+    call_site,
+    attempt=1,
+    chat_id=None,
+    priority="text",
+    **kwargs,
+):
+    """Calls a Gemini model and records its token usage and latency.
+
+    Every model call in TimeSked goes through this function (or, for streamed
+    responses, calls record_model_usage once the stream is consumed). The call
+    waits for a slot of the shared model scheduler first.
+
+    Args:
+        model: The genai.GenerativeModel to call.
+        contents: Prompt contents passed to generate_content_async.
+        call_site (str): Name of the code path making the call.
+        attempt (int, optional): Attempt number of the call. Defaults to 1.
+        chat_id (int, optional): Telegram chat ID the call is made for.
+                                 Defaults to None.
+        priority (str, optional): Scheduler priority class. Defaults to "text".
+        **kwargs: Extra keyword arguments for generate_content_async.
+
+    Returns:
+        google.generativeai.types.AsyncGenerateContentResponse: The model response.
+    """
+    async with model_slot(priority):
+        start = time.perf_counter()
+        response = None
+        try:
+            response = await model.generate_content_async(contents, **kwargs)
+            return response
+        finally:
+            record_model_usage(
+                model,
+                call_site,
+                response,
+                time.perf_counter() - start,
+                attempt,
+                chat_id,
+            )
+
+
+async def prompter(type, message, attempt=1, chat_id=None, priority=None):
     """Sends a prompt to the Gemini model to extract event details.
 
     This function handles both text and image-based prompts, processes the model's
@@ -11,7 +121,13 @@ def prompter(type, message):
 
     Args:
         type (str): The type of message ("text" or "image").
-        message (str or bytes): The message content (text or image data).
+        message (str or dict): The message content (text or inline image blob).
+        attempt (int, optional): Attempt number, used for usage accounting.
+                                 Defaults to 1.
+        chat_id (int, optional): Telegram chat ID, used for usage accounting.
+                                 Defaults to None.
+        priority (str, optional): Scheduler priority class. Defaults to "text"
+                                  or "photo" depending on the message type.
 
     Returns:
         list or str: If successful, returns a list of lists, where each inner list
@@ -21,9 +137,20 @@ def prompter(type, message):
     """
     try:
         if type == "text":
-            response = text_model.generate_content(f"{query} {message}")
+            model = text_model
+            contents = f"{query} {message}"
+            call_site = "extract_text"
         else:
-            response = img_model.generate_content([message, query])
+            model = img_model
+            contents = [message, query]
+            call_site = "extract_image"
+
+        if priority is None:
+            priority = "text" if type == "text" else "photo"
+
+        response = await generate(
+            model, contents, call_site, attempt, chat_id, priority
+        )
 
         details = response.text.replace("\n", "")
         print(f"Model Response : {details}")
@@ -37,10 +164,14 @@ def prompter(type, message):
                 break
             except SyntaxError as e:
                 if "unterminated string literal" in str(e):
-                    if type == "text":
-                        response = text_model.generate_content(f"{query} {message}")
-                    else:
-                        response = img_model.generate_content([message, query])
+                    response = await generate(
+                        model,
+                        contents,
+                        f"{call_site}_reparse",
+                        attempt,
+                        chat_id,
+                        priority,
+                    )
 
                     details = response.text.replace("\n", "")
 
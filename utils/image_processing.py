@@ -0,0 +1,180 @@
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor
+import asyncio
+
+from PIL import Image, ImageChops, ImageOps
+
+from config import (
+    IMAGE_MAX_EDGE,
+    IMAGE_JPEG_QUALITY,
+    IMAGE_TRIM_BORDERS,
+    IMAGE_POOL_WORKERS,
+    PHOTO_PIXEL_BUDGET,
+    PHOTO_MAX_ESCALATIONS,
+)
+
+image_pool = None
+
+
+def trim_uniform_borders(image, tolerance=12):
+    """Crops away uniform borders around an image.
+
+    The colour of the top left pixel is treated as the border colour, and every
+    row and column that stays within the tolerance of it is removed.
+
+    Args:
+        image (PIL.Image.Image): RGB image to be trimmed.
+        tolerance (int, optional): Maximum per channel difference that is still
+                                   considered part of the border. Defaults to 12.
+
+    Returns:
+        PIL.Image.Image: The cropped image, or the original image if there is
+                         no border to remove.
+    """
+    background = Image.new(image.mode, image.size, image.getpixel((0, 0)))
+    difference = ImageChops.difference(image, background)
+    difference = ImageChops.add(difference, difference, 2.0, -tolerance)
+    bbox = difference.getbbox()
+
+    if bbox and bbox != (0, 0, image.width, image.height):
+        return image.crop(bbox)
+
+    return image
+
+
+def preprocess_image(image_bytes, max_edge, quality, trim_borders):
+    """Downscales, optionally trims and re-encodes an image as JPEG.
+
+    This function is CPU bound and is meant to be run inside the process pool
+    through preprocess_in_pool.
+
+    Args:
+        image_bytes (bytes): Raw bytes of the downloaded image.
+        max_edge (int): Target length in pixels of the longer edge. Images that
+                        are already smaller are never upscaled.
+        quality (int): JPEG quality used while re-encoding.
+        trim_borders (bool): Whether uniform borders should be cropped away.
+
+    Returns:
+        bytes: The JPEG encoded image. The original bytes are returned when
+               re-encoding would not make the image any smaller.
+    """
+    image = Image.open(BytesIO(image_bytes))
+    original_size = image.size
+    image = ImageOps.exif_transpose(image)
+
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    if trim_borders:
+        image = trim_uniform_borders(image)
+
+    image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+    output = BytesIO()
+    image.save(output, format="JPEG", quality=quality, optimize=True)
+    processed_bytes = output.getvalue()
+
+    if image.size == original_size and len(processed_bytes) >= len(image_bytes):
+        return image_bytes
+
+    return processed_bytes
+
+
+async def preprocess_in_pool(
+    image_bytes,
+    max_edge=IMAGE_MAX_EDGE,
+    quality=IMAGE_JPEG_QUALITY,
+    trim_borders=IMAGE_TRIM_BORDERS,
+):
+    """Runs preprocess_image in the process pool, off the event loop.
+
+    Args:
+        image_bytes (bytes): Raw bytes of the downloaded image.
+        max_edge (int, optional): Target length of the longer edge.
+                                  Defaults to IMAGE_MAX_EDGE.
+        quality (int, optional): JPEG quality. Defaults to IMAGE_JPEG_QUALITY.
+        trim_borders (bool, optional): Whether uniform borders should be
+                                       cropped. Defaults to IMAGE_TRIM_BORDERS.
+
+    Returns:
+        dict: An inline image blob ({"mime_type", "data"}) that can be passed
+              to the Gemini models directly. If preprocessing fails, the blob
+              holds the original bytes.
+    """
+    global image_pool
+    try:
+        if image_pool is None:
+            image_pool = ProcessPoolExecutor(max_workers=IMAGE_POOL_WORKERS)
+
+        loop = asyncio.get_running_loop()
+        image_bytes = await loop.run_in_executor(
+            image_pool,
+            preprocess_image,
+            image_bytes,
+            max_edge,
+            quality,
+            trim_borders,
+        )
+
+    except Exception as e:
+        print(f"Error in preprocess_in_pool, sending the original image : {e}")
+
+    return {"mime_type": "image/jpeg", "data": image_bytes}
+
+
+def photo_size_ladder(
+    photo_sizes, pixel_budget=PHOTO_PIXEL_BUDGET, max_escalations=PHOTO_MAX_ESCALATIONS
+):
+    """Orders the Telegram PhotoSize entries of a photo for progressive extraction.
+
+    The first entry is the smallest size that meets the pixel budget (or the
+    largest size if none does), followed by the larger sizes that extraction
+    may escalate to.
+
+    Args:
+        photo_sizes (list): The "photo" array of a Telegram message.
+        pixel_budget (int, optional): Minimum width * height of the first size.
+                                      Defaults to PHOTO_PIXEL_BUDGET.
+        max_escalations (int, optional): Maximum number of larger sizes kept
+                                         after the first one.
+                                         Defaults to PHOTO_MAX_ESCALATIONS.
+
+    Returns:
+        list: PhotoSize dictionaries, smallest adequate size first.
+    """
+    sizes = sorted(photo_sizes, key=lambda size: size["width"] * size["height"])
+
+    start = len(sizes) - 1
+    for idx, size in enumerate(sizes):
+        if size["width"] * size["height"] >= pixel_budget:
+            start = idx
+            break
+
+    return sizes[start : start + 1 + max_escalations]
+
+
+def photo_extraction_adequate(events):
+    """Checks whether the events extracted from a photo can be trusted.
+
+    A result is treated as low confidence when it has no valid event, or when
+    some of the extracted events failed validation.
+
+    Args:
+        events (list): Output of process_events.
+
+    Returns:
+        bool: True if no escalation to a larger photo size is needed.
+    """
+    if not any(isinstance(event, list) and event for event in events):
+        return False
+
+    return not any(isinstance(event, ValueError) for event in events)
+
+
+def shutdown_image_pool():
+    """Shuts down the image preprocessing process pool, if it was started."""
+    global image_pool
+    if image_pool is not None:
+        image_pool.shutdown(wait=False, cancel_futures=True)
+        image_pool = None
@@ -0,0 +1,71 @@
+import asyncio
+import time
+
+counters = {}
+observations = {}
+
+
+def increment(name, value=1):
+    """Increments an in-memory counter.
+
+    Args:
+        name (str): Name of the counter.
+        value (int, optional): Amount to add. Defaults to 1.
+    """
+    counters[name] = counters.get(name, 0) + value
+
+
+def observe(name, value):
+    """Records a single observation (latency, size, ...) of a metric.
+
+    Keeps the count, sum, minimum and maximum of every metric so averages can
+    be derived without holding on to the individual values.
+
+    Args:
+        name (str): Name of the metric.
+        value (float): The observed value.
+    """
+    stats = observations.get(name)
+    if stats is None:
+        observations[name] = {
+            "count": 1,
+            "total": value,
+            "min": value,
+            "max": value,
+        }
+    else:
+        stats["count"] += 1
+        stats["total"] += value
+        stats["min"] = min(stats["min"], value)
+        stats["max"] = max(stats["max"], value)
+
+
+def snapshot():
+    """Returns a copy of all counters and observations.
+
+    Returns:
+        dict: A dictionary with the counters and, for every observed metric,
+              its count, total, average, minimum and maximum.
+    """
+    summary = {}
+    for name, stats in observations.items():
+        summary[name] = dict(stats, average=stats["total"] / stats["count"])
+
+    return {"counters": dict(counters), "observations": summary}
+
+
+async def loop_lag_monitor(interval=0.5):
+    """Background task measuring how late the event loop wakes up.
+
+    Sleeps for interval seconds at a time and records, as event_loop_lag, how
+    much longer than that the wake up took. Anything blocking the loop (a
+    synchronous network call, heavy CPU work) shows up as lag.
+
+    Args:
+        interval (float, optional): Seconds between two measurements.
+            Defaults to 0.5.
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        observe("event_loop_lag", time.perf_counter() - start - interval)
@@ -0,0 +1,136 @@
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import heapq
+import itertools
+import time
+
+from utils.metrics import observe
+from config import MODEL_MAX_CONCURRENCY, MODEL_RPM
+
+# Lower value means higher priority
+PRIORITIES = {
+    "chat": 0,
+    "regenerate": 1,
+    "text": 2,
+    "photo": 3,
+    "background": 4,
+}
+
+waiting = []
+active = 0
+call_times = deque()
+sequence = itertools.count()
+quota_timer = None
+
+
+def quota_delay():
+    """Returns how long to wait before the per-minute budget allows another call.
+
+    Returns:
+        float: Seconds until a call is allowed, 0 if one is allowed right now.
+    """
+    now = time.monotonic()
+    while call_times and now - call_times[0] >= 60:
+        call_times.popleft()
+
+    if MODEL_RPM <= 0 or len(call_times) < MODEL_RPM:
+        return 0
+    return 60 - (now - call_times[0])
+
+
+def dispatch():
+    """Hands free call slots to the highest priority waiters."""
+    global active, quota_timer
+
+    while waiting and active < MODEL_MAX_CONCURRENCY:
+        delay = quota_delay()
+        if delay > 0:
+            if quota_timer is None:
+                quota_timer = asyncio.get_running_loop().call_later(
+                    delay, on_quota_timer
+                )
+            return
+
+        _, _, future = heapq.heappop(waiting)
+        if future.done():
+            # the waiter was cancelled
+            continue
+
+        active += 1
+        call_times.append(time.monotonic())
+        future.set_result(None)
+
+
+def on_quota_timer():
+    global quota_timer
+    quota_timer = None
+    dispatch()
+
+
+async def acquire(priority_class):
+    """Waits for a model call slot.
+
+    Slots are handed out in priority order, within the global concurrency limit
+    and the per-minute call budget. The time spent waiting is recorded per
+    priority class.
+
+    Args:
+        priority_class (str): One of the keys of PRIORITIES.
+    """
+    start = time.perf_counter()
+    future = asyncio.get_running_loop().create_future()
+    heapq.heappush(waiting, (PRIORITIES[priority_class], next(sequence), future))
+    dispatch()
+
+    try:
+        await future
+    except asyncio.CancelledError:
+        if future.done() and not future.cancelled():
+            # the slot was granted just before the cancellation
+            release()
+        raise
+
+    observe(f"model_queue_wait.{priority_class}", time.perf_counter() - start)
+
+
+def release():
+    """Frees a model call slot and wakes up the next waiter."""
+    global active
+    active -= 1
+    dispatch()
+
+
+@asynccontextmanager
+async def model_slot(priority_class):
+    """Async context manager holding a model call slot for its duration.
+
+    Args:
+        priority_class (str): One of the keys of PRIORITIES.
+    """
+    await acquire(priority_class)
+    try:
+        yield
+    finally:
+        release()
+
+
+def scheduler_state():
+    """Returns the current state of the scheduler.
+
+    Returns:
+        dict: Number of active calls, waiters per priority class and calls
+              made in the last minute.
+    """
+    names = {value: key for key, value in PRIORITIES.items()}
+    queued = {}
+    for priority, _, future in waiting:
+        if not future.done():
+            queued[names[priority]] = queued.get(names[priority], 0) + 1
+
+    quota_delay()
+    return {
+        "active": active,
+        "waiting": queued,
+        "calls_last_minute": len(call_times),
+    }
@@ -0,0 +1,153 @@
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import time
+
+from google.cloud.firestore_v1.base_query import FieldFilter
+from google.cloud.firestore_v1.field_path import FieldPath
+
+from utils.event_index import index_remove
+from utils.metrics import increment, observe
+from config import (
+    MESSAGE_LOG_RETENTION_DAYS,
+    EVENT_RETENTION_DAYS,
+    RETENTION_BATCH_SIZE,
+    RETENTION_INTERVAL,
+    RETENTION_ARCHIVE_DIR,
+)
+
+# collection -> (date field the retention window applies to, window in days)
+RETENTION = {
+    "message_log": ("date", MESSAGE_LOG_RETENTION_DAYS),
+    "event_info": ("start_date", EVENT_RETENTION_DAYS),
+}
+
+
+def write_archive(path, collection, docs):
+    """Writes documents to a gzip compressed, column oriented JSON file.
+
+    Every field is stored once as a column (a list holding the value of each
+    document, None where it is missing), next to the list of document IDs.
+    The file is written under a temporary name and renamed, so an interrupted
+    write never leaves a truncated archive behind.
+
+    Args:
+        path (str): Path of the archive file.
+        collection (str): Name of the collection the documents come from.
+        docs (list): (document ID, contents) tuples.
+    """
+    fields = sorted({field for _, data in docs for field in data})
+    archive = {
+        "collection": collection,
+        "ids": [doc_id for doc_id, _ in docs],
+        "columns": {field: [data.get(field) for _, data in docs] for field in fields},
+    }
+
+    with gzip.open(f"{path}.tmp", "wt", encoding="utf-8") as file:
+        json.dump(archive, file, separators=(",", ":"), default=str)
+    os.replace(f"{path}.tmp", path)
+
+
+async def retention_batch(db, collection, field, cutoff):
+    """Archives and deletes the oldest batch of documents past the retention window.
+
+    Documents are taken oldest first, and deleted only once their archive is
+    written. A run that stops midway simply resumes with the documents that
+    are left, and an archive written for a batch whose deletion failed is
+    overwritten by the retry, as its name comes from the batch's first
+    document.
+
+    Args:
+        db: Firestore client instance.
+        collection (str): Name of the collection.
+        field (str): Date field (YYYY-MM-DD) the window applies to.
+        cutoff (str): Documents dated before this date are removed.
+
+    Returns:
+        int: Number of documents removed, 0 once none are left.
+    """
+    col_ref = db.collection(collection)
+    docs = await (
+        col_ref.where(filter=FieldFilter(field, "<", cutoff))
+        .order_by(field)
+        .order_by(FieldPath.document_id())
+        .limit(RETENTION_BATCH_SIZE)
+        .get()
+    )
+    if not docs:
+        return 0
+
+    if RETENTION_ARCHIVE_DIR:
+        first = docs[0]
+        path = os.path.join(
+            RETENTION_ARCHIVE_DIR,
+            f"{collection}-{first.get(field)}-{first.id}.json.gz",
+        )
+        await asyncio.to_thread(
+            write_archive, path, collection, [(doc.id, doc.to_dict()) for doc in docs]
+        )
+
+    batch = db.batch()
+    for doc in docs:
+        batch.delete(doc.reference)
+    await batch.commit()
+
+    if collection == "event_info":
+        for doc in docs:
+            index_remove(doc.get("chat_id"), doc.id)
+
+    increment(f"retention.removed.{collection}", len(docs))
+    return len(docs)
+
+
+async def run_retention(db):
+    """Removes the message_log entries and events older than their retention windows.
+
+    Works through each collection in batches of RETENTION_BATCH_SIZE until no
+    document past its window is left. If RETENTION_ARCHIVE_DIR is set, every
+    batch is archived there before it is deleted.
+
+    Args:
+        db: Firestore client instance.
+
+    Returns:
+        dict: Number of documents removed from each collection.
+    """
+    if RETENTION_ARCHIVE_DIR:
+        os.makedirs(RETENTION_ARCHIVE_DIR, exist_ok=True)
+
+    removed = {}
+    for collection, (field, days) in RETENTION.items():
+        start = time.perf_counter()
+        cutoff = (datetime.date.today() - datetime.timedelta(days=days)).strftime(
+            "%Y-%m-%d"
+        )
+        removed[collection] = 0
+        while True:
+            count = await retention_batch(db, collection, field, cutoff)
+            removed[collection] += count
+            if count < RETENTION_BATCH_SIZE:
+                break
+            # leave room for the requests of the users between batches
+            await asyncio.sleep(1)
+
+        observe(f"retention.duration.{collection}", time.perf_counter() - start)
+
+    return removed
+
+
+async def retention_job(db):
+    """Background task running the retention every RETENTION_INTERVAL seconds.
+
+    Args:
+        db: Firestore client instance.
+    """
+    while True:
+        try:
+            removed = await run_retention(db)
+            print(f"Retention removed {removed}")
+        except Exception as e:
+            print(f"Error in retention_job {e}")
+        await asyncio.sleep(RETENTION_INTERVAL)
@@ -0,0 +1,155 @@
+import asyncio
+import time
+
+from utils.metrics import increment
+from config import SESSION_FLUSH_INTERVAL, SESSION_TTL
+
+# chat_id -> {"position", "chat_session", "pending_turns", "last_used", "lock"}
+sessions = {}
+
+
+def session_get(chat_id):
+    """Returns the cached session of a user, if there is one.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+
+    Returns:
+        dict or None: The cached entry, or None on a cache miss.
+    """
+    entry = sessions.get(chat_id)
+    if entry is None:
+        increment("session_cache.misses")
+        return None
+
+    increment("session_cache.hits")
+    entry["last_used"] = time.monotonic()
+    return entry
+
+
+def session_put(chat_id, position, chat_session):
+    """Caches the session of a user who entered chat mode.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        position (str): Position of the user, "CHATTING".
+        chat_session (dict): Chat session, with the unsummarized turns.
+
+    Returns:
+        dict: The cached entry.
+    """
+    entry = {
+        "position": position,
+        "chat_session": chat_session,
+        "pending_turns": [],
+        "last_used": time.monotonic(),
+        # flushes of a user are serialized, so turn counts land in order
+        "lock": asyncio.Lock(),
+    }
+    sessions[chat_id] = entry
+    return entry
+
+
+def session_add_turns(chat_id, turns):
+    """Queues chat turns of a cached user to be written to Firestore.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        turns (list): Turn dictionaries (index, role, text).
+
+    Returns:
+        bool: True if the user is cached and the turns were queued.
+    """
+    entry = sessions.get(chat_id)
+    if entry is None:
+        return False
+
+    entry["pending_turns"] += turns
+    entry["last_used"] = time.monotonic()
+    return True
+
+
+async def session_flush(db, chat_id):
+    """Writes the pending turns of a cached user to Firestore.
+
+    Everything pending is written in a single batch: one small document per
+    turn, plus the turn count in the user's document.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+    """
+    entry = sessions.get(chat_id)
+    if entry is None or not entry["pending_turns"]:
+        return
+
+    async with entry["lock"]:
+        await write_pending(db, chat_id, entry)
+
+
+async def write_pending(db, chat_id, entry):
+    """Writes the pending turns of a cache entry in a single batch."""
+    turns = entry["pending_turns"]
+    entry["pending_turns"] = []
+    if not turns:
+        return
+
+    try:
+        user_ref = db.collection("user_records").document(str(chat_id))
+        batch = db.batch()
+        for turn in turns:
+            batch.set(
+                user_ref.collection("chat_turns").document(f"{turn['index']:06d}"),
+                turn,
+            )
+        batch.update(user_ref, {"chat_session.turn_count": turns[-1]["index"] + 1})
+        await batch.commit()
+        increment("session_cache.flushes")
+
+    except Exception as e:
+        # put them back, the next flush retries
+        entry["pending_turns"] = turns + entry["pending_turns"]
+        print(f"Error in session_flush {e}")
+
+
+def session_drop(chat_id):
+    """Removes a user from the cache without writing anything.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+    """
+    sessions.pop(chat_id, None)
+
+
+async def session_flush_all(db):
+    """Writes everything pending for every cached user, used on shutdown.
+
+    Args:
+        db: Firestore client instance.
+    """
+    await asyncio.gather(*(session_flush(db, chat_id) for chat_id in list(sessions)))
+
+
+async def session_flusher(db):
+    """Background task writing pending turns and evicting idle sessions.
+
+    Runs every SESSION_FLUSH_INTERVAL seconds. Sessions idle for longer than
+    SESSION_TTL are flushed one last time and dropped, the next message of the
+    user reloads them from Firestore.
+
+    Args:
+        db: Firestore client instance.
+    """
+    while True:
+        await asyncio.sleep(SESSION_FLUSH_INTERVAL)
+        now = time.monotonic()
+        await session_flush_all(db)
+        for chat_id in list(sessions):
+            entry = sessions.get(chat_id)
+            if (
+                entry is not None
+                and now - entry["last_used"] > SESSION_TTL
+                and not entry["pending_turns"]
+            ):
+                del sessions[chat_id]
+                increment("session_cache.evictions")
@@ -0,0 +1,108 @@
+import asyncio
+import random
+import time
+
+from firebase_admin import firestore
+from google.api_core.exceptions import AlreadyExists
+
+from utils.metrics import increment
+from config import COUNTER_SHARDS, COUNTER_CACHE_TTL
+
+# counter path -> (value, time it was read)
+cached_values = {}
+
+
+def global_counter(db, name):
+    """Returns the document of a global counter ("messages", "events" or "users").
+
+    Args:
+        db: Firestore client instance.
+        name (str): Name of the counter.
+
+    Returns:
+        The counter's document reference.
+    """
+    return db.collection("counters").document(name)
+
+
+def user_counter(db, chat_id, name):
+    """Returns the document of a counter of a single user, like "no_of_uses".
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+        name (str): Name of the counter.
+
+    Returns:
+        The counter's document reference.
+    """
+    user_ref = db.collection("user_records").document(str(chat_id))
+    return user_ref.collection("counters").document(name)
+
+
+def counter_increment(batch, counter_ref, amount=1, shards=COUNTER_SHARDS):
+    """Adds an increment of a sharded counter to a batch.
+
+    The increment goes to one of the counter's shard documents, picked at
+    random, so the writes of a busy counter are spread over all of its shards
+    instead of queueing on a single document.
+
+    Args:
+        batch: Firestore write batch the increment is added to.
+        counter_ref: Document reference returned by global_counter or user_counter.
+        amount (int, optional): Amount to add. Defaults to 1.
+        shards (int, optional): Number of shards. Defaults to COUNTER_SHARDS.
+    """
+    shard_ref = counter_ref.collection("shards").document(str(random.randrange(shards)))
+    batch.set(shard_ref, {"count": firestore.Increment(amount)}, merge=True)
+
+
+async def counter_value(counter_ref):
+    """Returns the value of a sharded counter, cached for COUNTER_CACHE_TTL seconds.
+
+    The value is the sum of all shards, plus the base stored in the counter's
+    document by counter_seed.
+
+    Args:
+        counter_ref: Document reference returned by global_counter or user_counter.
+
+    Returns:
+        int: Value of the counter.
+    """
+    cached = cached_values.get(counter_ref.path)
+    if cached is not None and time.monotonic() - cached[1] < COUNTER_CACHE_TTL:
+        increment("counters.cache_hits")
+        return cached[0]
+
+    doc, shards = await asyncio.gather(
+        counter_ref.get(), counter_ref.collection("shards").get()
+    )
+    value = (doc.to_dict() or {}).get("base", 0) if doc.exists else 0
+    value += sum((shard.to_dict() or {}).get("count", 0) for shard in shards)
+    cached_values[counter_ref.path] = (value, time.monotonic())
+    increment("counters.reads")
+    return value
+
+
+async def counter_seed(counter_ref, count_query):
+    """Sets the base of a counter that was not seeded yet to a count query.
+
+    Used once, to carry over the totals that were counted before the counter
+    existed. Documents already counted in the shards are left out of the base.
+    Counters that already have a base are left alone.
+
+    Args:
+        counter_ref: Document reference returned by global_counter.
+        count_query: Aggregation query counting the existing documents.
+    """
+    if (await counter_ref.get()).exists:
+        return
+
+    result, shards = await asyncio.gather(
+        count_query.get(), counter_ref.collection("shards").get()
+    )
+    counted = sum((shard.to_dict() or {}).get("count", 0) for shard in shards)
+    try:
+        await counter_ref.create({"base": result[0][0].value - counted})
+    except AlreadyExists:
+        pass
@@ -0,0 +1,407 @@
+import asyncio
+import copy
+import json
+import re
+import sqlite3
+import threading
+import uuid
+
+from google.api_core.exceptions import AlreadyExists, NotFound
+from google.cloud.firestore_v1.transforms import Increment
+
+# Secondary indexes of each collection, as tuples of document fields. Every
+# index starts with the parent document, so queries on subcollections use them
+# too.
+INDEXES = {
+    "event_info": [("chat_id", "start_date"), ("chat_id", "message_id")],
+    "message_log": [("chat_id", "message_id")],
+    "chat_turns": [("index",)],
+}
+
+FIELD = re.compile(r"^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$")
+OPERATORS = {"==", "!=", "<", "<=", ">", ">="}
+
+
+def field_sql(field):
+    """Returns the SQL expression of a field, __name__ being the document ID."""
+    if field == "__name__":
+        return "id"
+    if not FIELD.match(field):
+        raise ValueError(f"Unsupported field path {field!r}")
+    return f"json_extract(data, '$.{field}')"
+
+
+def nested_get(data, field):
+    """Returns the value of a dotted field path, raising KeyError if it is missing."""
+    for key in field.split("."):
+        if not isinstance(data, dict) or key not in data:
+            raise KeyError(field)
+        data = data[key]
+    return data
+
+
+def nested_apply(data, field, value):
+    """Sets a dotted field path in place, applying Increment transforms."""
+    keys = field.split(".")
+    for key in keys[:-1]:
+        if not isinstance(data.get(key), dict):
+            data[key] = {}
+        data = data[key]
+    if isinstance(value, Increment):
+        value = (data.get(keys[-1]) or 0) + value.value
+    data[keys[-1]] = value
+
+
+def nested_merge(data, values):
+    """Merges values into a document in place, recursing into maps like set(merge=True)."""
+    for key, value in values.items():
+        if isinstance(value, dict) and value:
+            if not isinstance(data.get(key), dict):
+                data[key] = {}
+            nested_merge(data[key], value)
+        elif isinstance(value, Increment):
+            data[key] = (data.get(key) or 0) + value.value
+        else:
+            data[key] = value
+
+
+class SQLiteClient:
+    """Local storage backend, with the part of the async Firestore client the bot uses.
+
+    Documents are stored as JSON, one table per collection (subcollections of
+    all parents share a table), with the indexes in INDEXES. Every call runs
+    in a worker thread over a single connection, so the event loop is never
+    blocked on disk.
+    """
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.lock = threading.Lock()
+        self.tables = set()
+
+    def collection(self, name):
+        return CollectionReference(self, name, None)
+
+    def batch(self):
+        return WriteBatch(self)
+
+    def table(self, name):
+        """Creates the table of a collection and its indexes on first use."""
+        if name in self.tables:
+            return name
+        if not re.match(r"^\w+$", name):
+            raise ValueError(f"Unsupported collection name {name!r}")
+
+        self.connection.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} "
+            "(parent TEXT NOT NULL, id TEXT NOT NULL, data TEXT NOT NULL, "
+            "PRIMARY KEY (parent, id))"
+        )
+        for fields in INDEXES.get(name, []):
+            columns = ", ".join(field_sql(field) for field in fields)
+            self.connection.execute(
+                f"CREATE INDEX IF NOT EXISTS {name}_{'_'.join(fields)} "
+                f"ON {name} (parent, {columns})"
+            )
+        self.connection.commit()
+        self.tables.add(name)
+        return name
+
+    async def run(self, function, *args):
+        """Runs a function on the connection in a worker thread."""
+
+        def locked():
+            with self.lock:
+                return function(*args)
+
+        return await asyncio.to_thread(locked)
+
+    def read(self, table, parent, doc_id):
+        row = self.connection.execute(
+            f"SELECT data FROM {self.table(table)} WHERE parent = ? AND id = ?",
+            (parent, doc_id),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def write(self, table, parent, doc_id, data):
+        self.connection.execute(
+            f"INSERT OR REPLACE INTO {self.table(table)} (parent, id, data) "
+            "VALUES (?, ?, ?)",
+            (parent, doc_id, json.dumps(data)),
+        )
+
+    def apply(self, operation, reference, data=None):
+        """Applies a single write operation, without committing."""
+        table, parent, doc_id = (
+            reference.parent.id,
+            reference.parent.parent_path,
+            reference.id,
+        )
+        if operation == "delete":
+            self.connection.execute(
+                f"DELETE FROM {self.table(table)} WHERE parent = ? AND id = ?",
+                (parent, doc_id),
+            )
+            return
+
+        current = self.read(table, parent, doc_id)
+        if operation == "create" and current is not None:
+            raise AlreadyExists(f"Document already exists: {reference.path}")
+        if operation == "update" and current is None:
+            raise NotFound(f"No document to update: {reference.path}")
+
+        if operation == "merge":
+            document = current or {}
+            nested_merge(document, data)
+        elif operation == "update":
+            document = current
+            for field, value in data.items():
+                nested_apply(document, field, value)
+        else:
+            document = {}
+            for field, value in data.items():
+                document[field] = value.value if isinstance(value, Increment) else value
+        self.write(table, parent, doc_id, document)
+
+    def commit(self, operations):
+        """Applies write operations in a single transaction."""
+        try:
+            for operation in operations:
+                self.apply(*operation)
+            self.connection.commit()
+        except Exception:
+            self.connection.rollback()
+            raise
+
+
+class DocumentSnapshot:
+    def __init__(self, reference, data, fields=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        if data is not None and fields is not None:
+            data = {field: data[field] for field in fields if field in data}
+        self._data = data
+
+    def to_dict(self):
+        return copy.deepcopy(self._data)
+
+    def get(self, field):
+        return copy.deepcopy(nested_get(self._data or {}, field))
+
+
+class DocumentReference:
+    def __init__(self, client, parent, doc_id):
+        self.client = client
+        self.parent = parent
+        self.id = doc_id
+        self.path = f"{parent.path}/{doc_id}"
+
+    def collection(self, name):
+        return CollectionReference(self.client, name, self)
+
+    async def get(self):
+        data = await self.client.run(
+            self.client.read, self.parent.id, self.parent.parent_path, self.id
+        )
+        return DocumentSnapshot(self, data)
+
+    async def create(self, data):
+        await self.client.run(self.client.commit, [("create", self, data)])
+
+    async def set(self, data, merge=False):
+        operation = "merge" if merge else "set"
+        await self.client.run(self.client.commit, [(operation, self, data)])
+
+    async def update(self, data):
+        await self.client.run(self.client.commit, [("update", self, data)])
+
+    async def delete(self):
+        await self.client.run(self.client.commit, [("delete", self)])
+
+
+class WriteBatch:
+    def __init__(self, client):
+        self.client = client
+        self.operations = []
+
+    def create(self, reference, data):
+        self.operations.append(("create", reference, data))
+
+    def set(self, reference, data, merge=False):
+        self.operations.append(("merge" if merge else "set", reference, data))
+
+    def update(self, reference, data):
+        self.operations.append(("update", reference, data))
+
+    def delete(self, reference):
+        self.operations.append(("delete", reference))
+
+    async def commit(self):
+        await self.client.run(self.client.commit, self.operations)
+
+
+class AggregationResult:
+    def __init__(self, value):
+        self.alias = "count"
+        self.value = value
+
+
+class AggregationQuery:
+    def __init__(self, query):
+        self.query = query
+
+    async def get(self):
+        rows = await self.query.client.run(self.query.fetch, "COUNT(*)", False)
+        return [[AggregationResult(rows[0][0])]]
+
+
+class Query:
+    def __init__(self, client, collection):
+        self.client = client
+        self.collection = collection
+        self.filters = []
+        self.orders = []
+        self.fields = None
+        self.limit_count = None
+        self.from_end = False
+        self.start = None
+        self.end = None
+
+    def copy(self, **changes):
+        query = copy.copy(self)
+        query.filters = list(self.filters)
+        query.orders = list(self.orders)
+        for name, value in changes.items():
+            setattr(query, name, value)
+        return query
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = (
+                filter.field_path,
+                filter.op_string,
+                filter.value,
+            )
+        if op_string not in OPERATORS and op_string != "in":
+            raise ValueError(f"Unsupported operator {op_string!r}")
+        query = self.copy()
+        query.filters.append((field_path, op_string, value))
+        return query
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        query = self.copy()
+        query.orders.append((field_path, direction == "DESCENDING"))
+        return query
+
+    def select(self, field_paths):
+        return self.copy(fields=list(field_paths))
+
+    def limit(self, count):
+        return self.copy(limit_count=count, from_end=False)
+
+    def limit_to_last(self, count):
+        return self.copy(limit_count=count, from_end=True)
+
+    def start_at(self, values):
+        return self.copy(start=(values, True))
+
+    def start_after(self, values):
+        return self.copy(start=(values, False))
+
+    def end_before(self, values):
+        return self.copy(end=(values, False))
+
+    def end_at(self, values):
+        return self.copy(end=(values, True))
+
+    def count(self):
+        return AggregationQuery(self)
+
+    def sql(self, columns, reverse=False):
+        """Compiles the query into SQL and its parameters."""
+        table = self.client.table(self.collection.id)
+        conditions = ["parent = ?"]
+        parameters = [self.collection.parent_path]
+
+        for field, op, value in self.filters:
+            if op == "in":
+                conditions.append(
+                    f"{field_sql(field)} IN ({', '.join('?' * len(value))})"
+                )
+                parameters += list(value)
+            elif value is None:
+                conditions.append(
+                    f"{field_sql(field)} IS {'NOT ' if op == '!=' else ''}NULL"
+                )
+            else:
+                conditions.append(f"{field_sql(field)} {'=' if op == '==' else op} ?")
+                parameters.append(value)
+
+        # like Firestore, results are ordered by document ID last
+        orders = list(self.orders)
+        if not any(field == "__name__" for field, _ in orders):
+            orders.append(("__name__", orders[-1][1] if orders else False))
+
+        for cursor, is_start in ((self.start, True), (self.end, False)):
+            if cursor is None:
+                continue
+            values, inclusive = cursor
+            fields = [field for field, _ in orders if field in values]
+            if len({descending for _, descending in orders[: len(fields)]}) > 1:
+                raise ValueError("Cursors need every ordering in the same direction")
+            # past the start in the order of the query, before the end
+            after = is_start != orders[0][1]
+            op = (">" if after else "<") + ("=" if inclusive else "")
+            conditions.append(
+                f"({', '.join(field_sql(field) for field in fields)}) {op} "
+                f"({', '.join('?' * len(fields))})"
+            )
+            parameters += [values[field] for field in fields]
+
+        sql = f"SELECT {columns} FROM {table} WHERE {' AND '.join(conditions)}"
+        if columns != "COUNT(*)":
+            sql += " ORDER BY " + ", ".join(
+                f"{field_sql(field)} {'DESC' if descending != reverse else 'ASC'}"
+                for field, descending in orders
+            )
+            if self.limit_count is not None:
+                sql += f" LIMIT {int(self.limit_count)}"
+        return sql, parameters
+
+    def fetch(self, columns, reverse):
+        """Runs the query on the connection, called in the worker thread."""
+        sql, parameters = self.sql(columns, reverse)
+        return self.client.connection.execute(sql, parameters).fetchall()
+
+    async def get(self):
+        reverse = self.from_end and self.limit_count is not None
+        rows = await self.client.run(self.fetch, "id, data", reverse)
+        if reverse:
+            rows.reverse()
+        return [
+            DocumentSnapshot(
+                self.collection.document(doc_id), json.loads(data), self.fields
+            )
+            for doc_id, data in rows
+        ]
+
+    async def stream(self):
+        for doc in await self.get():
+            yield doc
+
+
+class CollectionReference(Query):
+    def __init__(self, client, name, parent):
+        super().__init__(client, self)
+        self.id = name
+        self.parent = parent
+        self.parent_path = parent.path if parent is not None else ""
+        self.path = f"{self.parent_path}/{name}" if parent is not None else name
+
+    def document(self, doc_id=None):
+        return DocumentReference(
+            self.client, self, doc_id if doc_id is not None else uuid.uuid4().hex[:20]
+        )
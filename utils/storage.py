@@ -0,0 +1,52 @@
+import json
+
+from google.api_core.exceptions import (
+    Aborted,
+    DeadlineExceeded,
+    InternalServerError,
+    ResourceExhausted,
+    ServiceUnavailable,
+)
+from utils.storage_metrics import instrument_storage
+from config import (
+    STORAGE_BACKEND,
+    SQLITE_PATH,
+    FIREBASE_TOKEN,
+    STORAGE_INSTRUMENTATION,
+)
+
+# errors of a write worth sending it again for
+TRANSIENT_ERRORS = (
+    Aborted,
+    DeadlineExceeded,
+    InternalServerError,
+    ResourceExhausted,
+    ServiceUnavailable,
+)
+
+
+def storage_client():
+    """Creates the storage client chosen by STORAGE_BACKEND.
+
+    Both backends offer the same interface, the part of the async Firestore
+    client used by the handlers: the user_records documents (with their
+    chat_turns), message_log, event_info, batched writes and count queries for
+    the stats. "firestore" connects to Firestore, "sqlite" stores everything in
+    a local SQLite database at SQLITE_PATH, for development, CI and
+    single-node deployments. With STORAGE_INSTRUMENTATION the client is
+    wrapped to count the operations of every update.
+
+    Returns:
+        The storage client, passed to the handlers as db.
+    """
+    if STORAGE_BACKEND == "sqlite":
+        from utils.sqlite_store import SQLiteClient
+
+        db = SQLiteClient(SQLITE_PATH)
+    else:
+        from firebase_admin import initialize_app, credentials, firestore_async
+
+        initialize_app(credentials.Certificate(json.loads(FIREBASE_TOKEN)))
+        db = firestore_async.client()
+
+    return instrument_storage(db) if STORAGE_INSTRUMENTATION else db
@@ -0,0 +1,250 @@
+import contextvars
+import inspect
+import sys
+import time
+
+from utils.metrics import increment, observe
+from config import CHAT_WINDOW_MESSAGES, CHAT_SUMMARY_BATCH
+
+# Storage operations an update of each type may cost once the user's caches
+# are warm, for a user with a few dozen events: what the handlers need, plus a
+# margin of one. Reads are documents read, writes documents written (batches
+# count every write in them). A chat turn of a cached session writes nothing,
+# a chat_resume turn first reads the session, with the turns not summarized
+# yet, from storage.
+STORAGE_BUDGETS = {
+    "text": {"reads": 2, "writes": 5, "queries": 1},
+    "photo": {"reads": 2, "writes": 5, "queries": 1},
+    "callback": {"reads": 3, "writes": 4, "queries": 2},
+    "chat": {"reads": 2, "writes": 1, "queries": 1},
+    "chat_resume": {
+        "reads": 2 + CHAT_WINDOW_MESSAGES + CHAT_SUMMARY_BATCH,
+        "writes": 1,
+        "queries": 2,
+    },
+}
+
+# Kind of object returned by the calls on each kind of wrapped object, calls
+# not listed here return plain values
+NEXT_KIND = {
+    ("client", "collection"): "query",
+    ("client", "batch"): "batch",
+    ("document", "collection"): "query",
+    ("query", "document"): "document",
+    ("query", "count"): "aggregation",
+}
+QUERY_METHODS = {
+    "where",
+    "order_by",
+    "select",
+    "limit",
+    "limit_to_last",
+    "offset",
+    "start_at",
+    "start_after",
+    "end_before",
+    "end_at",
+}
+WRITE_METHODS = {"create", "set", "update", "delete"}
+
+# usage of the update being handled, see storage_update_begin
+current_update = contextvars.ContextVar("current_update", default=None)
+
+
+class Instrumented:
+    """Wraps a storage client, or an object returned by it, to count its operations.
+
+    Every document read or write, query and batch commit is counted, with
+    its latency, against the current update (if any) and the function that
+    made the call. Objects passed back into the client are unwrapped, so the
+    wrapped client can be used everywhere the plain one is.
+    """
+
+    def __init__(self, target, kind):
+        self.target = target
+        self.kind = kind
+        self.batch_writes = 0
+
+    def __getattr__(self, name):
+        value = getattr(self.target, name)
+        if not callable(value):
+            return value
+
+        def method(*args, **kwargs):
+            return storage_call(self, name, value, args, kwargs)
+
+        return method
+
+
+def instrument_storage(db):
+    """Wraps a storage client so its operations are counted.
+
+    Args:
+        db: Firestore or SQLite client instance.
+
+    Returns:
+        Instrumented: The wrapped client.
+    """
+    return Instrumented(db, "client")
+
+
+def unwrap(value):
+    """Returns the wrapped object of an Instrumented value, other values as they are."""
+    return value.target if isinstance(value, Instrumented) else value
+
+
+def storage_call(proxy, name, method, args, kwargs):
+    """Calls a method of a wrapped object, counting it if it is an operation."""
+    # the caller of the wrapped method, two frames up
+    handler = sys._getframe(2).f_code.co_name
+    args = [unwrap(arg) for arg in args]
+    kwargs = {key: unwrap(value) for key, value in kwargs.items()}
+
+    if proxy.kind == "batch" and name in WRITE_METHODS:
+        proxy.batch_writes += 1
+
+    result = method(*args, **kwargs)
+
+    if inspect.isasyncgen(result):
+        return measured_stream(result, handler)
+    if inspect.isawaitable(result):
+        return measured(proxy, name, result, handler)
+
+    kind = NEXT_KIND.get((proxy.kind, name))
+    if kind is None and proxy.kind == "query" and name in QUERY_METHODS:
+        kind = "query"
+    return Instrumented(result, kind) if kind else result
+
+
+async def measured(proxy, name, awaitable, handler):
+    """Awaits an operation and records what it cost."""
+    start = time.perf_counter()
+    result = await awaitable
+    seconds = time.perf_counter() - start
+
+    if proxy.kind == "batch":
+        storage_record(handler, "writes", proxy.batch_writes, seconds)
+    elif proxy.kind == "document":
+        operation = "reads" if name == "get" else "writes"
+        storage_record(handler, operation, 1, seconds)
+    elif proxy.kind == "aggregation":
+        storage_record(handler, "queries", 1, seconds, reads=1)
+    elif proxy.kind == "query":
+        # Firestore bills a query that matches nothing as one read
+        storage_record(handler, "queries", 1, seconds, reads=max(len(result), 1))
+    return result
+
+
+async def measured_stream(stream, handler):
+    """Iterates a streamed query and records what it cost."""
+    start = time.perf_counter()
+    count = 0
+    async for doc in stream:
+        count += 1
+        yield doc
+    storage_record(
+        handler, "queries", 1, time.perf_counter() - start, reads=max(count, 1)
+    )
+
+
+def storage_record(handler, operation, amount, seconds, reads=0):
+    """Records an operation in the metrics and in the usage of the current update.
+
+    Args:
+        handler (str): Name of the function that made the call.
+        operation (str): "reads", "writes" or "queries".
+        amount (int): Number of operations.
+        seconds (float): Latency of the call.
+        reads (int, optional): Documents read by a query. Defaults to 0.
+    """
+    usage = current_update.get()
+    update_type = usage["type"] if usage else "background"
+    costs = {operation: amount}
+    if reads:
+        costs["reads"] = reads
+
+    for name, value in costs.items():
+        increment(f"storage.{update_type}.{name}", value)
+        increment(f"storage.handler.{handler}.{name}", value)
+    observe(f"storage.latency.{operation}", seconds)
+
+    if usage:
+        for name, value in costs.items():
+            usage[name] += value
+        usage["seconds"] += seconds
+        handler_usage = usage["handlers"].setdefault(
+            handler, {"reads": 0, "writes": 0, "queries": 0}
+        )
+        for name, value in costs.items():
+            handler_usage[name] += value
+
+
+def storage_update_begin(update_type):
+    """Starts counting the storage operations of an update.
+
+    Operations of tasks started during the update count towards it too, but
+    only those finished by storage_update_end are checked against the budget.
+
+    Args:
+        update_type (str): "text", "photo", "callback", "chat" or
+                           "chat_resume".
+
+    Returns:
+        contextvars.Token: Token to pass to storage_update_end.
+    """
+    return current_update.set(
+        {
+            "type": update_type,
+            "reads": 0,
+            "writes": 0,
+            "queries": 0,
+            "seconds": 0.0,
+            "handlers": {},
+        }
+    )
+
+
+def storage_update_tag(update_type):
+    """Changes the type of the current update, once it is known.
+
+    Args:
+        update_type (str): "text", "photo", "callback", "chat" or
+                           "chat_resume".
+    """
+    usage = current_update.get()
+    if usage:
+        usage["type"] = update_type
+
+
+def storage_update_end(token):
+    """Stops counting the storage operations of an update and checks its budget.
+
+    The cost of the update is recorded per update type. Operations over the
+    STORAGE_BUDGETS of the update type are counted and printed, along with
+    the handlers that made them.
+
+    Args:
+        token (contextvars.Token): Token returned by storage_update_begin.
+
+    Returns:
+        dict: Usage of the update, with "over_budget" listing the exceeded
+              operations.
+    """
+    usage = current_update.get()
+    current_update.reset(token)
+
+    update_type = usage["type"]
+    for name in ("reads", "writes", "queries", "seconds"):
+        observe(f"storage.update.{update_type}.{name}", usage[name])
+
+    budget = STORAGE_BUDGETS.get(update_type, {})
+    usage["over_budget"] = [
+        name for name, limit in budget.items() if usage[name] > limit
+    ]
+    if usage["over_budget"]:
+        increment(f"storage.over_budget.{update_type}")
+        print(
+            f"Storage budget of a {update_type} update exceeded "
+            f"({', '.join(usage['over_budget'])}) : {usage['handlers']}"
+        )
+    return usage
@@ -1,7 +1,6 @@
-from io import BytesIO
-from PIL.Image import open as img_open
 from config import TOKEN
 from utils.weather_info import coordinates_retriever
+from utils.image_processing import preprocess_in_pool
 
 
 async def send_msg(
@@ -156,11 +155,12 @@ async def edit_msg(
     received_message_id=None,
     reply_markup=None,
     parse_mode=None,
+    plain_text=None,
 ):
     """Edits a previously sent message with new text and optional markup.
 
     This function attempts to edit a message with new text content and optional
-    inline keyboard markup, retrying without Markdown parsing if the initial
+    inline keyboard markup, retrying once without Markdown parsing if the initial
     attempt fails.
 
     Args:
@@ -174,6 +174,8 @@ async def edit_msg(
                                         Defaults to None.
         parse_mode (str, optional): Text parsing mode (e.g., "MarkdownV2").
                                      Defaults to None.
+        plain_text (str, optional): Unescaped text sent on the retry without
+                                    parsing mode. Defaults to None, the text.
 
     Returns:
         httpx.Response or None: The response object from the Telegram API if
@@ -197,15 +199,15 @@ async def edit_msg(
 
         response = await session.post(url, json=payload)
 
-        if response.status_code != 200:
+        if response.status_code != 200 and parse_mode is not None:
             print("Error : ", response.text)
 
             # try without parsing mode
-            await edit_msg(
+            return await edit_msg(
                 session,
                 chat_id,
                 sent_message_id,
-                text,
+                plain_text if plain_text is not None else text,
                 received_message_id,
                 reply_markup,
                 None,
@@ -355,14 +357,17 @@ async def send_venue(session, chat_id, location):
 
 
 async def image_downloader(session, file_id):
-    """Downloads an image from Telegram using its file ID.
+    """Downloads an image from Telegram using its file ID and preprocesses it.
+
+    The image is downscaled, re-encoded and trimmed in the process pool before
+    it is handed to Gemini, which keeps the upload size small.
 
     Args:
         session: httpx asynchronous client session object.
         file_id (str): Telegram file ID of the image.
 
     Returns:
-        PIL.Image.Image: The downloaded image as a PIL Image object.
+        dict: The preprocessed image as an inline blob ({"mime_type", "data"}).
     """
     file_path_response = await session.get(
         f"https://api.telegram.org/bot{TOKEN}/getFile?file_id={file_id}"
@@ -372,7 +377,6 @@ async def image_downloader(session, file_id):
     image_url = f"https://api.telegram.org/file/bot{TOKEN}/{file_path}"
     image_response = await session.get(image_url, timeout=10.0)
 
-    image_bytes = BytesIO(image_response.content)
-    image = img_open(image_bytes)
+    image = await preprocess_in_pool(image_response.content)
 
     return image
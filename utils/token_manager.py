@@ -0,0 +1,277 @@
+import asyncio
+import datetime
+import time
+from collections import OrderedDict
+
+from utils.user_context import user_context_data
+from utils.metrics import increment, observe
+from config import (
+    CAL_CLIENT_ID,
+    CAL_CLIENT_SECRET,
+    TOKEN_CACHE_MAX_USERS,
+    TOKEN_REFRESH_AHEAD,
+    TOKEN_EXPIRY_MARGIN,
+    TOKEN_REFRESH_INTERVAL,
+    TOKEN_ACTIVE_WINDOW,
+)
+
+TOKEN_URL = "https://oauth2.googleapis.com/token"
+
+# chat_id -> {access_token, refresh_token, expiry, used}, least recently used
+# first. expiry is a Unix timestamp (None when unknown), used the monotonic
+# time of the last request made with the token.
+tokens = OrderedDict()
+
+# chat_id -> task refreshing the user's access token, shared by every request
+# that needs the new token
+refreshes = {}
+
+
+def expiry_timestamp(expiry):
+    """Converts the expiry of OAuth credentials (a naive UTC datetime) to a Unix timestamp."""
+    if expiry is None:
+        return None
+    return expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+def token_store(chat_id, access_token, refresh_token, expiry):
+    """Caches the tokens of a user.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        access_token (str): Google access token.
+        refresh_token (str): Google refresh token.
+        expiry (float, optional): Unix timestamp the access token expires at,
+                                  None if unknown.
+
+    Returns:
+        dict: The cached entry.
+    """
+    entry = tokens.get(chat_id)
+    used = entry["used"] if entry else time.monotonic()
+    tokens[chat_id] = {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "expiry": expiry,
+        "used": used,
+    }
+    tokens.move_to_end(chat_id)
+    while len(tokens) > TOKEN_CACHE_MAX_USERS:
+        tokens.popitem(last=False)
+    return tokens[chat_id]
+
+
+def token_forget(chat_id):
+    """Drops the cached tokens of a user, once their calendar is unlinked.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+    """
+    tokens.pop(chat_id, None)
+
+
+async def fetch_token(db, session, chat_id, refresh_token):
+    """Gets a new access token from Google and stores it with its expiry.
+
+    The token is cached and written to the user's document, so it survives
+    restarts.
+
+    Args:
+        db: Firestore client instance.
+        session: httpx asynchronous client session object.
+        chat_id (int): Telegram chat ID of the user.
+        refresh_token (str): The user's refresh token.
+
+    Returns:
+        str or None: The new access token, or None if the refresh failed.
+    """
+    start = time.perf_counter()
+    try:
+        response = await session.post(
+            TOKEN_URL,
+            data={
+                "grant_type": "refresh_token",
+                "refresh_token": refresh_token,
+                "client_id": CAL_CLIENT_ID,
+                "client_secret": CAL_CLIENT_SECRET,
+            },
+        )
+    except Exception as e:
+        print(f"Error refreshing access token : {e}")
+        increment("tokens.refresh_errors")
+        return None
+    observe("tokens.refresh_duration", time.perf_counter() - start)
+
+    if response.status_code != 200:
+        print(f"Error refreshing access token : {response.text}")
+        increment("tokens.refresh_errors")
+        # a revoked refresh token will not work again
+        if response.status_code == 400:
+            token_forget(chat_id)
+        return None
+
+    data = response.json()
+    access_token = data["access_token"]
+    expiry = time.time() + data.get("expires_in", 3600)
+    refresh_token = data.get("refresh_token", refresh_token)
+    token_store(chat_id, access_token, refresh_token, expiry)
+
+    fields = {
+        "access_token": access_token,
+        "refresh_token": refresh_token,
+        "token_expiry": expiry,
+    }
+    try:
+        await db.collection("user_records").document(str(chat_id)).update(fields)
+    except Exception as e:
+        print(f"Error saving refreshed access token : {e}")
+
+    return access_token
+
+
+def refresh_task(db, session, chat_id, refresh_token):
+    """Returns the task refreshing a user's access token, starting it if none is running.
+
+    Args:
+        db: Firestore client instance.
+        session: httpx asynchronous client session object.
+        chat_id (int): Telegram chat ID of the user.
+        refresh_token (str): The user's refresh token.
+
+    Returns:
+        asyncio.Task: Task resolving to the new access token, or None.
+    """
+    task = refreshes.get(chat_id)
+    if task is not None:
+        increment("tokens.refresh_joins")
+        return task
+
+    task = asyncio.create_task(fetch_token(db, session, chat_id, refresh_token))
+    refreshes[chat_id] = task
+
+    def done(finished):
+        if refreshes.get(chat_id) is finished:
+            del refreshes[chat_id]
+
+    task.add_done_callback(done)
+    increment("tokens.refreshes")
+    return task
+
+
+async def token_refresh(db, session, chat_id, refresh_token):
+    """Refreshes a user's access token, sharing a refresh that is already running.
+
+    Args:
+        db: Firestore client instance.
+        session: httpx asynchronous client session object.
+        chat_id (int): Telegram chat ID of the user.
+        refresh_token (str): The user's refresh token.
+
+    Returns:
+        str or None: The new access token, or None if the refresh failed.
+    """
+    # a cancelled request must not cancel the refresh the others wait for
+    return await asyncio.shield(refresh_task(db, session, chat_id, refresh_token))
+
+
+async def token_get(session, context):
+    """Returns a valid access token of the user, from memory when possible.
+
+    The tokens are read from the user's document the first time. A token
+    within TOKEN_REFRESH_AHEAD seconds of its expiry is still returned, while
+    a new one is fetched in the background. Only a token that expired, or is
+    about to, makes the caller wait for the refresh.
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+
+    Returns:
+        str or None: The access token, None if the user has no tokens.
+    """
+    chat_id = context["chat_id"]
+    entry = tokens.get(chat_id)
+    if entry is None:
+        doc = await user_context_data(context)
+        if not doc.get("refresh_token"):
+            return doc.get("access_token")
+        # documents stored before expiries were kept have none, their
+        # token is refreshed on first use
+        entry = token_store(
+            chat_id,
+            doc["access_token"],
+            doc["refresh_token"],
+            doc.get("token_expiry"),
+        )
+    else:
+        tokens.move_to_end(chat_id)
+
+    entry["used"] = time.monotonic()
+    remaining = (entry["expiry"] or 0) - time.time()
+
+    if remaining < TOKEN_EXPIRY_MARGIN:
+        increment("tokens.refresh_waits")
+        access_token = await token_refresh(
+            context["db"], session, chat_id, entry["refresh_token"]
+        )
+        return access_token or entry["access_token"]
+
+    if remaining < TOKEN_REFRESH_AHEAD:
+        refresh_task(context["db"], session, chat_id, entry["refresh_token"])
+
+    increment("tokens.cache_hits")
+    return entry["access_token"]
+
+
+async def token_rejected(session, context, access_token):
+    """Gets a new access token after Google rejected one with a 401.
+
+    If the token was already replaced by another request, the new one is
+    returned without refreshing again.
+
+    Args:
+        session: httpx asynchronous client session object.
+        context (dict): Context of the user for this update.
+        access_token (str): The rejected access token.
+
+    Returns:
+        str or None: The new access token, or None if the refresh failed.
+    """
+    chat_id = context["chat_id"]
+    entry = tokens.get(chat_id)
+    if entry is not None and entry["access_token"] != access_token:
+        return entry["access_token"]
+
+    if entry is not None:
+        refresh_token = entry["refresh_token"]
+    else:
+        refresh_token = (await user_context_data(context)).get("refresh_token")
+    if not refresh_token:
+        return None
+    return await token_refresh(context["db"], session, chat_id, refresh_token)
+
+
+async def token_refresh_job(db, session):
+    """Background task refreshing the tokens of active users before they expire.
+
+    Every TOKEN_REFRESH_INTERVAL seconds, the tokens of the users who made a
+    Calendar request in the last TOKEN_ACTIVE_WINDOW seconds and that expire
+    within TOKEN_REFRESH_AHEAD seconds (plus the interval) are refreshed, so
+    their next request finds a valid token.
+
+    Args:
+        db: Firestore client instance.
+        session: httpx asynchronous client session object.
+    """
+    while True:
+        await asyncio.sleep(TOKEN_REFRESH_INTERVAL)
+        try:
+            now = time.monotonic()
+            deadline = time.time() + TOKEN_REFRESH_AHEAD + TOKEN_REFRESH_INTERVAL
+            for chat_id, entry in list(tokens.items()):
+                if now - entry["used"] > TOKEN_ACTIVE_WINDOW:
+                    continue
+                if (entry["expiry"] or 0) < deadline:
+                    refresh_task(db, session, chat_id, entry["refresh_token"])
+        except Exception as e:
+            print(f"Error in token_refresh_job {e}")
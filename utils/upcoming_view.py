@@ -0,0 +1,142 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+import datetime
+
+from config import UPCOMING_VIEW_MAX_USERS
+
+# chat_id -> {"keys", "events", "complete"}, least recently used first. keys
+# holds the (start_date, doc_id) of the user's first upcoming events in start
+# order, events maps their document IDs to the contents of their event_info
+# documents. complete is False when the user has more upcoming events than
+# were loaded, the view then only covers the events up to its last key.
+views = OrderedDict()
+
+
+def view_build(chat_id, events, complete=True):
+    """Builds the upcoming events view of a user.
+
+    The least recently used view is dropped once more than
+    UPCOMING_VIEW_MAX_USERS users have one.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        events (dict): Contents of the user's first upcoming event_info
+                       documents, keyed by document ID.
+        complete (bool, optional): Whether events holds all of the user's
+                                   upcoming events. Defaults to True.
+    """
+    views[chat_id] = {
+        "keys": sorted(
+            (event["start_date"], doc_id) for doc_id, event in events.items()
+        ),
+        "events": dict(events),
+        "complete": complete,
+    }
+
+    while len(views) > UPCOMING_VIEW_MAX_USERS:
+        views.popitem(last=False)
+
+
+def view_get(chat_id):
+    """Returns the upcoming events view of a user, without the events that passed.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+
+    Returns:
+        dict or None: The view, or None if it has not been built.
+    """
+    view = views.get(chat_id)
+    if view is None:
+        return None
+
+    views.move_to_end(chat_id)
+
+    # keys are in start order, so the passed events are at the front
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    passed = bisect_left(view["keys"], (today,))
+    if passed:
+        for _, doc_id in view["keys"][:passed]:
+            del view["events"][doc_id]
+        del view["keys"][:passed]
+    return view
+
+
+def view_add(chat_id, doc_id, event):
+    """Adds an event to the upcoming events view of a user, if the view is built.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        doc_id (str): Document ID of the event.
+        event (dict): Contents of the event_info document.
+    """
+    view = views.get(chat_id)
+    if view is None:
+        return
+
+    view_remove(chat_id, doc_id)
+    today = datetime.date.today().strftime("%Y-%m-%d")
+    if not event.get("start_date") or event["start_date"] < today:
+        return
+
+    key = (event["start_date"], doc_id)
+    if not view["complete"] and (not view["keys"] or key > view["keys"][-1]):
+        # beyond what the view covers
+        return
+    view["keys"].insert(bisect_left(view["keys"], key), key)
+    view["events"][doc_id] = event
+
+
+def view_remove(chat_id, doc_id):
+    """Removes an event from the upcoming events view of a user, if it is present.
+
+    Args:
+        chat_id (int): Telegram chat ID of the user.
+        doc_id (str): Document ID of the event.
+    """
+    view = views.get(chat_id)
+    if view is None or doc_id not in view["events"]:
+        return
+
+    event = view["events"].pop(doc_id)
+    key = (event["start_date"], doc_id)
+    del view["keys"][bisect_left(view["keys"], key)]
+
+
+def view_page(view, cursor=None, direction="at", page_size=10):
+    """Returns one page of an upcoming events view.
+
+    Args:
+        view (dict): View returned by view_get.
+        cursor (tuple, optional): (start_date, document ID) of an event.
+            Defaults to None, the first page.
+        direction (str, optional): "at" for the page starting at the cursor,
+            "after" for the page following it and "before" for the page
+            preceding it. Defaults to "at".
+        page_size (int, optional): Events per page. Defaults to 10.
+
+    Returns:
+        tuple or None: List of (document ID, event) tuples, and whether there
+                       are events before and after the page. None if the page
+                       reaches past what an incomplete view covers.
+    """
+    keys = view["keys"]
+    if cursor is None:
+        first = 0
+    elif direction == "after":
+        first = bisect_right(keys, tuple(cursor))
+    elif direction == "before":
+        first = max(bisect_left(keys, tuple(cursor)) - page_size, 0)
+    else:
+        first = bisect_left(keys, tuple(cursor))
+
+    if direction == "before" and cursor is not None:
+        last = bisect_left(keys, tuple(cursor))
+    else:
+        last = min(first + page_size, len(keys))
+
+    if not view["complete"] and last >= len(keys):
+        return None
+
+    page = [(doc_id, view["events"][doc_id]) for _, doc_id in keys[first:last]]
+    return page, first > 0, last < len(keys)
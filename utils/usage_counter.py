@@ -0,0 +1,125 @@
+import asyncio
+
+from utils.metrics import increment
+from utils.sharded_counter import user_counter, counter_increment, counter_value
+from utils.storage import TRANSIENT_ERRORS
+from config import USAGE_FLUSH_INTERVAL, USAGE_MAX_PENDING
+
+# writes Firestore accepts in a single batch
+BATCH_LIMIT = 500
+
+# chat_id -> uses not written to the no_of_uses counter yet
+pending_uses = {}
+flush_lock = asyncio.Lock()
+flush_task = None
+
+
+def count_use(db, chat_id):
+    """Counts a message of a user, to be added to no_of_uses on the next flush.
+
+    A flush is started right away once USAGE_MAX_PENDING users have pending
+    increments, which keeps most flushes within a single batch and bounds what
+    a crash can lose to one interval or USAGE_MAX_PENDING users.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+    """
+    global flush_task
+
+    pending_uses[chat_id] = pending_uses.get(chat_id, 0) + 1
+    if len(pending_uses) >= USAGE_MAX_PENDING and (
+        flush_task is None or flush_task.done()
+    ):
+        flush_task = asyncio.create_task(flush_uses(db))
+
+
+async def commit_uses(db, uses):
+    """Commits the no_of_uses increments of some users in one batch."""
+    batch = db.batch()
+    for chat_id, count in uses.items():
+        counter_increment(batch, user_counter(db, chat_id, "no_of_uses"), count)
+    await batch.commit()
+
+
+def requeue_uses(uses):
+    """Puts increments that could not be written back for the next flush."""
+    for chat_id, count in uses.items():
+        pending_uses[chat_id] = pending_uses.get(chat_id, 0) + count
+
+
+async def flush_uses(db):
+    """Writes the pending no_of_uses increments of all users.
+
+    Every user gets a single increment of their sharded no_of_uses counter,
+    however many messages they sent since the last flush, in batches of at
+    most BATCH_LIMIT users. A batch failing with a transient error is put
+    back for the next flush. On any other error its users are written one by
+    one, and only the increments that still fail are dropped, so a bad entry
+    is not retried forever.
+
+    Args:
+        db: Firestore client instance.
+    """
+    async with flush_lock:
+        if not pending_uses:
+            return
+
+        uses = list(pending_uses.items())
+        pending_uses.clear()
+
+        for i in range(0, len(uses), BATCH_LIMIT):
+            chunk = dict(uses[i : i + BATCH_LIMIT])
+            try:
+                await commit_uses(db, chunk)
+                increment("usage.flushes")
+                increment("usage.flushed_users", len(chunk))
+
+            except TRANSIENT_ERRORS as e:
+                requeue_uses(chunk)
+                print(f"Error in flush_uses {e}")
+
+            except Exception as e:
+                print(f"Error in flush_uses {e}")
+                for chat_id, count in chunk.items():
+                    try:
+                        await commit_uses(db, {chat_id: count})
+                        increment("usage.flushed_users")
+                    except TRANSIENT_ERRORS:
+                        requeue_uses({chat_id: count})
+                    except Exception as e:
+                        print(f"Dropped {count} uses of {chat_id} : {e}")
+                        increment("usage.dropped_users")
+
+
+async def usage_flusher(db):
+    """Background task writing the pending usage increments every interval.
+
+    Args:
+        db: Firestore client instance.
+    """
+    while True:
+        await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+        await flush_uses(db)
+
+
+async def user_uses(db, chat_id):
+    """Returns the number of messages a user has sent.
+
+    Adds the user's sharded no_of_uses counter, and what is still pending, to
+    the no_of_uses field of their record, which holds the uses counted before
+    the counter existed.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+
+    Returns:
+        int: Number of uses of the user.
+    """
+    doc, counted = await asyncio.gather(
+        db.collection("user_records").document(str(chat_id)).get(),
+        counter_value(user_counter(db, chat_id, "no_of_uses")),
+    )
+    recorded = (doc.to_dict() or {}).get("no_of_uses", 0) if doc.exists else 0
+    return recorded + counted + pending_uses.get(chat_id, 0)
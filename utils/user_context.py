@@ -0,0 +1,165 @@
+import asyncio
+
+from google.api_core.exceptions import AlreadyExists
+
+from utils.metrics import increment
+from utils.sharded_counter import (
+    global_counter,
+    user_counter,
+    counter_increment,
+)
+
+# chat_ids whose user_records document is known to exist
+known_users = set()
+KNOWN_USERS_MAX = 100_000
+
+
+def user_context(db, chat_id):
+    """Creates the context of a user for a single Telegram update.
+
+    The user's document is read at most once, the first time a handler needs
+    one of its fields. Handlers record their changes in the context and all of
+    them are written in one merged write by user_context_flush at the end of
+    the update.
+
+    Args:
+        db: Firestore client instance.
+        chat_id (int): Telegram chat ID of the user.
+
+    Returns:
+        dict: The context, to be passed through the handlers of the update.
+    """
+    return {
+        "db": db,
+        "doc_ref": db.collection("user_records").document(str(chat_id)),
+        "chat_id": chat_id,
+        "data": None,
+        "exists": None,
+        "create": None,
+        "dirty": {},
+        # concurrent handlers of the update share a single read
+        "lock": asyncio.Lock(),
+    }
+
+
+async def user_context_data(context):
+    """Returns the fields of the user's document, reading it on first use.
+
+    Args:
+        context (dict): Context returned by user_context.
+
+    Returns:
+        dict: Fields of the user's document, with the changes made during the
+              update applied. Empty if the user has no document.
+    """
+    async with context["lock"]:
+        if context["data"] is None:
+            doc = await context["doc_ref"].get()
+            increment("user_context.reads")
+            context["exists"] = doc.exists
+            context["data"] = doc.to_dict() if doc.exists else {}
+            if doc.exists:
+                remember_user(context["chat_id"])
+            context["data"].update(context["dirty"])
+    return context["data"]
+
+
+def user_context_set(context, fields):
+    """Records changes to fields of the user's document.
+
+    Args:
+        context (dict): Context returned by user_context.
+        fields (dict): Field names and their new values.
+    """
+    if context["data"] is not None:
+        context["data"].update(fields)
+    context["dirty"].update(fields)
+
+
+def user_context_known(context):
+    """Checks whether the user's document is known to exist, without reading it.
+
+    Args:
+        context (dict): Context returned by user_context.
+
+    Returns:
+        bool: True if the document was read during this update or earlier in
+              this process, or was created by it.
+    """
+    return bool(context["exists"]) or context["chat_id"] in known_users
+
+
+def user_context_create(context, fields, increments=None):
+    """Records the creation of the user's document, if it does not exist yet.
+
+    The document is created with a single create-if-absent write on flush, so
+    no read is needed to find out whether the user is new. If the document
+    turns out to exist, the recorded changes are applied to it instead.
+
+    Args:
+        context (dict): Context returned by user_context.
+        fields (dict): Fields of the new document.
+        increments (dict, optional): Increments of the user's sharded counters
+            to apply instead of the creation when the document already
+            exists. Defaults to None.
+    """
+    context["create"] = {"fields": fields, "increments": increments or {}}
+
+
+def remember_user(chat_id):
+    """Adds a user to known_users, clearing it once it reaches KNOWN_USERS_MAX."""
+    if len(known_users) >= KNOWN_USERS_MAX:
+        known_users.clear()
+    known_users.add(chat_id)
+
+
+async def user_context_flush(context):
+    """Writes all the changes recorded during the update in a single write.
+
+    A recorded creation is written with create(), in one batch with the
+    increment of the global users counter. The batch fails if the document
+    already exists, in which case the changes are written as an update, along
+    with the recorded counter increments.
+
+    Args:
+        context (dict): Context returned by user_context.
+
+    Raises:
+        Exception: If an error occurs during the process, prints the error
+            message to the console.
+    """
+    try:
+        db = context["db"]
+        changes = dict(context["dirty"])
+        create = context["create"]
+        batch = db.batch()
+        pending = False
+
+        if create:
+            try:
+                created = db.batch()
+                created.create(context["doc_ref"], {**create["fields"], **changes})
+                counter_increment(created, global_counter(db, "users"))
+                await created.commit()
+                changes = {}
+                increment("user_context.creates")
+            except AlreadyExists:
+                for name, amount in create["increments"].items():
+                    counter_increment(
+                        batch, user_counter(db, context["chat_id"], name), amount
+                    )
+                    pending = True
+            remember_user(context["chat_id"])
+
+        if changes:
+            batch.update(context["doc_ref"], changes)
+            increment("user_context.writes")
+            pending = True
+        if pending:
+            await batch.commit()
+
+        context["create"] = None
+        context["dirty"] = {}
+
+    except Exception as e:
+        print(f"Error in user_context_flush {e}")
@@ -1,14 +1,43 @@
 from utils.telegram_handlers import send_msg, edit_msg
-from utils.firebase_handlers import retrieve_upcoming_events
+from utils.firebase_handlers import (
+    retrieve_events_page,
+    retrieve_event,
+    event_to_list,
+)
 from utils.data_validation import date_cleaner, time_cleaner
-from utils.gcal_events import get_authenticated_service, delete_event_calendar
+from utils.gcal_events import delete_event_calendar
+from utils.event_index import index_remove
+from utils.upcoming_view import view_remove
+from utils.user_context import user_context_data
 
 
-async def view_upcoming_events(db, session, chat_id, sent_message_id, edit=False):
-    """Displays a list of upcoming events for a user.
+def page_anchor(doc_id, event):
+    """Encodes the cursor of an event for callback data, as "start_date|doc_id"."""
+    return f"{event['start_date']}|{doc_id}"
 
-    Retrieves upcoming events from Firestore, formats them into a message,
-    and sends it to the user. Includes inline buttons for viewing specific events.
+
+def parse_anchor(anchor):
+    """Decodes a cursor encoded by page_anchor.
+
+    Args:
+        anchor (str): Encoded cursor, an empty string for the first page.
+
+    Returns:
+        tuple or None: (start_date, document ID), or None for the first page.
+    """
+    if not anchor or "|" not in anchor:
+        return None
+    return tuple(anchor.split("|", 1))
+
+
+async def view_upcoming_events(
+    db, session, chat_id, sent_message_id, edit=False, cursor=None, direction="at"
+):
+    """Displays a page of the upcoming events of a user.
+
+    Retrieves one page of upcoming events from Firestore, formats them into a
+    message, and sends it to the user. Includes inline buttons for viewing
+    specific events and for moving to the previous and next pages.
 
     Args:
         db: Firestore client instance.
@@ -18,35 +47,54 @@ async def view_upcoming_events(db, session, chat_id, sent_message_id, edit=False
                                            Defaults to None.
         edit (bool, optional): Whether to edit an existing message or send
                                 a new one. Defaults to False.
+        cursor (tuple, optional): (start_date, document ID) the page is
+                                  relative to. Defaults to None, the first page.
+        direction (str, optional): "at", "after" or "before" the cursor.
+                                   Defaults to "at".
     """
     try:
-        result = retrieve_upcoming_events(db, chat_id)
+        result, has_previous, has_next = await retrieve_events_page(
+            db, chat_id, cursor, direction
+        )
+        if not result and cursor is not None:
+            # the events around the cursor are gone, start over
+            result, has_previous, has_next = await retrieve_events_page(db, chat_id)
         output_msg = None
         reply_markup = None
 
         # Formatting the events properly
         if result:
+            anchor = page_anchor(*result[0]) if has_previous else ""
             output_msg = "<b><u>Upcoming events are</u></b>\n"
-            for i in range(len(result)):
-                formatted_date = result[i][1]
-                formatted_message = f"\n{i+1}. <b>{result[i][0]}</b> on <i>{date_cleaner(formatted_date)}</i>"
+            reply_markup = {"inline_keyboard": []}
+            for i, (doc_id, event) in enumerate(result):
+                formatted_message = f"\n{i+1}. <b>{event['name']}</b> on <i>{date_cleaner(event['start_date'])}</i>"
                 output_msg += formatted_message
 
-            # Adding inline buttons to view specific events
-            reply_markup = {"inline_keyboard": [[]]}
-            number = len(result)
-            if number > 5:
-                reply_markup["inline_keyboard"].append([])
-
-            for i in range(number):
-                if i <= 4:
-                    reply_markup["inline_keyboard"][0].append(
-                        {"text": i + 1, "callback_data": f"Button {i}"}
-                    )
-                if i >= 5:
-                    reply_markup["inline_keyboard"][1].append(
-                        {"text": i + 1, "callback_data": f"Button {i}"}
-                    )
+                # Adding inline buttons to view specific events, 5 per row
+                if i % 5 == 0:
+                    reply_markup["inline_keyboard"].append([])
+                reply_markup["inline_keyboard"][-1].append(
+                    {"text": i + 1, "callback_data": f"E#{doc_id}|{anchor}"}
+                )
+
+            navigation = []
+            if has_previous:
+                navigation.append(
+                    {
+                        "text": "« Previous",
+                        "callback_data": f"EVP<{page_anchor(*result[0])}",
+                    }
+                )
+            if has_next:
+                navigation.append(
+                    {
+                        "text": "Next »",
+                        "callback_data": f"EVP>{page_anchor(*result[-1])}",
+                    }
+                )
+            if navigation:
+                reply_markup["inline_keyboard"].append(navigation)
         else:
             output_msg = "<b>No upcoming events</b>\nPlease schedule events using TimeSked to view it here !"
 
@@ -67,24 +115,31 @@ async def view_upcoming_events(db, session, chat_id, sent_message_id, edit=False
         print(f"An error has occurred in view_upcoming_events : {e}")
 
 
-async def view_specific_event(db, session, chat_id, sent_message_id, button_number):
+async def view_specific_event(db, session, chat_id, sent_message_id, doc_id, anchor=""):
     """Displays details of a specific event selected by the user.
 
-    Retrieves event details from Firestore based on the button number clicked,
-    formats the details, and sends them to the user with options to delete
-    the event or return to the event list.
+    Looks the event up by its document ID, formats the details,
+    and sends them to the user with options to delete the event or return to
+    the page of the event list it was selected from.
 
     Args:
         db: Firestore client instance.
         session: httpx asynchronous client session object.
         chat_id (int): Telegram chat ID of the user.
         sent_message_id (int): Message ID to edit with event details.
-        button_number (int): The index of the selected event from the list.
+        doc_id (str): Document ID of the selected event.
+        anchor (str, optional): Encoded cursor of the list page the event was
+                                selected from. Defaults to "", the first page.
     """
     try:
-        result = retrieve_upcoming_events(db, chat_id)
+        event = await retrieve_event(db, chat_id, doc_id)
+        if event is None:
+            await view_upcoming_events(
+                db, session, chat_id, sent_message_id, True, parse_anchor(anchor)
+            )
+            return
 
-        event_details = result[button_number]
+        event_details = event_to_list(doc_id, event)
         output_msg = "<b><u>Event Details</u></b>"
         output_msg += f"\n\n<b>Event name :</b> {event_details[0]}"
         output_msg += f"\n\n<b>Starting Date :</b> {date_cleaner(event_details[1])}"
@@ -110,13 +165,13 @@ async def view_specific_event(db, session, chat_id, sent_message_id, button_numb
                 [
                     {
                         "text": "🗑 Delete this event",
-                        "callback_data": f"D3L%{event_details[8]}",
+                        "callback_data": f"D3L%{event_details[8]}|{anchor}",
                     }
                 ],
                 [
                     {
                         "text": "<< Back to event list",
-                        "callback_data": "Back to event_list",
+                        "callback_data": f"EVA>{anchor}",
                     }
                 ],
             ]
@@ -133,16 +188,18 @@ async def view_specific_event(db, session, chat_id, sent_message_id, button_numb
         print(f"An error has occurred in view_specific_event function {e}")
 
 
-def delete_specific_event(db, chat_id, doc_id):
+async def delete_specific_event(db, session, chat_id, doc_id, context):
     """Deletes a specific event from both Google Calendar and Firestore.
 
-    Retrieves event ID from Firestore, deletes the event from Google Calendar
+    Looks up the event ID, deletes the event from Google Calendar
     (if it has an event ID), and then deletes the event document from Firestore.
 
     Args:
         db: Firestore client instance.
+        session: httpx asynchronous client session object.
         chat_id (int): Telegram chat ID of the user.
         doc_id (str): Document ID of the event in Firestore.
+        context (dict): Context of the user for this update.
 
     Returns:
         bool: True if the event was successfully deleted, False otherwise.
@@ -150,29 +207,21 @@ def delete_specific_event(db, chat_id, doc_id):
     try:
         event_id = None
 
-        col_ref = db.collection("event_info")
-        doc_ref = col_ref.document(doc_id)
-        doc = doc_ref.get()
-        if doc.exists:
-            event_id = doc.to_dict()["event_id"]
+        event = await retrieve_event(db, chat_id, doc_id)
+        if event is not None:
+            event_id = event["event_id"]
 
         if event_id == "None":
             event_id = None
 
         if event_id:
-            col_ref = db.collection("user_records")
-            doc = col_ref.document(str(chat_id)).get().to_dict()
-            calendar_id = doc["calendar_id"]
-            access_token = doc["access_token"]
-            refresh_token = doc["refresh_token"]
-
-            service = get_authenticated_service(
-                db, chat_id, access_token, refresh_token
-            )
-            delete_event_calendar(service, calendar_id, event_id)
+            calendar_id = (await user_context_data(context))["calendar_id"]
+            await delete_event_calendar(session, context, calendar_id, event_id)
 
         col_ref = db.collection("event_info")
-        col_ref.document(str(doc_id)).delete()
+        await col_ref.document(str(doc_id)).delete()
+        index_remove(chat_id, doc_id)
+        view_remove(chat_id, doc_id)
         return True
 
     except Exception as e: